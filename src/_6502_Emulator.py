@@ -13,11 +13,34 @@ https://www.mdawson.net/vic20chrome/cpu/mos_6500_mpu_preliminary_may_1976.pdf
 https://www.lihaoyi.com/post/BuildyourownCommandLinewithANSIescapecodes.html
 """
 
-import re
 import os
+import sys
 import time
 #import readline # only to fix bug on vs code which doesnt have internally this package
 
+from . import aot
+from . import assembler
+from . import breakpoints
+from . import bus
+from . import disassembler
+from . import idle
+from . import interpreter
+from . import jit
+from . import loader
+from . import snapshot
+
+TRAP_CODE = 0x01    # bit in pageTraps - translated code is on the page
+TRAP_CLEAN = 0x02   # bit in pageTraps - the page wasn't written since the last snapshot
+TRAP_DEVICE = bus.TRAP_DEVICE   # bit in pageTraps - the page is handled by a device (see bus.py)
+TRAP_WATCH = breakpoints.TRAP_WATCH     # bit in pageTraps - a watchpoint is on the page (see breakpoints.py)
+
+# ANSI escape codes of the console
+GREEN = u"\u001b[32;1m"
+YELLOW = u"\u001b[33;1m"
+CYAN = u"\u001b[36;1m"
+WHITE = u"\u001b[37;1m"
+RED = u"\u001b[31;1m"
+CLEAR_SCREEN = u"\u001b[H\u001b[2J"   # cursor to the top left corner, clear the screen
 
 class CPU():
     def __init__(self):
@@ -26,1057 +49,552 @@ class CPU():
         self.A = 0 # 8-bit
         self.X = 0 # 8-bit
         self.Y = 0 # 8-bit
-        self.PC = 0 # 16-bit
         self.S = 0 # 8-bit
         self.P = 0 # 8-bit
 
         self.resetVector = 0x8000 # starting address of the program
-
-        self.adrsMode = {"A":0,"abs":1,"abs,X":2, "imm":4,"imp":5,"rel":9}
-
-    # ---- GET FLAG METHODS ----
-    """ Following methods return value of flag in the status register """
-
-    def GetNegativeFlag(self):
-        if self.P & 0b10000000 != 0:
-            return 1
-        else:
-            return 0
-
-    def GetCarryFlag(self):
-        if self.P & 0b00000001 != 0:
-            return 1
-        else:
-            return 0
-
-    def GetZeroFlag(self):
-        if self.P & 0b00000010 != 0:
-            return 1
-        else:
-            return 0
-
-    # ---- SET FLAG METHODS ----
-    """ Following methods set flag in the status register to value (0 or 1) """
-
-    def SetNegativeFlag(self, value):
-        if value == 0:
-            self.P = self.P & 0b01111111
-        else:
-            self.P = self.P | 0b10000000
-        return
-
-    def SetZeroFlag(self, value):
-        if value == 0:
-            self.P = self.P & 0b11111101
-        else:
-            self.P = self.P | 0b00000010
-        return
-
-    def SetCarryFlag(self, value):
-        if value == 0:
-            self.P = self.P & 0b11111110
-        else:
-            self.P = self.P | 0b00000001
-        return
-
-    def SetOverflowFlag(self, value):
-        if value == 0:
-            self.P = self.P & 0b10111111
-        else:
-            self.P = self.P | 0b01000000
-        return
-
-    # ---- HELPER METHODS ----
-
-    def IsNegative(self, value):
-        """ Return True is value is negative in the two's complement view of the value """
-        if value & 0b10000000 != 0:
-            return True
-        else:
-            return False
-
-    def UpdateStatusRegister(self, n=None, z=None, c=None, i=None, d=None, v=None):
-        """ If parameter is 0 or 1, set flag to that value, if it is -1 check flag for Accumulator, if -2 check flag for X register, -3 for Y.
-            n - Negative flag
-            z - Zero flag
-            c - Carry flag
-            i - Interrupt flag
-            d - Decimal flag
-            v - Overflow flag
+        self.PC = self.resetVector # 16-bit
+
+        self.engine = "interpreter" # 'interpreter', 'jit' or 'aot'
+        self.fusion = True          # if the interpreter executes common groups of instructions at once (see opcodes.FUSIONS)
+        self.skipIdle = True        # if Run skips loops which wait forever (see idle.py)
+        self.instructions = 0       # number of executed instructions since Reset
+        self.cycles = 0             # number of cycles of the executed instructions since Reset
+        self.hostTime = 0.0         # seconds spent executing them
+        self.dispatchesSaved = 0    # number of dispatches of the interpreter saved by fusion
+        self.jit = None
+        self.aot = None
+        self.pageTraps = bytearray(0x100)   # for every page of memory bits of reasons why stores there go through TrappedWrite
+        self.codeWatchers = []              # objects with translated code (see jit.py), which has to be removed when the memory changes
+        self.loadCount = 0                  # number of loaded programs, so that translators know when the image is new
+        self.disassembler = disassembler.Disassembler(self)  # cache of the decoded instructions for Encode
+        self.snapshot = None                # last Snapshot taken or restored, memory is compared with it
+        self.dirtyPages = bytearray(0x100)  # 1 for every page written since the snapshot
+        self.screen = None                  # lines of the last debug screen, for redrawing only the changed ones
+        self.breakpoints = breakpoints.Breakpoints(self)    # breakpoints, watchpoints and stop conditions of the debugger
+        self.tracer = None                  # Tracer recording the executed instructions (see tracer.py), None when tracing is off
+        self.profiler = None                # Profiler counting the executed instructions (see profiler.py), None when profiling is off
+        self.bus = bus.Bus(self)            # page table with the devices mapped into memory (see bus.py)
+
+    # ---- MEMORY TRAPS ----
+
+    def TrappedWrite(self, address, value):
+        """ Writes value into memory on a page with a trap set, on a page of a device the device gets it instead.
+            Returns True if translated code was changed by the write or if the CPU has to stop (bus.exitCode is set).
         """
-        
-        if n != None:
-            if n == 0:
-                self.SetNegativeFlag(0)
-            elif n == 1:
-                self.SetNegativeFlag(1)
-            elif n == -1:
-                if self.IsNegative(self.A):
-                    self.SetNegativeFlag(1)
-                else:
-                    self.SetNegativeFlag(0)
-            elif n == -2:
-                if self.IsNegative(self.X):
-                    self.SetNegativeFlag(1)
-                else:
-                    self.SetNegativeFlag(0)
-            elif n == -3:
-                if self.IsNegative(self.Y):
-                    self.SetNegativeFlag(1)
-                else:
-                    self.SetNegativeFlag(0)
-
-        if z != None:
-            if z == 0:
-                self.SetZeroFlag(0)
-            elif z == 1:
-                self.SetZeroFlag(1)
-            elif z == -1:
-                if self.A == 0:
-                    self.SetZeroFlag(1)
-                else:
-                    self.SetZeroFlag(0)
-            elif z == -2:
-                if self.X == 0:
-                    self.SetZeroFlag(1)
-                else:
-                    self.SetZeroFlag(0)
-            elif z == -3:
-                if self.Y == 0:
-                    self.SetZeroFlag(1)
-                else:
-                    self.SetZeroFlag(0)
-
-        if c != None:
-            if c == 0:
-                self.SetCarryFlag(0)
-            elif c == 1:
-                self.SetCarryFlag(1)
-
-        if v != None:
-            if v == 0:
-                self.SetOverflowFlag(0)
-            elif v == 1:
-                self.SetOverflowFlag(1)
-
-        return
-
-    # ---- INSTRUCTION METHODS ----
-
-    def ADC(self, thisMode):
-        if thisMode == self.adrsMode["abs"]:
-            address = self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8)
-            value = self.RAM[address]
-            self.PC += 2
-        elif thisMode == self.adrsMode["imm"]:
-            value = self.RAM[self.PC+1]
-            self.PC += 1
-        elif thisMode == self.adrsMode["abs,X"]:
-            address = (self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8) + self.X) % 0x10000
-            value = self.RAM[address]
-            self.PC += 2
-
-        isANegative = self.IsNegative(self.A)
-        isValueNegative = self.IsNegative(value)
-
-        sum = self.A + value + self.GetCarryFlag()
-        self.A = sum % 0x100
-
-        if sum > 255:
-            cFlag = 1
-        else:
-            cFlag = 0
-
-        if isANegative == isValueNegative and isANegative != self.IsNegative(self.A):
-            vFlag = 1
-        else:
-            vFlag = 0
-
-        self.UpdateStatusRegister(n=-1, z=-1, c=cFlag, v=vFlag)
-        return
-
-    def AND(self, thisMode):
-        if thisMode == self.adrsMode["abs"]:
-            address = self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8)
-            value = self.RAM[address]
-            self.PC += 2
-        elif thisMode == self.adrsMode["imm"]:
-            value = self.RAM[self.PC+1]
-            self.PC += 1
-
-        self.A = self.A & value
-        self.UpdateStatusRegister(n=-1, z=-1)
-        return
-
-    def ASL(self, thisMode):
-        if thisMode == self.adrsMode["A"]:
-            if self.A & 0x80 != 0:
-                cFlag = 1
-            else:
-                cFlag = 0
-
-            self.A = (self.A << 1) & 0xff
-
-        self.UpdateStatusRegister(n=-1, z=-1, c=cFlag)
-        return
-
-    def BCC(self):
-        if self.GetCarryFlag() == 0:
-            if self.IsNegative(self.RAM[self.PC+1]):
-                self.PC = (self.PC + self.RAM[self.PC+1] - 0x100) % 0x10000
-            else:
-                self.PC = (self.PC + self.RAM[self.PC+1]) % 0x10000
-
-        self.PC += 1
-        return
-
-    def BCS(self):
-        if self.GetCarryFlag() == 1:
-            if self.IsNegative(self.RAM[self.PC+1]):
-                self.PC = (self.PC + self.RAM[self.PC+1] - 0x100) % 0x10000
-            else:
-                self.PC = (self.PC + self.RAM[self.PC+1]) % 0x10000
-
-        self.PC += 1
-        return
-
-    def BEQ(self):
-        if self.GetZeroFlag() == 1:
-            if self.IsNegative(self.RAM[self.PC+1]):
-                self.PC = (self.PC + self.RAM[self.PC+1] - 0x100) % 0x10000
-            else:
-                self.PC = (self.PC + self.RAM[self.PC+1]) % 0x10000
-
-        self.PC += 1
-        return
-
-    def BMI(self):
-        if self.GetNegativeFlag() == 1:
-            if self.IsNegative(self.RAM[self.PC+1]):
-                self.PC = (self.PC + self.RAM[self.PC+1] - 0x100) % 0x10000
-            else:
-                self.PC = (self.PC + self.RAM[self.PC+1]) % 0x10000
-
-        self.PC += 1
-        return
-
-    def BNE(self):
-        if self.GetZeroFlag() == 0:
-            if self.IsNegative(self.RAM[self.PC+1]):
-                self.PC = (self.PC + self.RAM[self.PC+1] - 0x100) % 0x10000
-            else:
-                self.PC = (self.PC + self.RAM[self.PC+1]) % 0x10000
-
-        self.PC += 1
-        return
-
-    def BPL(self):
-        if self.GetNegativeFlag() == 0:
-            if self.IsNegative(self.RAM[self.PC+1]):
-                self.PC = (self.PC + self.RAM[self.PC+1] - 0x100) % 0x10000
-            else:
-                self.PC = (self.PC + self.RAM[self.PC+1]) % 0x10000
-
-        self.PC += 1
-        return
-
-    def CLC(self):
-        self.SetCarryFlag(0)
-        return
-
-    def CMP(self, thisMode):
-        if thisMode == self.adrsMode["abs"]:
-            address = self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8)
-            value = self.RAM[address]
-            self.PC += 2
-        elif thisMode == self.adrsMode["abs,X"]:            
-            address = (self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8) + self.X) % 0x10000
-            value = self.RAM[address]
-            self.PC += 2
-        elif thisMode == self.adrsMode["imm"]:
-            value = self.RAM[self.PC+1]
-            self.PC += 1
-
-        if self.A < value:
-            zFlag = 0
-            cFlag = 0
-        elif self.A == value:
-            zFlag = 1
-            cFlag = 1
-        elif self.A > value:
-            zFlag = 0
-            cFlag = 1
-
-        result = (self.A - value) % 0x100
-
-        if self.IsNegative(result):
-            nFlag = 1
-        else:
-            nFlag = 0
-
-        self.UpdateStatusRegister(n=nFlag, z=zFlag, c=cFlag)
-        return
-
-    def DEX(self):
-        self.X = (self.X - 1) % 0x100
-
-        self.UpdateStatusRegister(n=-2, z=-2)
-        return
-
-    def DEY(self):
-        self.Y = (self.Y - 1) % 0x100
-
-        self.UpdateStatusRegister(n=-3, z=-3)
-        return
-
-    def EOR(self, thisMode):
-        if thisMode == self.adrsMode["abs"]:
-            address = self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8)
-            value = self.RAM[address]
-            self.PC += 2
-        elif thisMode == self.adrsMode["imm"]:
-            value = self.RAM[self.PC+1]
-            self.PC += 1
-
-        self.A = self.A ^ value
-        self.UpdateStatusRegister(n=-1, z=-1)
-        return
-
-    def INX(self):
-        self.X = (self.X + 1) % 0x100
-
-        self.UpdateStatusRegister(n=-2, z=-2)
-        return
-    
-    def INY(self):
-        self.Y = (self.Y + 1) % 0x100
-
-        self.UpdateStatusRegister(n=-3, z=-3)
-        return
-
-    def JMP(self, thisMode):
-        if thisMode == self.adrsMode["abs"]: 
-            address = self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8)
-        self.PC = address
-        return
-
-    def LDA(self, thisMode):
-        if thisMode == self.adrsMode["abs"]:            
-            address = self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8)
-            self.PC += 2
-            self.A = self.RAM[address]
-        elif thisMode == self.adrsMode["abs,X"]:            
-            address = (self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8) + self.X) % 0x10000
-            self.PC += 2
-            self.A = self.RAM[address] 
-        elif thisMode == self.adrsMode["imm"]:
-            value = self.RAM[self.PC+1]
-            self.PC += 1
-            self.A = value
-            
-
-        self.UpdateStatusRegister(n=-1, z=-1)
-        return
-
-    def LDX(self, thisMode):
-        if thisMode == self.adrsMode["abs"]:            
-            address = self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8)
-            self.PC += 2
-            self.X = self.RAM[address]            
-        elif thisMode == self.adrsMode["imm"]:
-            value = self.RAM[self.PC+1]
-            self.PC += 1
-            self.X = value
-            
-
-        self.UpdateStatusRegister(n=-2, z=-2)
-        return
-
-    def LDY(self, thisMode):
-        if thisMode == self.adrsMode["abs"]:            
-            address = self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8)
-            self.PC += 2
-            self.Y = self.RAM[address]
-        elif thisMode == self.adrsMode["abs,X"]:            
-            address = (self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8) + self.X) % 0x100
-            self.PC += 2
-            self.Y = self.RAM[address] 
-        elif thisMode == self.adrsMode["imm"]:
-            value = self.RAM[self.PC+1]
-            self.PC += 1
-            self.Y = value
-            
-
-        self.UpdateStatusRegister(n=-3, z=-3)
-        return
-
-    def LSR(self, thisMode):
-        if thisMode == self.adrsMode["A"]:
-            if self.A & 0x01 != 0:
-                cFlag = 1
-            else:
-                cFlag = 0
-
-            self.A = self.A >> 1
-
-        self.UpdateStatusRegister(n=-1, z=-1, c=cFlag)
-        return
-
-    def ORA(self, thisMode):
-        if thisMode == self.adrsMode["abs"]:
-            address = self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8)
-            value = self.RAM[address]
-            self.PC += 2
-        elif thisMode == self.adrsMode["imm"]:
-            value = self.RAM[self.PC+1]
-            self.PC += 1
-
-        self.A = self.A | value
-        self.UpdateStatusRegister(n=-1, z=-1)
-        return
-
-    def ROL(self, thisMode):
-        if thisMode == self.adrsMode["A"]:
-            if self.A & 0x80 != 0:
-                cFlag = 1
-            else:
-                cFlag = 0
-
-            self.A = ((self.A << 1) % 0x100) + self.GetCarryFlag()
-
-        self.UpdateStatusRegister(n=-1, z=-1, c=cFlag)
-        return
-
-    def ROR(self, thisMode):
-        if thisMode == self.adrsMode["A"]:
-            if self.A & 0x01 != 0:
-                cFlag = 1
+        page = address >> 8
+        if self.pageTraps[page] & TRAP_DEVICE:
+            return self.bus.Write(address, value)
+        self.RAM[address] = value
+        if self.pageTraps[page] & TRAP_CLEAN:
+            self.dirtyPages[page] = 1
+            self.pageTraps[page] &= ~TRAP_CLEAN
+        if self.pageTraps[page] & TRAP_CODE:
+            return self.CodeChanged(address, address + 1)
+        return False
+
+    def Written(self, first, last):
+        """ Marks memory on addresses first to last-1 written from outside of the program (loading, patching) """
+        for page in range(first >> 8, (last + 0xFF) >> 8):
+            self.dirtyPages[page] = 1
+            self.pageTraps[page] &= ~TRAP_CLEAN
+        self.CodeChanged(first, last)
+        return
+
+    def CodeChanged(self, first, last):
+        """ Removes translated code on addresses first to last-1. Returns True if there was some. """
+        changed = False
+        for watcher in self.codeWatchers:
+            if watcher.Invalidate(first, last):
+                changed = True
+        return changed
+
+    def SetCodeTrap(self, page):
+        self.pageTraps[page] |= TRAP_CODE
+        return
+
+    def ClearCodeTrap(self, page):
+        """ Clears the trap on the page if no watcher has translated code there anymore """
+        for watcher in self.codeWatchers:
+            if watcher.HasCode(page):
+                return
+        self.pageTraps[page] &= ~TRAP_CODE
+        return
+
+    # ---- SNAPSHOTS ----
+
+    def Snapshot(self):
+        """ Returns Snapshot of the memory and the registers (see snapshot.py). Pages not written since the last snapshot
+            are shared with it, so a snapshot costs only the copies of the written pages.
+        """
+        base = self.snapshot
+        pages = []
+        for page in range(0x100):
+            if base is None or self.dirtyPages[page]:
+                pages.append(bytes(self.RAM[page << 8:(page + 1) << 8]))
             else:
-                cFlag = 0
-
-            self.A = (self.A >> 1) + self.GetCarryFlag() * 0x80
-
-        self.UpdateStatusRegister(n=-1, z=-1, c=cFlag)
-        return
-
-    def SBC(self, thisMode):
-        if thisMode == self.adrsMode["abs"]:
-            address = self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8)
-            value = self.RAM[address] + (self.GetCarryFlag() - 1)
-            self.PC += 2
-        elif thisMode == self.adrsMode["abs,X"]:
-            address = (self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8) + self.X) % 0x10000
-            value = self.RAM[address] + (self.GetCarryFlag() - 1)
-            self.PC += 2
-        elif thisMode == self.adrsMode["imm"]:
-            value = self.RAM[self.PC+1] + (self.GetCarryFlag() - 1)
-            self.PC += 1
-
-        isANegative = self.IsNegative(self.A)
-        isValueNegative = self.IsNegative(value)
-
-        if self.A < value:
-            cFlag = 1
+                pages.append(base.pages[page])
+        state = snapshot.Snapshot(pages, self.A, self.X, self.Y, self.S, self.P, self.PC, self.instructions, self.cycles)
+        self.Track(state, range(0x100) if base is None else self.DirtyPages())
+        return state
+
+    def Restore(self, state):
+        """ Sets the memory and the registers back to the Snapshot state. Copies only the pages which differ from it:
+            the pages written since the last snapshot and the pages in which the last snapshot and state differ.
+        """
+        base = self.snapshot
+        if base is None:
+            changed = range(0x100)
+        elif base is state:
+            changed = self.DirtyPages()
         else:
-            cFlag = 0
-
-        self.A = (self.A - value) % 0x100
-
-        if isANegative != isValueNegative and isANegative != self.IsNegative(self.A):
-            vFlag = 1
+            changed = [page for page in range(0x100) if self.dirtyPages[page] or base.pages[page] is not state.pages[page]]
+        for page in changed:
+            first = page << 8
+            self.RAM[first:first + 0x100] = state.pages[page]
+            self.CodeChanged(first, first + 0x100)
+
+        self.A = state.A
+        self.X = state.X
+        self.Y = state.Y
+        self.S = state.S
+        self.P = state.P
+        self.PC = state.PC
+        self.instructions = state.instructions
+        self.cycles = state.cycles
+        self.Track(state, changed)
+        return
+
+    def Track(self, state, pages):
+        """ Makes state the snapshot the memory is compared with. pages are the pages which are not already clean. """
+        self.snapshot = state
+        for page in pages:
+            self.dirtyPages[page] = 0
+            self.pageTraps[page] |= TRAP_CLEAN
+        return
+
+    def DirtyPages(self):
+        """ Returns list of the pages written since the last snapshot """
+        pages = []
+        page = self.dirtyPages.find(1)
+        while page >= 0:
+            pages.append(page)
+            page = self.dirtyPages.find(1, page + 1)
+        return pages
+
+    def ChangedPages(self, old):
+        """ Returns list of the pages in which memory differs from the Snapshot old. Compares only the pages written since
+            the last snapshot and the pages which the last snapshot doesn't share with old.
+        """
+        base = self.snapshot
+        if base is None:
+            pages = range(0x100)
         else:
-            vFlag = 0
-
-        self.UpdateStatusRegister(n=-1, z=-1, c=cFlag, v=vFlag)
-        return
-    
-    def SEC(self):
-        self.SetCarryFlag(1)
-        return
-
-    def STA(self, thisMode):
-        if thisMode == self.adrsMode["abs"]:
-            address = self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8)
-            self.PC += 2
-        elif thisMode == self.adrsMode["abs,X"]:
-            address = (self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8) + self.X) % 0x10000
-            self.PC += 2
-
-        self.RAM[address] = self.A
-        return
-
-    def STX(self, thisMode):
-        if thisMode == self.adrsMode["abs"]:
-            address = self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8)
-            self.PC += 2
-
-        self.RAM[address] = self.X
-        return
-
-    def STY(self, thisMode):
-        if thisMode == self.adrsMode["abs"]:
-            address = self.RAM[self.PC+1] + (self.RAM[self.PC+2] << 8)
-            self.PC += 2
-
-        self.RAM[address] = self.Y
-        return
-
-    def TAX(self):
-        self.X = self.A
-
-        self.UpdateStatusRegister(n=-2, z=-2)
-        return
-
-    def TAY(self):
-        self.Y = self.A
-
-        self.UpdateStatusRegister(n=-3, z=-3)
-        return
-
-    def TXA(self):
-        self.A = self.X
+            pages = set(self.DirtyPages())
+            if base is not old:
+                pages.update(page for page in range(0x100) if base.pages[page] is not old.pages[page])
+        return [page for page in sorted(pages) if self.RAM[page << 8:(page + 1) << 8] != old.pages[page]]
+
+    def Diff(self, old):
+        """ Returns list of ranges (first, last) of the addresses first to last-1, where memory differs from the Snapshot old """
+        ranges = []
+        for page in self.ChangedPages(old):
+            first = page << 8
+            new = self.RAM[first:first + 0x100]
+            before = old.pages[page]
+            for offset in range(0x100):
+                if new[offset] != before[offset]:
+                    address = first + offset
+                    if ranges and ranges[-1][1] == address:
+                        ranges[-1][1] = address + 1
+                    else:
+                        ranges.append([address, address + 1])
+        return [(first, last) for first, last in ranges]
 
-        self.UpdateStatusRegister(n=-1, z=-1)
-        return
-    
-    def TYA(self):
-        self.A = self.Y
+    # ---- INPUT METHODS ----
 
-        self.UpdateStatusRegister(n=-1, z=-1)
+    def Load(self, data, address=None):
+        """ Writes bytes of data into memory starting at address (resetVector if not given) """
+        if address is None:
+            address = self.resetVector
+        if address + len(data) > 0x10000:
+            raise ValueError(f"{len(data)} bytes do not fit into memory at ${address:04X}")
+        self.RAM[address:address + len(data)] = data
+        self.Written(address, address + len(data))
+        self.loadCount += 1
         return
 
-    # ---- INPUT METHODS ----
+    def LoadAssembly(self, source, address=None, directory=None):
+        """ Assembles source (see assembler.py) from address (resetVector if not given) and writes it into memory.
+            Returns assembler.Program with the segments and the symbols. Raises assembler.AssemblyError (a ValueError).
+        """
+        program = assembler.Assemble(source, self.resetVector if address is None else address, directory)
+        for start, data in program.segments:
+            self.RAM[start:start + len(data)] = data
+            self.Written(start, start + len(data))
+        self.loadCount += 1
+        return program
+
+    def Reset(self, clearMemory=False):
+        """ Sets registers to zero and PC to resetVector, so that the CPU can run another program. """
+        self.A = 0
+        self.X = 0
+        self.Y = 0
+        self.S = 0
+        self.P = 0
+        self.PC = self.resetVector
+        self.instructions = 0
+        self.cycles = 0
+        self.hostTime = 0.0
+        if clearMemory:
+            self.RAM[:] = bytes(0x10000)
+            self.Written(0, 0x10000)
+            self.loadCount += 1
+        return
+
+    def LoadFile(self, path, address=None):
+        """ Loads the image file path - raw binary (.bin), segments (.seg), Intel HEX or bytes in hexadecimal (see loader.py).
+            Formats without addresses are loaded at address (resetVector if not given).
+            Returns list of the loaded segments (address, length) and the start address given by the file (or None).
+        """
+        return loader.LoadFile(self, path, address)
 
     def HexInputConsole(self):
-        """ Line by line writes input in hexadecimal into memory, until line is empy """
-        counter = self.resetVector
+        """ Reads lines of input in hexadecimal until an empty line and writes them into memory """
+        lines = []
         line = input()
         while line != '':
-            line = line.split()
-            for num in line:
-                self.RAM[counter] = int(num, 16)
-                counter += 1
-
+            lines.append(line)
             line = input()
+        loader.LoadHex(self, "\n".join(lines))
         return
 
     def HexInputFile(self):
-        """ Writes input from file 'in.txt' to memory """
+        """ Writes input from file 'in.txt' (bytes in hexadecimal or Intel HEX) to memory """
         with open(f"{os.path.dirname(os.path.realpath(__file__))}/in.txt") as f:
-            counter = self.resetVector
-            line = f.readline()
-            while True:
-                if line != '\n':
-                    endOfFile = not line.endswith("\n")
-                    if not endOfFile:
-                        line = line[:-1]
-                    line = line.split()
-                    for num in line:
-                        self.RAM[counter] = int(num, 16)
-                        counter += 1
-                    if endOfFile:
-                        break
-
-                line = f.readline()
+            segments, start = loader.LoadHex(self, f.read())
+        if start is not None:
+            self.PC = start
         return
 
-    def Translate(self, line, counter):
-        """ Helper method of the assembly input methods. Matches line written in assembly with hexadecimal eqvivalent and writes it to memory. """
-        line = line.split()
-
-        if len(line) == 1:
-            thisMode = self.adrsMode["imp"]
-        elif line[1] == "A":
-            thisMode = self.adrsMode["A"]
-        elif re.match("^\$....$", line[1]):
-            thisMode = self.adrsMode["abs"]
-        elif re.match("^\$....,X$", line[1]):
-            thisMode = self.adrsMode["abs,X"]
-        elif re.match("^\$....,Y$", line[1]):
-            thisMode = 3 # absolute, Y-indexed
-        elif re.match("^#\$..$", line[1]):
-            thisMode = self.adrsMode["imm"]
-        elif re.match("^\$..$", line[1]):
-            thisMode = self.adrsMode["rel"]
-
-                
-
-        if line[0].lower() == "adc":
-            if thisMode == self.adrsMode["abs"]:
-                self.RAM[counter] = 0x6D
-            elif thisMode == self.adrsMode["abs,X"]:
-                self.RAM[counter] = 0x7D
-            elif thisMode == self.adrsMode["imm"]:
-                self.RAM[counter] = 0x69
-        elif line[0].lower() == "and":
-            if thisMode == self.adrsMode["abs"]:
-                self.RAM[counter] = 0x2D
-            elif thisMode == self.adrsMode["imm"]:
-                self.RAM[counter] = 0x29
-        elif line[0].lower() == "asl":
-            if thisMode == self.adrsMode["A"]:
-                self.RAM[counter] = 0x0A
-        elif line[0].lower() == "bcc":
-            self.RAM[counter] = 0x90
-        elif line[0].lower() == "bcs":
-            self.RAM[counter] = 0xB0
-        elif line[0].lower() == "beq":
-            self.RAM[counter] = 0xF0
-        elif line[0].lower() == "bmi":
-            self.RAM[counter] = 0x30
-        elif line[0].lower() == "bne":
-            self.RAM[counter] = 0xD0
-        elif line[0].lower() == "bpl":
-            self.RAM[counter] = 0x10
-        elif line[0].lower() == "clc":
-            self.RAM[counter] = 0x18
-        elif line[0].lower() == "cmp":
-            if thisMode == self.adrsMode["abs"]:
-                self.RAM[counter] = 0xCD
-            elif thisMode == self.adrsMode["abs,X"]:
-                self.RAM[counter] = 0xDD
-            elif thisMode == self.adrsMode["imm"]:
-                self.RAM[counter] = 0xC9
-        elif line[0].lower() == "dex":
-            self.RAM[counter] = 0xCA
-        elif line[0].lower() == "dey":
-            self.RAM[counter] = 0x88
-        elif line[0].lower() == "eor":
-            if thisMode == self.adrsMode["abs"]:
-                self.RAM[counter] = 0x4D
-            elif thisMode == self.adrsMode["imm"]:
-                self.RAM[counter] = 0x49
-        elif line[0].lower() == "inx":
-            self.RAM[counter] = 0xE8
-        elif line[0].lower() == "iny":
-            self.RAM[counter] = 0xC8
-        elif line[0].lower() == "jmp":
-            if thisMode == self.adrsMode["abs"]:
-                self.RAM[counter] = 0x4C
-        elif line[0].lower() == "lda":
-            if thisMode == self.adrsMode["abs"]:
-                self.RAM[counter] = 0xAD
-            elif thisMode == self.adrsMode["abs,X"]:
-                self.RAM[counter] = 0xBD
-            elif thisMode == self.adrsMode["imm"]:
-                self.RAM[counter] = 0xA9
-        elif line[0].lower() == "ldx":
-            if thisMode == self.adrsMode["abs"]:
-                self.RAM[counter] = 0xAE
-            elif thisMode == self.adrsMode["imm"]:
-                self.RAM[counter] = 0xA2
-        elif line[0].lower() == "ldy":
-            if thisMode == self.adrsMode["abs"]:
-                self.RAM[counter] = 0xAC
-            elif thisMode == self.adrsMode["abs,X"]:
-                self.RAM[counter] = 0xBC
-            elif thisMode == self.adrsMode["imm"]:
-                self.RAM[counter] = 0xA0
-        elif line[0].lower() == "lsr":
-            if thisMode == self.adrsMode["A"]:
-                self.RAM[counter] = 0x4A
-        elif line[0].lower() == "ora":
-            if thisMode == self.adrsMode["abs"]:
-                self.RAM[counter] = 0x0D
-            elif thisMode == self.adrsMode["imm"]:
-                self.RAM[counter] = 0x09
-        elif line[0].lower() == "rol":
-            if thisMode == self.adrsMode["A"]:
-                self.RAM[counter] = 0x2A
-        elif line[0].lower() == "ror":
-            if thisMode == self.adrsMode["A"]:
-                self.RAM[counter] = 0x6A
-        elif line[0].lower() == "sbc":
-            if thisMode == self.adrsMode["abs"]:
-                self.RAM[counter] = 0xED
-            elif thisMode == self.adrsMode["abs,X"]:
-                self.RAM[counter] = 0xFD
-            elif thisMode == self.adrsMode["imm"]:
-                self.RAM[counter] = 0xE9
-        elif line[0].lower() == "sec":
-            self.RAM[counter] = 0x38
-        elif line[0].lower() == "sta":
-            if thisMode == self.adrsMode["abs"]:
-                self.RAM[counter] = 0x8D
-            elif thisMode == self.adrsMode["abs,X"]:
-                self.RAM[counter] = 0x9D
-        elif line[0].lower() == "stx":
-            if thisMode == self.adrsMode["abs"]:
-                self.RAM[counter] = 0x8E
-        elif line[0].lower() == "sty":
-            if thisMode == self.adrsMode["abs"]:
-                self.RAM[counter] = 0x8C
-        elif line[0].lower() == "tax":
-                self.RAM[counter] = 0xAA
-        elif line[0].lower() == "tay":
-                self.RAM[counter] = 0xA8
-        elif line[0].lower() == "txa":
-                self.RAM[counter] = 0x8A
-        elif line[0].lower() == "tya":
-                self.RAM[counter] = 0x98
-
-        counter += 1
-
-        if thisMode == self.adrsMode["A"]:
-            pass
-        elif thisMode == self.adrsMode["abs"]:
-            self.RAM[counter] = int(line[1][3:], 16)
-            self.RAM[counter+1] = int(line[1][1:3], 16)
-            counter += 2
-        elif thisMode == self.adrsMode["abs,X"]:
-            self.RAM[counter] = int(line[1][3:5], 16)
-            self.RAM[counter+1] = int(line[1][1:3], 16)
-            counter += 2
-        elif thisMode == 3:
-            self.RAM[counter] = int(line[1][3:5], 16)
-            self.RAM[counter+1] = int(line[1][1:3], 16)
-            counter += 2
-        elif thisMode == self.adrsMode["imm"]:
-            self.RAM[counter] = int(line[1][2:], 16)
-            counter += 1
-        elif thisMode == self.adrsMode["rel"]:
-            self.RAM[counter] = int(line[1][1:], 16)
-            counter += 1
-        elif thisMode == self.adrsMode["imp"]:
-            pass
+    def BinaryInputFile(self):
+        """ Reads the raw binary file 'in.bin' into memory """
+        loader.LoadBinary(self, f"{os.path.dirname(os.path.realpath(__file__))}/in.bin")
+        return
 
+    def Translate(self, line, counter):
+        """ Assembles one line (see assembler.py) on the address counter and writes it to memory.
+            Returns address after the instruction. Raises assembler.AssemblyError (a ValueError) if the instruction doesn't exist.
+        """
+        program = assembler.Assemble(line, counter, cache=False)
+        for start, data in program.segments:
+            self.RAM[start:start + len(data)] = data
+            self.Written(start, start + len(data))
+            counter = start + len(data)
         return counter
 
     def AssemblyInputConsole(self):
-        counter = self.resetVector
+        """ Reads lines of assembly until an empty line and loads them """
+        lines = []
         line = input()
-        while line != '':            
-            counter = self.Translate(line, counter)
-
+        while line != '':
+            lines.append(line)
             line = input()
+        self.LoadAssembly("\n".join(lines))
+        return
 
     def AssemblyInputFile(self):
-        counter = self.resetVector
-        with open(f"{os.path.dirname(os.path.realpath(__file__))}/in.txt") as f:
-            line = f.readline()
-            while True:
-                if line != '\n':
-                    endOfFile = not line.endswith("\n")
-                    if not endOfFile:
-                        line = line[:-1]
-                        
-                    counter = self.Translate(line, counter)
-
-                    if endOfFile:
-                        break
-
-                line = f.readline()
-                
+        """ Loads the assembly from file 'in.txt', files of .incbin are relative to its directory """
+        directory = os.path.dirname(os.path.realpath(__file__))
+        with open(f"{directory}/in.txt") as f:
+            self.LoadAssembly(f.read(), directory=directory)
+        return
+
     # ---- DEBUG MODE ----
     
     def Encode(self, index):
         """ Encodes instruction on index in RAM from hexadecimal to assembly eqvivalent - stored in ins_s.
-            Returns this string instruction and index of the next instruction.
+            Returns this string instruction and index of the next instruction. Decoded instructions are cached (see disassembler.py).
         """
+        return self.disassembler.Decode(index)
 
-        ins = self.RAM[index]
-
-        if ins == 0x69:
-            thisMode = self.adrsMode["imm"]
-            ins_s = "adc"
-        elif ins == 0x6D:
-            thisMode = self.adrsMode["abs"]
-            ins_s = "adc"
-        elif ins == 0x7D:
-            thisMode = self.adrsMode["abs,X"]
-            ins_s = "adc"
-        elif ins == 0x29:
-            thisMode = self.adrsMode["imm"]
-            ins_s = "and"
-        elif ins == 0x2D:
-            thisMode = self.adrsMode["abs"]
-            ins_s = "and"
-        elif ins == 0x0A:
-            thisMode = self.adrsMode["A"]
-            ins_s = "asl"
-        elif ins == 0x90:
-            thisMode = self.adrsMode["rel"]
-            ins_s = "bcc"
-        elif ins == 0xB0:
-            thisMode = self.adrsMode["rel"]
-            ins_s = "bcs"
-        elif ins == 0xF0:
-            thisMode = self.adrsMode["rel"]
-            ins_s = "beq"
-        elif ins == 0x30:
-            thisMode = self.adrsMode["rel"]
-            ins_s = "bmi"
-        elif ins == 0xD0:
-            thisMode = self.adrsMode["rel"]
-            ins_s = "bne"
-        elif ins == 0x10:
-            thisMode = self.adrsMode["rel"]
-            ins_s = "bpl"
-        elif ins == 0x00:
-            thisMode = self.adrsMode["imp"]
-            ins_s = "brk"
-        elif ins == 0x18:
-            thisMode = self.adrsMode["imp"]
-            ins_s = "clc"
-        elif ins == 0xC9:
-            thisMode = self.adrsMode["imm"]
-            ins_s = "cmp"
-        elif ins == 0xCD:
-            thisMode = self.adrsMode["abs"]
-            ins_s = "cmp"
-        elif ins == 0xDD:
-            thisMode = self.adrsMode["abs,X"]
-            ins_s = "cmp"
-        elif ins == 0xCA:
-            thisMode = self.adrsMode["imp"]
-            ins_s = "dex"
-        elif ins == 0x88:
-            thisMode = self.adrsMode["imp"]
-            ins_s = "dey"
-        elif ins == 0x49:
-            thisMode = self.adrsMode["imm"]
-            ins_s = "eor"
-        elif ins == 0x4D:
-            thisMode = self.adrsMode["abs"]
-            ins_s = "eor"
-        elif ins == 0xE8:
-            thisMode = self.adrsMode["imp"]
-            ins_s = "inx"
-        elif ins == 0xC8:
-            thisMode = self.adrsMode["imp"]
-            ins_s = "iny"
-        elif ins == 0x4C:
-            thisMode = self.adrsMode["abs"]
-            ins_s = "jmp"
-        elif ins == 0xA9:
-            thisMode = self.adrsMode["imm"]
-            ins_s = "lda"
-        elif ins == 0xAD:
-            thisMode = self.adrsMode["abs"]
-            ins_s = "lda"
-        elif ins == 0xBD:
-            thisMode = self.adrsMode["abs,X"]
-            ins_s = "lda"
-        elif ins == 0xA2:
-            thisMode = self.adrsMode["imm"]
-            ins_s = "ldx"
-        elif ins == 0xAE:
-            thisMode = self.adrsMode["abs"]
-            ins_s = "ldx"
-        elif ins == 0xA0:
-            thisMode = self.adrsMode["imm"]
-            ins_s = "ldy"
-        elif ins == 0xAC:
-            thisMode = self.adrsMode["abs"]
-            ins_s = "ldy"
-        elif ins == 0xBC:
-            thisMode = self.adrsMode["abs,X"]
-            ins_s = "ldy"
-        elif ins == 0x4A:
-            thisMode = self.adrsMode["A"]
-            ins_s = "lsr"
-        elif ins == 0x09:
-            thisMode = self.adrsMode["imm"]
-            ins_s = "ora"
-        elif ins == 0x0D:
-            thisMode = self.adrsMode["abs"]
-            ins_s = "ora"
-        elif ins == 0x2A:
-            thisMode = self.adrsMode["A"]
-            ins_s = "rol"
-        elif ins == 0x6A:
-            thisMode = self.adrsMode["A"]
-            ins_s = "ror"
-        elif ins == 0xE9:
-            thisMode = self.adrsMode["imm"]
-            ins_s = "sbc"
-        elif ins == 0xED:
-            thisMode = self.adrsMode["abs"]
-            ins_s = "sbc"
-        elif ins == 0xFD:
-            thisMode = self.adrsMode["abs,X"]
-            ins_s = "sbc"
-        elif ins == 0x38:
-            thisMode = self.adrsMode["imp"]
-            ins_s = "sec"
-        elif ins == 0x8D:
-            thisMode = self.adrsMode["abs"]
-            ins_s = "sta"
-        elif ins == 0x9D:
-            thisMode = self.adrsMode["abs,X"]
-            ins_s = "sta"
-        elif ins == 0x8E:
-            thisMode = self.adrsMode["abs"]
-            ins_s = "stx"
-        elif ins == 0x8C:
-            thisMode = self.adrsMode["abs"]
-            ins_s = "sty"    
-        elif ins == 0xAA:
-            thisMode = self.adrsMode["imp"]
-            ins_s = "tax"
-        elif ins == 0xA8:
-            thisMode = self.adrsMode["imp"]
-            ins_s = "tay"
-        elif ins == 0x8A:
-            thisMode = self.adrsMode["imp"]
-            ins_s = "txa"
-        elif ins == 0x98:
-            thisMode = self.adrsMode["imp"]
-            ins_s = "tya"
-        else:
-            thisMode = self.adrsMode["imp"]
-            ins_s = "nao"
-
-        if thisMode == self.adrsMode["A"]:
-            ins_s += " A"
-        if thisMode == self.adrsMode["abs"]:
-            ins_s += " $" + format(self.RAM[index+2], "02X") + format(self.RAM[index+1], "02X")
-            index += 2
-        elif thisMode == self.adrsMode["abs,X"]:
-            ins_s += " $" + format(self.RAM[index+2], "02X") + format(self.RAM[index+1], "02X") + ",X"
-            index += 2
-        elif thisMode == self.adrsMode["imm"]:
-            ins_s += " #$" + format(self.RAM[index+1], "02X")
-            index += 1
-        elif thisMode == self.adrsMode["imp"]:
-            pass
-        elif thisMode == self.adrsMode["rel"]:
-            ins_s += " $" + format(self.RAM[index+1], "02X")
-            index += 1
-
-        index += 1
-
-        return ins_s, index
-
-    def PrintDebug(self, insIndex, dataIndex, colors):
-        """ Prints debug screen with x instructions in assembly in the top, y lines of hexdump of memory on the bottom, and on the right prints contents of CPU registers. """
-
-        print()
-        clear()
+    def DebugScreen(self, insIndex, dataIndex, colors):
+        """ Returns lines of the debug screen with x instructions in assembly in the top, y lines of hexdump of memory on the bottom,
+            and on the right contents of CPU registers. The last line is the prompt.
+        """
+        green, yellow, cyan, white = (GREEN, YELLOW, CYAN, WHITE) if colors else ("", "", "", "")
+        registers = {
+            2: ("A   ", format(self.A, "02X")),
+            3: ("X   ", format(self.X, "02X")),
+            4: ("Y   ", format(self.Y, "02X")),
+            6: ("PC  ", format(self.PC, "02X" if colors else "04X")),
+            8: ("S   ", format(self.S, "02X")),
+            9: ("P   ", format(self.P, "02X")),
+        }
+
+        lines = []
         for i in range(15):
             ins_s, newInsIndex = self.Encode(insIndex)
             if colors:
-                print(u"\u001b[32;1m", end='') # green
-                print(f'I:{format(insIndex, "04X")}', end='')
-                if insIndex == self.PC:
-                    print(u"\u001b[33;1m", end='') # yellow
+                line = f'{green}I:{format(insIndex, "04X")}{yellow if insIndex == self.PC else cyan}'
+                if i in registers:
+                    name, value = registers[i]
+                    line += f'{f" {ins_s}":<16}{green}{name}{cyan}{value}'
                 else:
-                    print(u"\u001b[36;1m", end='') # cyan
-                if i == 2 or i == 3 or i == 4 or i == 6 or i == 8 or i == 9:
-                    print("{:<16}".format(f' {ins_s}'), end='')
-                else:
-                    print(f' {ins_s}')
-                
-                if i == 2:
-                    print(u"\u001b[32;1m", end='') # green
-                    print("A   ", end='')
-                    print(u"\u001b[36;1m", end='') # cyan
-                    print(format(self.A, "02X"))
-                if i == 3:
-                    print(u"\u001b[32;1m", end='') # green
-                    print("X   ", end='')
-                    print(u"\u001b[36;1m", end='') # cyan
-                    print(format(self.X, "02X"))
-                if i == 4:
-                    print(u"\u001b[32;1m", end='') # green
-                    print("Y   ", end='')
-                    print(u"\u001b[36;1m", end='') # cyan
-                    print(format(self.Y, "02X"))
-                if i == 6:
-                    print(u"\u001b[32;1m", end='') # green
-                    print("PC  ", end='')
-                    print(u"\u001b[36;1m", end='') # cyan
-                    print(format(self.PC, "02X"))
-                if i == 8:
-                    print(u"\u001b[32;1m", end='') # green
-                    print("S   ", end='')
-                    print(u"\u001b[36;1m", end='') # cyan
-                    print(format(self.S, "02X"))
-                if i == 9:
-                    print(u"\u001b[32;1m", end='') # green
-                    print("P   ", end='')
-                    print(u"\u001b[36;1m", end='') # cyan
-                    print(format(self.P, "02X"))
+                    line += f' {ins_s}'
             else:
-                if i == 2 or i == 3 or i == 4 or i == 6 or i == 8 or i == 9:
-                    print("{:<22}".format(f'I:{format(insIndex, "04X")} {ins_s}'), end='')
-                else:
-                    print(f'I:{format(insIndex, "04X")} {ins_s}')
-                if i == 2:
-                    print(f"A   {format(self.A, '02X')}")
-                if i == 3:
-                    print(f"X   {format(self.X, '02X')}")
-                if i == 4:
-                    print(f"Y   {format(self.Y, '02X')}")
-                if i == 6:
-                    print(f"PC  {format(self.PC, '04X')}")
-                if i == 8:
-                    print(f"S   {format(self.S, '02X')}")
-                if i == 9:
-                    print(f"P   {format(self.P, '02X')}")
+                line = f'I:{format(insIndex, "04X")} {ins_s}'
+                if i in registers:
+                    name, value = registers[i]
+                    line = f'{line:<22}{name}{value}'
+            lines.append(line)
             insIndex = newInsIndex
 
-        print()
+        lines.append("")
         for i in range(10):
-            if colors:
-                print(u"\u001b[32;1m", end='') # green
-            print(f'M:{format(dataIndex, "04X")}', end='')
-            if colors:
-                print(u"\u001b[36;1m", end='') # cyan
-            for j in range(8):
-                print(f' {format(self.RAM[dataIndex], "02X")}', end='')
-                dataIndex += 1
-            print()
-        
-        if colors:
-            print(u"\u001b[37;1m", end='') # white
-        print(20 * "_")
-        print('> ', end='')
-        
+            data = "".join(f' {format(self.RAM[(dataIndex + j) & 0xFFFF], "02X")}' for j in range(8))
+            lines.append(f'{green}M:{format(dataIndex, "04X")}{cyan}{data}')
+            dataIndex += 8
+
+        mips, mhz = self.Speed()
+        lines.append(f"instructions {self.instructions}  cycles {self.cycles}  {mips:.2f} MIPS  {mhz:.2f} MHz")
+        if self.breakpoints.hit is not None:
+            lines.append(f"stopped on {self.breakpoints.hit}")
+        if self.jit is not None:
+            lines += self.jit.Report().split("\n")
+        if self.aot is not None:
+            lines += self.aot.Report().split("\n")
+        lines.append(white + 20 * "_")
+        lines.append("> ")
+        return lines
+
+    def PrintDebug(self, insIndex, dataIndex, colors, redraw=False):
+        """ Prints debug screen (see DebugScreen) with one write. With redraw only the lines which changed since the last
+            debug screen are written again - for stepping, when nothing else was printed in between.
+        """
+        lines = self.DebugScreen(insIndex, dataIndex, colors)
+        screen = self.screen
+        if redraw and screen is not None and len(screen) == len(lines):
+            # the cursor is at the end of the prompt (the last line), it moves up and down to the changed lines
+            frame = ""
+            row = len(lines) - 1
+            for i, line in enumerate(lines[:-1]):
+                if line != screen[i]:
+                    frame += f"\u001b[{row - i}A" if row > i else f"\u001b[{i - row}B" if i > row else ""
+                    frame += f"\r{line}\u001b[K"
+                    row = i
+            if row < len(lines) - 1:
+                frame += f"\u001b[{len(lines) - 1 - row}B"
+            frame += f"\r{lines[-1]}\u001b[J"
+        else:
+            frame = CLEAR_SCREEN + "\n".join(lines)
+        self.screen = lines
+        sys.stdout.write(frame)
+        sys.stdout.flush()
+        return
+
+    def PrintDiff(self, old, name, colors):
+        """ Prints rows of hexdump of memory with bytes changed since the Snapshot old, the changed bytes are highlighted """
+        green, red, cyan, white = (GREEN, RED, CYAN, WHITE) if colors else ("", "", "", "")
+        ranges = self.Diff(old)
+        lines = [f"memory changed since {name}: {sum(last - first for first, last in ranges)} bytes in {len(ranges)} ranges"]
+
+        changed = set()
+        for first, last in ranges:
+            changed.update(range(first, last))
+        rows = sorted({address & 0xFFF8 for address in changed})
+        for row in rows[:40]:
+            line = f'{green}M:{format(row, "04X")}'
+            for address in range(row, row + 8):
+                if address in changed:
+                    line += f'{red} {format(self.RAM[address], "02X")}' if colors else f'*{format(self.RAM[address], "02X")}'
+                else:
+                    line += f'{cyan} {format(self.RAM[address], "02X")}'
+            lines.append(line)
+        if len(rows) > 40:
+            lines.append(f"... {len(rows) - 40} more rows")
+
+        lines.append(white + 20 * "_")
+        lines.append("press enter to continue")
+        clear()
+        print("\n".join(lines))
+        return
+
+    def DiffCommand(self, command, checkpoints, colors):
+        """ Handles the command 'diff [step|checkpoint|start]' of the debug screen """
+        name = command[1] if len(command) > 1 else "step"
+        if name not in checkpoints:
+            print(f"no {name} to compare with - press enter to continue")
+        else:
+            self.PrintDiff(checkpoints[name], f"the last {name}" if name != "start" else "the start", colors)
+        input()
         return
 
+    def BreakpointCommand(self, line):
+        """ Handles the commands of the debug screen setting breakpoints (see breakpoints.py):
+            'break HHLL [if condition]', 'watch [r|w|rw] HHLL[:HHLL]', 'stop condition', 'delete [n]' and 'breaks'.
+            Returns False if line is not one of them.
+        """
+        command = line.split()
+        try:
+            if command[0] == "break" and len(command) > 1:
+                condition = line.split(" if ", 1)[1] if " if " in line else None
+                self.breakpoints.Break(int(command[1].lstrip("$"), 16), condition)
+            elif command[0] == "watch" and len(command) > 1:
+                kind = command[1] if command[1] in ("r", "w", "rw") else "w"
+                parts = [int(part.lstrip("$"), 16) for part in command[-1].split(":")]
+                self.breakpoints.Watch(parts[0], parts[1] if len(parts) > 1 else None, "r" in kind, "w" in kind)
+            elif command[0] == "stop" and len(command) > 1:
+                self.breakpoints.Stop(line.split(None, 1)[1])
+            elif command[0] == "delete":
+                self.breakpoints.Delete(int(command[1]) if len(command) > 1 else None)
+            elif command[0] == "breaks":
+                print("\n".join(self.breakpoints.List() or ["no breakpoints"]))
+                print("press enter to continue")
+                input()
+            else:
+                return False
+        except (ValueError, IndexError) as error:
+            print(f"{error} - press enter to continue")
+            input()
+        return True
+
     # ---- MAIN LOOP ----
 
-    def Run(self, debug = 0, colors = False):
-        """ Main loop which steps the instructions in memory and executes them until reaches a break or not known instruction.
+    def Run(self, maxInstructions=None):
+        """ Executes instructions from PC until reaches a break or not known instruction, or until maxInstructions are executed.
+            Uses the interpreter, the JIT (see jit.py) or the ahead-of-time translated program (see aot.py) depending on engine,
+            with breakpoints set (see breakpoints.py), the tracer (see tracer.py) or the profiler (see profiler.py) always the checking interpreter
+            and with devices which see reads (see bus.py) always an interpreter. The buffered output of the devices is written at the end.
+            Without the checks an idle loop (see idle.py) is skipped up to maxInstructions or stops the run with the reason 'idle'.
+            Doesn't use the console, so it can be called repeatedly from other programs. Returns RunResult with the state of the CPU.
+        """
+
+        limited = maxInstructions is not None
+        if maxInstructions is None:
+            maxInstructions = sys.maxsize
+
+        cycles = self.cycles
+        start = time.perf_counter()
+        self.breakpoints.hit = None
+        self.bus.exitCode = None
+        if self.Checking():
+            count, reason = self.Interpret(maxInstructions)
+        else:
+            if self.bus.reads:
+                engine = self.Interpret
+            elif self.engine == "jit":
+                if self.jit is None:
+                    self.jit = jit.JIT(self)
+                engine = self.jit.Run
+            elif self.engine == "aot":
+                if self.aot is None:
+                    self.aot = aot.AOT(self)
+                engine = self.aot.Run
+            else:
+                engine = self.Interpret
+            count = 0
+            while True:
+                done, reason = engine(min(maxInstructions - count, idle.SLICE) if self.skipIdle else maxInstructions - count)
+                count += done
+                if reason != "limit" or count == maxInstructions:
+                    break
+                done, reason = idle.FastForward(self, maxInstructions - count if limited else None)
+                count += done
+                if reason != "limit" or count == maxInstructions:
+                    break
+        seconds = time.perf_counter() - start
+        self.hostTime += seconds
+        self.bus.Flush()
+
+        return RunResult(self, count, reason, self.cycles - cycles, seconds)
+
+    def Interpret(self, maxInstructions):
+        """ Interpreter generated from the specification of the instructions (see interpreter.py).
+            Returns the number of executed instructions and the reason of the stop.
+            With breakpoints set it runs the checking interpreter, which can stop also with the reason 'break' or 'watch',
+            with the tracer or the profiler its variant, which records or counts the instructions.
+            With devices which see reads it runs the interpreter with devices. A store into the HaltPort stops it with the reason 'exit'.
+        """
+        self.breakpoints.hit = None
+        if self.Checking():
+            return interpreter.CHECKING[self.tracer is not None, self.profiler is not None](self, maxInstructions)
+        if self.bus.reads:
+            return interpreter.InterpretDevices(self, maxInstructions)
+        if self.fusion:
+            return interpreter.Interpret(self, maxInstructions)
+        return interpreter.InterpretUnfused(self, maxInstructions)
+
+    def Checking(self):
+        """ Returns True if the instructions have to be checked - breakpoints are set, the tracer or the profiler is on """
+        return bool(self.breakpoints) or self.tracer is not None or self.profiler is not None
+
+    def Speed(self):
+        """ Returns millions of instructions executed per second of the host and the emulated frequency in MHz since Reset """
+        if self.hostTime == 0:
+            return 0.0, 0.0
+        return self.instructions / self.hostTime / 1e6, self.cycles / self.hostTime / 1e6
+
+    def RunInteractive(self, debug = 0, colors = False):
+        """ Main loop of the console program, which steps the instructions in memory and executes them until reaches a break or not known instruction.
             At the end of program prints interactive debug screen, where user can view data in specific locations in memory.
             If debug mode is enabled, after every step interactive debug screen is printed, which also allows user to step through the program.
         """
 
-        self.PC = self.resetVector
         stepper = 0         # number of steps to be done without debug screen
         dataIndex = 0       # starting location of data in memory displayed in debug screen
         insIndex = self.PC  # starting location of instructions in memory displayed in debug screen
         exit = False        # indicator if end the program without an ending debug screen
-        sleep = False       # if wait between stepped instructions
+        delay = 0.0         # seconds of waiting between stepped instructions
+        redraw = False      # if the debug screen can be redrawn by lines - nothing was printed or typed since the last one
+        running = False     # if run until a breakpoint or the end of the program (command continue)
         printDebug = True
+        checkpoints = {"start": self.Snapshot()}    # snapshots of memory for the command diff
 
         while True:
+            if debug == 0:
+                # nothing has to be done between instructions
+                self.Run()
+                break
+
             if debug == 1 and (printDebug or stepper == 0):
                 insIndex = self.PC
-                self.PrintDebug(insIndex, dataIndex, colors)
+                self.PrintDebug(insIndex, dataIndex, colors, redraw)
+                redraw = stepper > 0
 
             if debug == 1 and stepper == 0:
                 # interactive debug screen
                 printDebug = True
                 execute = False # indicator if command executes another instruction
                 while not execute:
-                    command = input().split()
+                    line = input()
+                    command = line.split()
                     if len(command) == 0:
                         print("command not valid")
                         input()
                         self.PrintDebug(insIndex, dataIndex, colors)
+                    elif self.BreakpointCommand(line):
+                        self.PrintDebug(insIndex, dataIndex, colors)
+                    elif command[0] == "continue":
+                        execute = True
+                        running = True
+                    elif command[0] == "checkpoint":
+                        checkpoints["checkpoint"] = self.Snapshot()
+                        self.PrintDebug(insIndex, dataIndex, colors)
+                    elif command[0] == "diff":
+                        self.DiffCommand(command, checkpoints, colors)
+                        self.PrintDebug(insIndex, dataIndex, colors)
                     elif command[0] == "step":
                         if len(command) == 1:
                             execute = True
                         else:
                             stepper = int(command[1])
                             execute = True
-                            sleep = True
+                            delay = float(command[2]) if len(command) > 2 else 0.75
                     elif command[0] == "qstep":
                         stepper = int(command[1])
                         execute = True
-                        sleep = False
+                        delay = 0.0
                         printDebug = False
                     elif command[0] == "m":
                         dataIndex = int(command[1], 16)
@@ -1096,118 +614,31 @@ class CPU():
                         print("command not valid")
                         input()
                         self.PrintDebug(insIndex, dataIndex, colors)
+                if execute:
+                    checkpoints["step"] = self.Snapshot()
                     
             if stepper > 0:         # if there are yet steps without debug screen to be done
-                if sleep:
-                    time.sleep(0.75)
+                if delay:
+                    time.sleep(delay)
                 stepper -= 1
 
-            ins = self.RAM[self.PC]
-            if ins == 0x69:
-                self.ADC(self.adrsMode["imm"])
-            elif ins == 0x6D:
-                self.ADC(self.adrsMode["abs"])
-            elif ins == 0x7D:
-                self.ADC(self.adrsMode["abs,X"])
-            elif ins == 0x29:
-                self.AND(self.adrsMode["imm"])
-            elif ins == 0x2D:
-                self.AND(self.adrsMode["abs"])
-            elif ins == 0x0A:
-                self.ASL(self.adrsMode["A"])
-            elif ins == 0x90:
-                self.BCC()
-            elif ins == 0xB0:
-                self.BCS()
-            elif ins == 0xF0:
-                self.BEQ()
-            elif ins == 0x30:
-                self.BMI()
-            elif ins == 0xD0:
-                self.BNE()
-            elif ins == 0x10:
-                self.BPL()
-            elif ins == 0x00:   # BRK instruction
-                break
-            elif ins == 0x18:
-                self.CLC()
-            elif ins == 0xC9:
-                self.CMP(self.adrsMode["imm"])
-            elif ins == 0xCD:
-                self.CMP(self.adrsMode["abs"])
-            elif ins == 0xDD:
-                self.CMP(self.adrsMode["abs,X"])
-            elif ins == 0xCA:
-                self.DEX()
-            elif ins == 0x88:
-                self.DEY()
-            elif ins == 0x49:
-                self.EOR(self.adrsMode["imm"])
-            elif ins == 0x4D:
-                self.EOR(self.adrsMode["abs"])
-            elif ins == 0xE8:
-                self.INX()
-            elif ins == 0xC8:
-                self.INY()
-            elif ins == 0x4C:
-                self.JMP(self.adrsMode["abs"])
-                continue
-            elif ins == 0xA9:
-                self.LDA(self.adrsMode["imm"])
-            elif ins == 0xAD:
-                self.LDA(self.adrsMode["abs"])
-            elif ins == 0xBD:
-                self.LDA(self.adrsMode["abs,X"])
-            elif ins == 0xA2:
-                self.LDX(self.adrsMode["imm"])
-            elif ins == 0xAE:
-                self.LDX(self.adrsMode["abs"])
-            elif ins == 0xA0:
-                self.LDY(self.adrsMode["imm"])
-            elif ins == 0xAC:
-                self.LDY(self.adrsMode["abs"])
-            elif ins == 0xBC:
-                self.LDY(self.adrsMode["abs,X"])
-            elif ins == 0x4A:
-                self.LSR(self.adrsMode["A"])
-            elif ins == 0x09:
-                self.ORA(self.adrsMode["imm"])
-            elif ins == 0x0D:
-                self.ORA(self.adrsMode["abs"])
-            elif ins == 0x2A:
-                self.ROL(self.adrsMode["A"])
-            elif ins == 0x6A:
-                self.ROR(self.adrsMode["A"])
-            elif ins == 0xE9:
-                self.SBC(self.adrsMode["imm"])
-            elif ins == 0xED:
-                self.SBC(self.adrsMode["abs"])
-            elif ins == 0xFD:
-                self.SBC(self.adrsMode["abs,X"])
-            elif ins == 0x38:
-                self.SEC()
-            elif ins == 0x8D:
-                self.STA(self.adrsMode["abs"])
-            elif ins == 0x9D:
-                self.STA(self.adrsMode["abs,X"])
-            elif ins == 0x8E:
-                self.STX(self.adrsMode["abs"])
-            elif ins == 0x8C:
-                self.STY(self.adrsMode["abs"])
-            elif ins == 0xAA:
-                self.TAX()
-            elif ins == 0xA8:
-                self.TAY()
-            elif ins == 0x8A:
-                self.TXA()
-            elif ins == 0x98:
-                self.TYA()
-            else:   # not an instruction
+            if running:
+                reason = self.Run().reason
+                running = False
+            else:
+                start = time.perf_counter()
+                reason = self.Interpret(1)[1]
+                self.hostTime += time.perf_counter() - start
+                if reason == "limit" and stepper > 0 and self.breakpoints and self.breakpoints.At():
+                    reason = "break"
+            if reason == "break" or reason == "watch":
+                stepper = 0
+                printDebug = True
+            elif reason != "limit":  # brk, not an instruction, exit or idle
                 break
-            
-            self.PC += 1
         
         # interactive debug screen at the end of program
+        self.bus.Flush()
         insIndex = self.PC
         while not exit:
             self.PrintDebug(insIndex, dataIndex, colors)
@@ -1222,6 +653,10 @@ class CPU():
             elif command[0] == "i":
                 insIndex = int(command[1], 16)
                 self.PrintDebug(insIndex, dataIndex, colors)
+            elif command[0] == "checkpoint":
+                checkpoints["checkpoint"] = self.Snapshot()
+            elif command[0] == "diff":
+                self.DiffCommand(command, checkpoints, colors)
             elif command[0] == "exit":
                 exit = True
             else:
@@ -1232,64 +667,133 @@ class CPU():
         return
 
 def clear():
-        # for windows
-        if os.name == 'nt':
-            _ = os.system('cls')
-        # for mac and linux(here, os.name is 'posix')
+    """ Clears the console by ANSI escape codes and moves the cursor to the top left corner """
+    sys.stdout.write(CLEAR_SCREEN)
+    sys.stdout.flush()
+    return
+
+class RunResult():
+    """ State of the CPU after Run.
+        reason - why the CPU stopped: 'brk', 'halt' (not known instruction), 'limit' (maxInstructions were executed),
+                 'break' (breakpoint or stop condition) or 'watch' (watchpoint) - described by cpu.breakpoints.hit,
+                 'exit' (store into the HaltPort, see bus.py), 'idle' (loop which can never end, see idle.py)
+        exitCode - byte stored into the HaltPort, None if the program didn't exit
+        instructions, cycles, seconds - executed by this Run and the time it took on the host
+    """
+
+    def __init__(self, cpu, instructions, reason, cycles=0, seconds=0.0):
+        self.A = cpu.A
+        self.X = cpu.X
+        self.Y = cpu.Y
+        self.PC = cpu.PC
+        self.S = cpu.S
+        self.P = cpu.P
+        self.instructions = instructions
+        self.cycles = cycles
+        self.seconds = seconds
+        self.reason = reason
+        self.exitCode = cpu.bus.exitCode
+
+    @property
+    def mips(self):
+        """ Millions of instructions executed per second of the host """
+        return self.instructions / self.seconds / 1e6 if self.seconds else 0.0
+
+    @property
+    def mhz(self):
+        """ Emulated frequency - millions of cycles executed per second of the host """
+        return self.cycles / self.seconds / 1e6 if self.seconds else 0.0
+
+    def __repr__(self):
+        return (f"RunResult(reason={self.reason!r}, instructions={self.instructions}, cycles={self.cycles}, "
+                f"A=${self.A:02X}, X=${self.X:02X}, Y=${self.Y:02X}, PC=${self.PC:04X}, S=${self.S:02X}, P=${self.P:02X}"
+                + (f", exitCode={self.exitCode}" if self.exitCode is not None else "") + ")")
+
+def main():
+    """ Reads config.txt, loads the program from the console or from 'in.txt' and runs it with the console debug screen """
+    source = 0          # 0 - console, 1 - file
+    inputFormat = 0     # 0 - hex,     1 - assembly,   2 - binary (only from a file)
+    color = False       # 0 - off,     1 - on
+    mode = 0            # 0 - run,     1 - debug
+    correctConfig = True
+
+    # reading configuration
+    with open(f"{os.path.dirname(os.path.realpath(__file__))}/config.txt", "r") as f:
+        line = f.readline()[:-1]
+        if line == "source=console":
+            source = 0
+        elif line == "source=file":
+            source = 1
         else:
-            _ = os.system('clear')
-
-source = 0          # 0 - console, 1 - file
-inputFormat = 0     # 0 - hex,     1 - assembly
-color = False       # 0 - off,     1 - on
-mode = 0            # 0 - run,     1 - debug
-correctConfig = True
-
-# reading configuration
-with open(f"{os.path.dirname(os.path.realpath(__file__))}/config.txt", "r") as f:
-    line = f.readline()[:-1]
-    if line == "source=console":
-        source = 0
-    elif line == "source=file":
-        source = 1
-    else:
-        correctConfig = False
+            correctConfig = False
+
+        line = f.readline()[:-1]
+        if line == "format=hex":
+            inputFormat = 0
+        elif line == "format=assembly":
+            inputFormat = 1
+        elif line == "format=binary" and source == 1:
+            inputFormat = 2
+        else:
+            correctConfig = False
 
-    line = f.readline()[:-1]
-    if line == "format=hex":
-        inputFormat = 0
-    elif line == "format=assembly":
-        inputFormat = 1
-    else:
-        correctConfig = False
+        line = f.readline()[:-1]
+        if line == "color=off":
+            color = False
+        elif line == "color=on":
+            color = True
+        else:
+            correctConfig = False
 
-    line = f.readline()[:-1]
-    if line == "color=off":
-        color = False
-    elif line == "color=on":
-        color = True
-    else:
-        correctConfig = False
+        line = f.readline().strip()
+        if line == "mode=run":
+            mode = 0
+        elif line == "mode=debug":
+            mode = 1
+        else:
+            correctConfig = False
+
+        line = f.readline().strip()  # optional
+        if line == "" or line == "engine=interpreter":
+            engine = "interpreter"
+        elif line == "engine=jit":
+            engine = "jit"
+        elif line == "engine=aot":
+            engine = "aot"
+        else:
+            correctConfig = False
+
+        line = f.readline().strip()  # optional
+        if line == "" or line == "devices=off":
+            devices = None
+        elif line == "devices=on":
+            devices = "on"
+        elif line == "devices=all":
+            devices = "all"
+        else:
+            correctConfig = False
 
-    line = f.readline()
-    if line == "mode=run":
-        mode = 0
-    elif line == "mode=debug":
-        mode = 1
+    if correctConfig:
+        if os.name == 'nt':
+            os.system('')   # turns on ANSI escape codes in the console of windows
+        cpu = CPU()
+        cpu.engine = engine
+        if devices is not None:
+            cpu.bus.MapStandard(reads=devices == "all")
+        if source == 0 and inputFormat == 0:
+            cpu.HexInputConsole()
+        elif source == 0 and inputFormat == 1:
+            cpu.AssemblyInputConsole()
+        elif source == 1 and inputFormat == 0:
+            cpu.HexInputFile()
+        elif source == 1 and inputFormat == 1:
+            cpu.AssemblyInputFile()
+        elif source == 1 and inputFormat == 2:
+            cpu.BinaryInputFile()
+
+        cpu.RunInteractive(mode, color)
     else:
-        correctConfig = False
-
-if correctConfig:
-    cpu = CPU()
-    if source == 0 and inputFormat == 0:
-        cpu.HexInputConsole()
-    elif source == 0 and inputFormat == 1:
-        cpu.AssemblyInputConsole()
-    elif source == 1 and inputFormat == 0:
-        cpu.HexInputFile()
-    elif source == 1 and inputFormat == 1:
-        cpu.AssemblyInputFile()
-
-    cpu.Run(mode, color)
-else:
-    print("Incorrect configuration in config.txt, please set up file config.txt correctly!")
+        print("Incorrect configuration in config.txt, please set up file config.txt correctly!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+"""
+6502 emulator.
+
+The modules import each other relatively, so their generic names (bus, loader, session, ...) don't collide with other
+modules. Run them from the directory of the project as modules of the package:
+
+    python -m src._6502_Emulator
+    python -m src.benchmark --engine jit
+"""
@@ -0,0 +1,192 @@
+"""
+Ahead-of-time translation of a program image into a python module.
+
+All code reachable from the start of the program is split into basic blocks (see jit.py) and written into one python module,
+with a function for every block and the table BLOCKS, which gives the block for an address. The module is stored in the directory
+CACHE (__aotcache__ next to the sources, or the directory in the environment variable EMULATOR_AOT_CACHE) under the hash
+of the image, so the next run of the same image only imports it - python loads its compiled bytecode. The directory keeps
+at most MAX_MODULES modules, the least recently used ones are removed with their bytecode.
+
+Addresses which were not translated and the code which was overwritten while running are executed by the interpreter.
+Blocks which are loops of loops.py are executed by Loop.Execute like in the JIT.
+"""
+
+import hashlib
+import importlib.util
+import os
+import time
+
+from . import jit
+
+VERSION = 8     # change when the generated code changes, so the modules in the cache are translated again
+
+CACHE = os.environ.get("EMULATOR_AOT_CACHE") or os.path.join(os.path.dirname(os.path.realpath(__file__)), "__aotcache__")
+MAX_MODULES = 256   # modules kept in CACHE and in modules
+
+modules = {}    # key of the image: module, modules already imported in this process, the least recently used first
+
+
+def ImageKey(RAM, entries, start):
+    """ Returns hash of the image in memory from start to the end and of the entry points """
+    key = hashlib.sha256(f"{VERSION} {sorted(entries)}".encode())
+    key.update(memoryview(RAM)[start:])
+    return key.hexdigest()[:32]
+
+
+def CodeHash(RAM, blocks):
+    """ Returns hash of the bytes of all translated blocks - blocks is a list of pairs (start, end) """
+    code = hashlib.sha256()
+    for start, end in sorted(blocks):
+        code.update(RAM[start:end])
+    return code.hexdigest()
+
+
+def TranslateImage(RAM, entries):
+    """ Returns source of the module with all blocks reachable from the entry points """
+    functions = []
+    table = []
+    ranges = []
+    visited = set()
+    waiting = list(entries)
+
+    while waiting:
+        start = waiting.pop()
+        if start in visited:
+            continue
+        visited.add(start)
+
+        translation = jit.TranslateBlock(RAM, start, f"block_{start:04X}")
+        if translation is None:
+            continue
+        source, end, count, exits = translation
+        functions.append(source)
+        table.append(f"    0x{start:04X}: (block_{start:04X}, 0x{end:04X}, {count}),")
+        ranges.append((start, end))
+        waiting.extend(exits)
+
+    return "\n".join([
+        f'""" Generated by aot.py from a 6502 program, do not edit. """',
+        f"",
+        f"from {__package__}.bus import Exit",
+        f"from {__package__}.opcodes import ADC, NZ, NZVALUE, SBC",
+        f"",
+        f"",
+        "\n\n".join(functions),
+        f"",
+        f"BLOCKS = {{",
+        *sorted(table),
+        f"}}",
+        f"",
+        f"CODE = {sorted(ranges)!r}",
+        f"CODEHASH = {CodeHash(RAM, ranges)!r}",
+        f"",
+    ])
+
+
+def LoadModule(RAM, entries, start):
+    """ Returns module with the translated image - from this process, from the cache directory or translates it """
+    key = ImageKey(RAM, entries, start)
+    module = modules.pop(key, None)
+    if module is not None and module.CODEHASH == CodeHash(RAM, module.CODE):
+        modules[key] = module
+        return module
+
+    path = os.path.join(CACHE, f"aot_{key}.py")
+    if os.path.exists(path):
+        module = Import(key, path)
+        if module.CODEHASH == CodeHash(RAM, module.CODE):
+            Remember(key, module)
+            try:
+                # the time of access is the time of the last use, the time of modification validates the bytecode
+                os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+            except OSError:
+                pass
+            return module
+
+    # translated code outside of the hashed image can be different, so the module is always translated again then
+    os.makedirs(CACHE, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        f.write(TranslateImage(RAM, entries))
+    os.replace(temporary, path)
+    Prune()
+
+    module = Import(key, path)
+    Remember(key, module)
+    return module
+
+
+def Remember(key, module):
+    """ Puts the module into modules, removes the least recently used ones over MAX_MODULES """
+    modules[key] = module
+    while len(modules) > MAX_MODULES:
+        del modules[next(iter(modules))]
+    return
+
+
+def Prune():
+    """ Removes the least recently used modules over MAX_MODULES from CACHE with their bytecode """
+    paths = [os.path.join(CACHE, name) for name in os.listdir(CACHE) if name.startswith("aot_") and name.endswith(".py")]
+    if len(paths) <= MAX_MODULES:
+        return
+    used = {}
+    for path in paths:
+        try:
+            used[path] = os.stat(path).st_atime_ns
+        except OSError:
+            pass    # removed by another process
+    for path in sorted(used, key=used.get)[:len(used) - MAX_MODULES]:
+        for name in (path, importlib.util.cache_from_source(path)):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+    return
+
+
+def Import(key, path):
+    spec = importlib.util.spec_from_file_location(f"aot_{key}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class AOT(jit.JIT):
+    """ Runs the program with blocks from the translated module. Unlike the JIT it never translates while running. """
+
+    def __init__(self, cpu):
+        super().__init__(cpu)
+        self.loadCount = None   # cpu.loadCount when the module was chosen
+
+    def Prepare(self):
+        """ Finds the module for the image in memory and puts all its blocks into the cache, if a program was loaded since
+            the last run - loading removes the blocks on the loaded addresses, also when the same image is loaded again.
+            Code changed by the program itself is not translated again, it stays in the interpreter.
+        """
+        cpu = self.cpu
+        if cpu.loadCount == self.loadCount:
+            return
+        self.loadCount = cpu.loadCount
+
+        entries = {cpu.resetVector}
+        vector = cpu.RAM[0xFFFE] | cpu.RAM[0xFFFF] << 8
+        if vector:
+            entries.add(vector)     # handler of brk
+
+        self.Flush()
+        module = LoadModule(cpu.RAM, entries, cpu.resetVector)
+        for start, entry in module.BLOCKS.items():
+            if self.CompileLoop(start) is None:
+                self.AddBlock(start, entry)
+        return
+
+    def Compile(self, start):
+        """ Addresses outside of the translated code are left to the interpreter, only loops are recognized (see loops.py) """
+        return self.CompileLoop(start)
+
+    def Run(self, maxInstructions):
+        self.Prepare()
+        return super().Run(maxInstructions)
+
+    def Report(self):
+        return f"AOT blocks {len(self.blocks)}  executed {self.dispatches}  interpreted instructions {self.interpreted}"
@@ -0,0 +1,505 @@
+"""
+Two-pass assembler of the 6502 assembly.
+
+The first pass finds the address of every line and so the values of the labels, the second pass evaluates the operands
+and writes the bytes. Lines look like:
+
+    ; comment
+    length = 7                  ; constant
+    .org $0000                  ; following lines are assembled from the address
+    numbers: .byte $05, 2, %11, "text"
+    .word table + 2, $1234      ; 2 bytes each, low byte first
+    .incbin "data.bin"          ; bytes of the file
+    .org $8000
+    loop:   lda numbers,X       ; label followed by an instruction
+            cmp #<length + 1
+            bne loop            ; offset of the branch is computed from the label
+            sta (pointer),Y     ; also (zp,X), (abs) for jmp, zp,X, zp,Y and abs,Y
+
+An address operand is assembled on the zero page when the instruction has the zero page mode and the address is known
+to be there in the first pass - a number with at most 2 hexadecimal digits ($10, 16) or an expression of numbers and constants
+defined before. Labels and numbers with more digits ($0010) give the absolute mode.
+
+Numbers are written as $FF, 0xFF, %1010, 0b1010, 123 or 'c'. Expressions have operators | ^ & << >> + - * / and unary
+- ~ < (low byte) > (high byte), with the precedence of python, * on the place of a number is the address of the line.
+
+The format of the first version of the emulator still works: an operand of a branch written as $HH or #$HH is the offset
+itself, not the target address.
+"""
+
+import hashlib
+import os
+import re
+
+from .opcodes import ENCODE, OPCODES
+
+
+class AssemblyError(ValueError):
+    """ Error in the source, line is the number of the line (from 1) """
+
+    def __init__(self, message, line=None, text=None):
+        self.line = line
+        if line is not None:
+            message = f"line {line}: {message}"
+            if text is not None:
+                message += f": {text.strip()}"
+        super().__init__(message)
+
+
+class Program():
+    """ Assembled program - segments is a list of (address, bytes), symbols a dictionary of the labels and constants """
+
+    def __init__(self, segments, symbols, includes=()):
+        self.segments = segments
+        self.symbols = symbols
+        self.includes = includes    # (path, hash) of the included files, the cached program is valid while they don't change
+
+    def __repr__(self):
+        return "Program(" + ", ".join(f"${address:04X}: {len(data)} bytes" for address, data in self.segments) + ")"
+
+
+# ---- EXPRESSIONS ----
+
+NUMBER = re.compile(r"^\$([0-9A-Fa-f]+)$")
+SYMBOL = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+TOKEN = re.compile(r"""\s*(?:
+    (?P<number>\$[0-9A-Fa-f]+|0[xX][0-9A-Fa-f]+|%[01]+|0[bB][01]+|[0-9]+)
+    |(?P<symbol>[A-Za-z_][A-Za-z0-9_]*)
+    |'(?P<char>.)'
+    |(?P<operator><<|>>|[-+*/&|^~()<>])
+    )""", re.VERBOSE)
+
+# binary operator: (precedence, function)
+BINARY = {
+    "|": (1, lambda a, b: a | b),
+    "^": (2, lambda a, b: a ^ b),
+    "&": (3, lambda a, b: a & b),
+    "<<": (4, lambda a, b: a << b),
+    ">>": (4, lambda a, b: a >> b),
+    "+": (5, lambda a, b: a + b),
+    "-": (5, lambda a, b: a - b),
+    "*": (6, lambda a, b: a * b),
+    "/": (6, lambda a, b: a // b),
+}
+
+UNARY = {
+    "-": lambda a: -a,
+    "~": lambda a: ~a,
+    "<": lambda a: a & 0xFF,
+    ">": lambda a: (a >> 8) & 0xFF,
+}
+
+
+def Tokens(text):
+    """ Returns list of (kind, token) of the expression """
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None:
+            raise ValueError(f"not valid expression {text.strip()}")
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+    return tokens
+
+
+def ParseNumber(token):
+    if token[0] == "$":
+        return int(token[1:], 16)
+    if token[0] == "%":
+        return int(token[1:], 2)
+    return int(token, 0) if token[:2].lower() in ("0x", "0b") else int(token)
+
+
+class Expression():
+    """ Evaluates expression from the tokens by precedence climbing """
+
+    def __init__(self, tokens, symbols, pc):
+        self.tokens = tokens
+        self.index = 0
+        self.symbols = symbols
+        self.pc = pc
+
+    def Next(self):
+        token = self.tokens[self.index] if self.index < len(self.tokens) else (None, None)
+        self.index += 1
+        return token
+
+    def Peek(self):
+        return self.tokens[self.index] if self.index < len(self.tokens) else (None, None)
+
+    def Binary(self, precedence):
+        left = self.Unary()
+        while True:
+            kind, token = self.Peek()
+            if kind != "operator" or token not in BINARY or BINARY[token][0] < precedence:
+                return left
+            self.index += 1
+            operatorPrecedence, function = BINARY[token]
+            right = self.Binary(operatorPrecedence + 1)
+            if token == "/" and right == 0:
+                raise ValueError("division by zero")
+            left = function(left, right)
+
+    def Unary(self):
+        kind, token = self.Next()
+        if kind == "number":
+            return ParseNumber(token)
+        if kind == "char":
+            return ord(token)
+        if kind == "symbol":
+            if token not in self.symbols:
+                raise KeyError(token)
+            return self.symbols[token]
+        if kind == "operator":
+            if token == "(":
+                value = self.Binary(1)
+                if self.Next() != ("operator", ")"):
+                    raise ValueError("missing )")
+                return value
+            if token == "*":
+                return self.pc
+            if token in UNARY:
+                return UNARY[token](self.Unary())
+        raise ValueError("not valid expression")
+
+
+def Evaluate(text, symbols, pc):
+    """ Returns the value of the expression text. Raises KeyError with the name of an unknown symbol and ValueError. """
+    text = text.strip()
+    match = NUMBER.match(text)
+    if match:
+        return int(match.group(1), 16)
+    if SYMBOL.match(text):
+        if text not in symbols:
+            raise KeyError(text)
+        return symbols[text]
+
+    expression = Expression(Tokens(text), symbols, pc)
+    value = expression.Binary(1)
+    if expression.index != len(expression.tokens):
+        raise ValueError(f"not valid expression {text}")
+    return value
+
+
+# ---- LINES ----
+
+# label:, constant = expression, mnemonic or directive with the operand
+LINE = re.compile(r"^\s*(?:([A-Za-z_][A-Za-z0-9_]*)\s*:)?\s*(?:([A-Za-z_][A-Za-z0-9_]*)\s*=\s*(.*?)|(\.?[A-Za-z]+)(?:\s+(.*?))?)?\s*$")
+
+# address mode: pattern of the operand with one group - the expression, the first matching mode is used
+OPERANDS = [
+    ("A", r"([Aa])"),
+    ("imm", r"#(.+)"),
+    ("ind,X", r"\((.+?)\s*,\s*[Xx]\s*\)"),
+    ("ind,Y", r"\((.+?)\)\s*,\s*[Yy]"),
+    ("abs,X", r"(.+?)\s*,\s*[Xx]"),
+    ("abs,Y", r"(.+?)\s*,\s*[Yy]"),
+    ("ind", r"(\(.+\))"),
+    ("abs", r"(.+)"),
+]
+OPERAND = re.compile("^(?:" + "|".join(pattern for mode, pattern in OPERANDS) + ")$")
+MODES = {index: mode for index, (mode, pattern) in enumerate(OPERANDS, 1)}     # number of the group: mode
+RAW_OFFSET = re.compile(r"^#?\$[0-9A-Fa-f]{1,2}$")    # operand of a branch in the format of the first version
+
+BRANCHES = {mnemonic for mnemonic, mode in ENCODE if mode == "rel"}
+RESERVED = {mnemonic for mnemonic, mode in ENCODE} | {"a", "x", "y"}    # names which can't be labels
+LONG_NUMBER = re.compile(r"^(\$|0[xX])[0-9A-Fa-f]{3,}$")    # number written as a word, which is never on the zero page
+
+
+def StripComment(line):
+    """ Returns the line without the comment after ; (which is not in quotes) """
+    if ";" not in line:
+        return line
+    quote = None
+    for index, char in enumerate(line):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == ";":
+            return line[:index]
+    return line
+
+
+def SplitArguments(text):
+    """ Splits arguments of a directive by the commas, which are not in quotes or parentheses """
+    arguments = []
+    depth = 0
+    quote = None
+    start = 0
+    for index, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            arguments.append(text[start:index].strip())
+            start = index + 1
+    arguments.append(text[start:].strip())
+    return arguments
+
+
+def SplitLine(text):
+    """ Returns the groups of LINE for the line without the comment or None if it isn't valid. A line without a label
+        and a constant is split by the whitespace, which is faster than the pattern.
+    """
+    line = StripComment(text)
+    if ":" not in line and "=" not in line:
+        parts = line.split(None, 1)
+        if not parts:
+            return None, None, None, None, None
+        name = parts[0]
+        if name.isascii() and (name[1:] if name[0] == "." else name).isalpha():
+            return None, None, None, name, parts[1].rstrip() if len(parts) > 1 else None
+    match = LINE.match(line)
+    return match.groups() if match is not None else None
+
+
+def InstructionMode(mnemonic, operand):
+    """ Returns (address mode, expression of the operand, if a branch has the offset itself) """
+    if not operand:
+        return "imp", None, False
+    if mnemonic in BRANCHES:
+        raw = RAW_OFFSET.match(operand) is not None
+        return "rel", operand.lstrip("#"), raw or operand.startswith("#")
+    # the most common modes without the pattern
+    if operand[0] == "#" and len(operand) > 1:
+        return "imm", operand[1:], False
+    if "," not in operand and "(" not in operand and operand not in ("A", "a"):
+        return "abs", operand, False
+    match = OPERAND.match(operand)
+    if match is None:
+        raise ValueError(f"not known operand {operand}")
+    return MODES[match.lastindex], match.group(match.lastindex), False
+
+
+# ---- ASSEMBLER ----
+
+CACHE = {}          # hash of the source and origin: Program
+CACHE_SIZE = 64
+
+
+def FileHash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def Assemble(source, origin=0x8000, directory=None, cache=True):
+    """ Assembles the source starting at origin and returns Program. Files of .incbin are relative to directory
+        (the current directory if not given). Programs are cached by the hash of the source.
+        Raises AssemblyError with the number of the line.
+    """
+    if cache:
+        key = hashlib.sha256(f"{origin} {directory}\n{source}".encode()).hexdigest()
+        program = CACHE.get(key)
+        if program is not None and all(os.path.exists(path) and FileHash(path) == digest for path, digest in program.includes):
+            return program
+
+    program = Assembler(origin, directory).Assemble(source)
+    if cache:
+        if len(CACHE) >= CACHE_SIZE:
+            del CACHE[next(iter(CACHE))]
+        CACHE[key] = program
+    return program
+
+
+class Assembler():
+    """ State of one assembling: symbols, address and the lines found by the first pass """
+
+    def __init__(self, origin=0x8000, directory=None):
+        self.origin = origin
+        self.directory = directory
+        self.symbols = {}
+        self.labels = set()     # names of the symbols which are labels, not constants
+        self.includes = []
+
+    def Value(self, expression, pc, number, text):
+        """ Evaluates the expression on the line, errors are raised as AssemblyError """
+        try:
+            return Evaluate(expression, self.symbols, pc)
+        except KeyError as error:
+            raise AssemblyError(f"not known symbol {error.args[0]}", number, text) from None
+        except ValueError as error:
+            raise AssemblyError(str(error), number, text) from None
+
+    def Assemble(self, source):
+        return self.Second(self.First(source))
+
+    def First(self, source):
+        """ Finds the address and the length of every line and the values of the labels and constants.
+            Returns list of (number, text, address, kind, arguments).
+        """
+        items = []
+        address = self.origin
+        for number, text in enumerate(source.splitlines(), 1):
+            groups = SplitLine(text)
+            if groups is None:
+                raise AssemblyError("not valid line", number, text)
+            label, constant, value, name, operand = groups
+            if label is not None:
+                self.Define(label, address, number, text)
+                self.labels.add(label)
+            if constant is not None:
+                self.Define(constant, self.Value(value, address, number, text), number, text)
+                continue
+            if name is None:
+                continue
+            name = name.lower()
+            operand = operand or ""
+
+            if name == ".org":
+                address = self.Value(operand, address, number, text)
+                if not 0 <= address <= 0xFFFF:
+                    raise AssemblyError(f"address ${address:X} is out of memory", number, text)
+                continue
+            if name == ".byte":
+                arguments = SplitArguments(operand)
+                length = sum(len(argument) - 2 if argument[:1] == '"' else 1 for argument in arguments)
+                items.append((number, text, address, ".byte", arguments))
+            elif name == ".word":
+                arguments = SplitArguments(operand)
+                length = 2 * len(arguments)
+                items.append((number, text, address, ".word", arguments))
+            elif name == ".incbin":
+                data = self.Include(operand, number, text)
+                length = len(data)
+                items.append((number, text, address, ".incbin", data))
+            elif name.startswith("."):
+                raise AssemblyError(f"not known directive {name}", number, text)
+            else:
+                try:
+                    mode, expression, raw = InstructionMode(name, operand)
+                except ValueError as error:
+                    raise AssemblyError(str(error), number, text) from None
+                if mode == "ind" and name != "jmp":
+                    mode = "abs"    # only jmp has (abs), otherwise the parentheses are a part of the expression
+                if mode in ("abs", "abs,X", "abs,Y"):
+                    zeroPage = "zp" + mode[3:]
+                    if (name, zeroPage) in ENCODE and ((name, mode) not in ENCODE or self.ZeroPage(expression)):
+                        mode = zeroPage
+                opcode = ENCODE.get((name, mode))
+                if opcode is None and mode == "imp":
+                    opcode = ENCODE.get((name, "A"))    # asl is the same as asl A
+                if opcode is None:
+                    raise AssemblyError("not known instruction", number, text)
+                length = OPCODES[opcode].length
+                items.append((number, text, address, "instruction", (opcode, expression, raw)))
+
+            if address + length > 0x10000:
+                raise AssemblyError("program doesn't fit into memory", number, text)
+            address += length
+        return items
+
+    def ZeroPage(self, expression):
+        """ Returns True if the address expression is known to be on the zero page in the first pass """
+        match = NUMBER.match(expression)
+        if match:
+            return len(match.group(1)) <= 2
+        if SYMBOL.match(expression):
+            value = self.symbols.get(expression)
+            return expression not in self.labels and value is not None and 0 <= value <= 0xFF
+        try:
+            tokens = Tokens(expression)
+        except ValueError:
+            return False
+        for kind, token in tokens:
+            if kind == "symbol" and (token in self.labels or token not in self.symbols):
+                return False
+            if kind == "number" and LONG_NUMBER.match(token):
+                return False
+        try:
+            # an expression with * (the address of the line) is not known in the first pass
+            value = Evaluate(expression, self.symbols, 0)
+            return 0 <= value <= 0xFF and value == Evaluate(expression, self.symbols, 0xFFFF)
+        except (KeyError, ValueError):
+            return False
+
+    def Define(self, name, value, number, text):
+        if name in self.symbols:
+            raise AssemblyError(f"{name} is already defined", number, text)
+        if name.lower() in RESERVED:
+            raise AssemblyError(f"{name} is a reserved name", number, text)
+        self.symbols[name] = value
+        return
+
+    def Include(self, operand, number, text):
+        """ Returns the bytes of the file of .incbin "path" """
+        path = operand.strip()
+        if len(path) < 2 or path[0] != '"' or path[-1] != '"':
+            raise AssemblyError('the file of .incbin must be in quotes "path"', number, text)
+        path = os.path.join(self.directory or os.getcwd(), path[1:-1])
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as error:
+            raise AssemblyError(f"can't read {path}: {error.strerror}", number, text) from None
+        self.includes.append((path, hashlib.sha256(data).hexdigest()))
+        return data
+
+    def Second(self, items):
+        """ Evaluates the operands and returns Program with the segments of continuous bytes """
+        segments = []   # (address, bytes, number of the first line)
+        data = bytearray()
+        start = None
+        for number, text, address, kind, arguments in items:
+            if start is None or start + len(data) != address:
+                if data:
+                    segments.append((start, bytes(data), first))
+                data = bytearray()
+                start = address
+                first = number
+            if kind == "instruction":
+                data += self.Instruction(address, arguments, number, text)
+            elif kind == ".byte":
+                for argument in arguments:
+                    if argument[:1] == '"':
+                        if len(argument) < 2 or argument[-1] != '"':
+                            raise AssemblyError("string is not closed", number, text)
+                        data += argument[1:-1].encode("latin-1")
+                    else:
+                        data.append(self.Fit(self.Value(argument, address, number, text), 0xFF, number, text))
+            elif kind == ".word":
+                for argument in arguments:
+                    value = self.Fit(self.Value(argument, address, number, text), 0xFFFF, number, text)
+                    data += bytes((value & 0xFF, value >> 8))
+            elif kind == ".incbin":
+                data += arguments
+        if data:
+            segments.append((start, bytes(data), first))
+
+        segments.sort()
+        for (address, data, number), (nextAddress, nextData, nextNumber) in zip(segments, segments[1:]):
+            if address + len(data) > nextAddress:
+                raise AssemblyError(f"bytes from ${nextAddress:04X} overwrite bytes from line {number}", nextNumber)
+        return Program([(address, data) for address, data, number in segments], self.symbols, tuple(self.includes))
+
+    def Fit(self, value, maximum, number, text):
+        """ Returns value in the range of a byte or a word (negative numbers in two's complement) """
+        if not -(maximum + 1) // 2 <= value <= maximum:
+            raise AssemblyError(f"value {value} doesn't fit into {'a byte' if maximum == 0xFF else 'a word'}", number, text)
+        return value & maximum
+
+    def Instruction(self, address, arguments, number, text):
+        """ Returns bytes of the instruction at address """
+        opcode, expression, raw = arguments
+        op = OPCODES[opcode]
+        if op.length == 1:
+            return bytes((opcode,))
+        value = self.Value(expression, address, number, text)
+        if op.mode == "rel" and not raw:
+            offset = value - (address + op.length)
+            if not -0x80 <= offset <= 0x7F:
+                raise AssemblyError(f"branch target ${value:04X} is too far ({offset} bytes)", number, text)
+            value = offset
+        if op.length == 2:
+            return bytes((opcode, self.Fit(value, 0xFF, number, text)))
+        value = self.Fit(value, 0xFFFF, number, text)
+        return bytes((opcode, value & 0xFF, value >> 8))
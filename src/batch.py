@@ -0,0 +1,242 @@
+"""
+Batch runs of one program with many inputs.
+
+The program is assembled once in every worker process of a multiprocessing pool. Every job is a set of patches of memory
+(for example the numbers to sort at $0000), which are written into the assembled image before the run. Results - registers,
+number of instructions and cycles and slices of memory after the run - come back in the order of the jobs.
+
+Jobs are read from a JSONL file (or standard input), one job on a line, with addresses and bytes in hexadecimal:
+
+    {"0000": "05 03 12 01 E8 18 02"}
+
+    python batch.py tests/bubbleSort.txt jobs.jsonl --slice 0000:0007 --output results.jsonl
+    python batch.py tests/bubbleSort.txt jobs.jsonl --slice 0000:0007 --output results.npz     # needs numpy
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+
+from ._6502_Emulator import CPU
+
+REGISTERS = ("A", "X", "Y", "P", "PC", "S")
+
+
+# ---- JOBS ----
+
+def ParsePatches(line):
+    """ Returns list of (address, bytes) from a line of JSON {"address": "hex bytes"} """
+    return [(int(address.lstrip("$"), 16), bytes.fromhex(data)) for address, data in json.loads(line).items()]
+
+
+def ParseSlice(text):
+    """ Returns (start, end) of the slice of memory written as 'start:end' in hexadecimal (end is not included) """
+    start, end = (int(part.lstrip("$"), 16) for part in text.split(":"))
+    if not 0 <= start < end <= 0x10000:
+        raise ValueError(f"bad slice of memory {text}")
+    return start, end
+
+
+def ReadJobs(f):
+    """ Yields patches of the jobs in the JSONL file f, empty lines are skipped """
+    for number, line in enumerate(f, 1):
+        if line.strip():
+            try:
+                yield ParsePatches(line)
+            except ValueError as error:
+                raise ValueError(f"job on line {number}: {error}") from None
+
+
+# ---- WORKER ----
+
+class Worker():
+    """ CPU with the assembled program, which runs jobs from the same snapshot """
+
+    def __init__(self, source, slices, engine="interpreter", maxInstructions=None):
+        self.cpu = CPU()
+        self.cpu.engine = engine
+        self.cpu.LoadAssembly(source)
+        self.image = bytes(self.cpu.RAM)
+        self.start = self.cpu.Snapshot()    # every job starts from it, restoring copies only the pages the last job wrote
+        self.slices = slices
+        self.maxInstructions = maxInstructions
+        self.lockstep = None
+
+    def Run(self, patches):
+        """ Runs the program with the patches of memory. Returns the result as a dictionary. """
+        cpu = self.cpu
+        cpu.Restore(self.start)
+        for address, data in patches:
+            CheckPatch(address, data)
+            cpu.RAM[address:address + len(data)] = data
+            cpu.Written(address, address + len(data))
+        result = cpu.Run(self.maxInstructions)
+        registers = {register: getattr(result, register) for register in REGISTERS}
+        return Result(registers, result.reason, result.instructions, result.cycles, cpu.RAM, self.slices)
+
+    def RunLockstep(self, jobs):
+        """ Runs the jobs (list of patches) together in the lockstep engine (see lockstep.py). Returns list of the results. """
+        from .lockstep import Lockstep
+
+        if self.lockstep is None or len(self.lockstep) != len(jobs):
+            self.lockstep = Lockstep(len(jobs), self.cpu.resetVector)
+        engine = self.lockstep
+        engine.Reset()
+        engine.Load(self.image, 0)
+        for index, patches in enumerate(jobs):
+            for address, data in patches:
+                CheckPatch(address, data)
+                engine.RAM[index, address:address + len(data)] = bytearray(data)
+        counts, reasons = engine.Run(self.maxInstructions)
+        results = []
+        for index in range(len(jobs)):
+            registers = {register: int(getattr(engine, register)[index]) for register in REGISTERS}
+            results.append(Result(registers, reasons[index], int(counts[index]), int(engine.cycles[index]), engine.RAM[index], self.slices))
+        return results
+
+
+def CheckPatch(address, data):
+    if address + len(data) > 0x10000:
+        raise ValueError(f"{len(data)} bytes do not fit into memory at ${address:04X}")
+
+
+def Result(registers, reason, instructions, cycles, RAM, slices):
+    """ Returns the result of a job as a dictionary """
+    return {
+        "reason": reason,
+        "instructions": instructions,
+        "cycles": cycles,
+        **registers,
+        "memory": {f"{start:04X}": bytes(RAM[start:end]).hex() for start, end in slices},
+    }
+
+
+worker = None   # Worker of the process of the pool
+
+
+def InitWorker(source, slices, engine, maxInstructions):
+    global worker
+    worker = Worker(source, slices, engine, maxInstructions)
+
+
+def RunJob(patches):
+    return worker.Run(patches)
+
+
+def RunJobs(jobs):
+    return worker.RunLockstep(jobs)
+
+
+def Chunks(jobs, size):
+    """ Yields lists of size jobs (the last one can be shorter) """
+    jobs = iter(jobs)
+    while True:
+        chunk = list(itertools.islice(jobs, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# ---- BATCH ----
+
+def RunBatch(source, jobs, slices, engine="interpreter", maxInstructions=None, processes=None, chunksize=64):
+    """ Runs the program (assembly source) once for every job (list of patches) in a pool of processes (all cores by default).
+        Yields results in the order of the jobs as soon as they are done. jobs can be any iterable, it is read as the pool needs it.
+        With the engine 'lockstep' every process runs chunksize jobs at once in the lockstep engine.
+    """
+    initargs = (source, slices, engine, maxInstructions)
+    if engine == "lockstep":
+        function, jobs, chunksize = RunJobs, Chunks(jobs, chunksize), 1
+    else:
+        function = RunJob
+
+    if processes == 1:
+        InitWorker(*initargs)
+        results = map(function, jobs)
+    else:
+        pool = multiprocessing.Pool(processes, InitWorker, initargs)
+        results = pool.imap(function, jobs, chunksize)
+
+    try:
+        for result in results:
+            if engine == "lockstep":
+                yield from result
+            else:
+                yield result
+    finally:
+        if processes != 1:
+            pool.terminate()
+    return
+
+
+def WriteJSONL(results, f):
+    """ Writes every result as a line of JSON, returns the number of results """
+    count = 0
+    for count, result in enumerate(results, 1):
+        f.write(json.dumps(result) + "\n")
+    return count
+
+
+def WriteNPZ(results, path, slices):
+    """ Writes the results into a NumPy .npz file with arrays reason, instructions, cycles, the registers
+        and memory_XXXX (jobs x length of the slice) for every slice. Returns the number of results.
+    """
+    import numpy
+
+    columns = {name: [] for name in ("reason", "instructions", "cycles", *REGISTERS)}
+    memory = {start: bytearray() for start, end in slices}
+    for result in results:
+        for name, values in columns.items():
+            values.append(result[name])
+        for start in memory:
+            memory[start] += bytes.fromhex(result["memory"][f"{start:04X}"])
+
+    arrays = {
+        "reason": numpy.array(columns.pop("reason")),
+        "instructions": numpy.array(columns.pop("instructions"), dtype=numpy.int64),
+        "cycles": numpy.array(columns.pop("cycles"), dtype=numpy.int64),
+        "PC": numpy.array(columns.pop("PC"), dtype=numpy.uint16),
+    }
+    arrays.update((name, numpy.array(values, dtype=numpy.uint8)) for name, values in columns.items())
+    for start, end in slices:
+        arrays[f"memory_{start:04X}"] = numpy.frombuffer(bytes(memory[start]), dtype=numpy.uint8).reshape(-1, end - start)
+    numpy.savez(path, **arrays)
+    return len(arrays["reason"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a 6502 program once for every job of patches of memory")
+    parser.add_argument("program", help="file with the program in assembly")
+    parser.add_argument("jobs", nargs="?", default="-", help="JSONL file with the jobs (standard input if not given)")
+    parser.add_argument("--slice", action="append", default=[], metavar="START:END",
+                        help="slice of memory (hexadecimal, END not included) written into the results, can be repeated")
+    parser.add_argument("--output", default="-", help="file for the results, .jsonl or .npz (standard output if not given)")
+    parser.add_argument("--engine", default="interpreter", choices=["interpreter", "jit", "aot", "lockstep"])
+    parser.add_argument("--limit", type=int, help="maximum number of instructions of one run")
+    parser.add_argument("--processes", type=int, help="number of processes (all cores by default)")
+    parser.add_argument("--chunksize", type=int, default=64, help="number of jobs sent to a process at once (run together by the engine lockstep)")
+    args = parser.parse_args()
+
+    with open(args.program) as f:
+        source = f.read()
+    slices = [ParseSlice(text) for text in args.slice]
+    jobsFile = sys.stdin if args.jobs == "-" else open(args.jobs)
+
+    with jobsFile:
+        results = RunBatch(source, ReadJobs(jobsFile), slices, args.engine, args.limit, args.processes, args.chunksize)
+        if os.path.splitext(args.output)[1] == ".npz":
+            count = WriteNPZ(results, args.output, slices)
+        elif args.output == "-":
+            count = WriteJSONL(results, sys.stdout)
+        else:
+            with open(args.output, "w") as f:
+                count = WriteJSONL(results, f)
+    print(f"{count} jobs", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
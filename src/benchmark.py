@@ -0,0 +1,341 @@
+"""
+Benchmarks of the emulator.
+
+Runs the programs in the directory tests and larger synthetic programs (long loops, copying of memory, sorting of 200 numbers)
+without the console, every one several times, and reports executed instructions per second with the standard deviation.
+After every run the state of the memory and the registers is checked, so a fast but wrong emulator doesn't pass.
+Benchmarks 'assemble' and 'encode' measure the assembler (assembler.py) and the disassembler (CPU.Encode).
+
+Results can be written into a JSON file and compared with a JSON file of an earlier run (the baseline):
+
+    python benchmark.py --output results.json
+    python benchmark.py --baseline results.json --engine jit
+
+The programs run on the same CPU again and again, like a program run many times. With the JIT and AOT the column
+'translated' shows the part of the instructions executed by the translated code and not by the interpreter.
+
+The exit code is 1 if some benchmark gives a wrong result, is slower than the baseline by more than the tolerance or
+the JIT or AOT executed less than MIN_TRANSLATED of its instructions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+from . import assembler
+from ._6502_Emulator import CPU
+
+TESTS = os.path.join(os.path.dirname(os.path.realpath(__file__)), "tests")
+MIN_TRANSLATED = 0.5    # the least part of the instructions, which the JIT and AOT have to execute by the translated code
+
+
+def ReadTest(name):
+    with open(os.path.join(TESTS, f"{name}.txt")) as f:
+        return f.read()
+
+
+# ---- PROGRAMS ----
+
+LOOP = """ldy #$00
+ldx #$00
+clc
+adc #$01
+sta $0200,X
+inx
+bne $F7
+dey
+bne $F2
+"""
+
+
+def CopySource(pages):
+    """ Returns program copying pages of memory from $1000 to $3000, 16 times """
+    lines = ["ldy #$10", "ldx #$00"]
+    for page in range(pages):
+        lines.append(f"lda ${0x1000 + page * 0x100:04X},X")
+        lines.append(f"sta ${0x3000 + page * 0x100:04X},X")
+    inner = -(pages * 6 + 3)    # from the end of the first bne back to the first lda
+    outer = inner - 5           # from the end of the second bne back to ldx
+    lines += ["inx", f"bne ${inner & 0xFF:02X}", "dey", f"bne ${outer & 0xFF:02X}"]
+    return "\n".join(lines) + "\n"
+
+
+SORT_LENGTH = 200
+
+# bubble sort of the numbers at $0300, $0200 is set when numbers were swapped in the pass
+SORT = f"""lda #$00
+sta $0200
+ldx #$00
+lda $0300,X
+cmp $0301,X
+bcc $12
+beq $10
+tay
+lda $0301,X
+sta $0300,X
+tya
+sta $0301,X
+lda #$01
+sta $0200
+inx
+txa
+cmp #${SORT_LENGTH - 1:02X}
+bne $E0
+lda $0200
+bne $D4
+"""
+
+
+def SortData():
+    numbers = random.Random(6502).choices(range(0x100), k=SORT_LENGTH)
+    return {0x0300: bytes(numbers)}
+
+
+def CopyData():
+    return {0x1000: bytes(random.Random(6502).choices(range(0x100), k=0x1000))}
+
+
+# ---- CHECKS ----
+# Every check gets the CPU after the run and the data of the program and returns True if the program ended correctly.
+
+
+def CheckBubbleSort(cpu, data):
+    return cpu.RAM[0:7] == bytes([0x01, 0x02, 0x03, 0x05, 0x12, 0x18, 0xE8]) and cpu.PC == 0x803A
+
+
+def CheckFibonacci(cpu, data):
+    # the biggest 2-byte fibonacci number 46368 and the next one without the overflow
+    return cpu.RAM[0:4] == (46368).to_bytes(2, "little") + (75025 & 0xFFFF).to_bytes(2, "little") and cpu.PC == 0x809A
+
+
+def CheckSelfDestruct(cpu, data):
+    return cpu.RAM[0x8008:0x8100] == bytes([0xFF] * 0xF8) and cpu.PC == 0xFF02
+
+
+def CheckLoop(cpu, data):
+    return cpu.RAM[0x0200:0x0300] == bytes((x + 1) & 0xFF for x in range(0x100)) and cpu.A == 0 and cpu.Y == 0
+
+
+def CheckCopy(cpu, data):
+    return cpu.RAM[0x3000:0x4000] == data[0x1000]
+
+
+def CheckSort(cpu, data):
+    return cpu.RAM[0x0300:0x0300 + SORT_LENGTH] == bytes(sorted(data[0x0300]))
+
+
+class Benchmark():
+    """ Program in assembly with the data loaded into memory before the run and the check of the result """
+
+    def __init__(self, name, source, check, data=None):
+        self.name = name
+        self.source = source
+        self.check = check
+        self.data = data or {}
+
+    def Run(self, cpu):
+        """ Loads the program and the data into the cleared memory of the cpu and runs it. Returns RunResult. """
+        cpu.Reset(clearMemory=True)
+        cpu.LoadAssembly(self.source)
+        for address, data in self.data.items():
+            cpu.Load(data, address)
+        return cpu.Run()
+
+
+def Programs():
+    return [
+        Benchmark("bubbleSort", ReadTest("bubbleSort"), CheckBubbleSort),
+        Benchmark("fibonacci", ReadTest("fibonacci"), CheckFibonacci),
+        Benchmark("self-destruct", ReadTest("self-destruct"), CheckSelfDestruct),
+        Benchmark("loop", LOOP, CheckLoop),
+        Benchmark("copy", CopySource(16), CheckCopy, CopyData()),
+        Benchmark("sort", SORT, CheckSort, SortData()),
+    ]
+
+
+# ---- MEASUREMENT ----
+
+def Summary(name, unit, rates, correct, **counts):
+    return {
+        "name": name,
+        "unit": unit,
+        "mean": statistics.mean(rates),
+        "stdev": statistics.stdev(rates) if len(rates) > 1 else 0.0,
+        "best": max(rates),
+        "runs": rates,
+        "correct": correct,
+        **counts,
+    }
+
+
+def Translator(cpu):
+    """ Returns the JIT or AOT running the program of the cpu, None for the interpreter """
+    return {"jit": cpu.jit, "aot": cpu.aot}.get(cpu.engine)
+
+
+def MeasureProgram(benchmark, engine, repeat):
+    """ Runs the benchmark repeat times (after one run to warm up) on the same CPU and returns its summary in instructions
+        per second. With the JIT or AOT the summary has also the part of the instructions executed by the translated code.
+    """
+    cpu = CPU()
+    cpu.engine = engine
+    benchmark.Run(cpu)
+
+    rates = []
+    correct = True
+    translator = Translator(cpu)
+    interpreted = translator.interpreted if translator is not None else 0
+    total = 0
+    for i in range(repeat):
+        result = benchmark.Run(cpu)
+        rates.append(result.instructions / result.seconds)
+        correct = correct and result.reason == "brk" and benchmark.check(cpu, benchmark.data)
+        total += result.instructions
+    counts = dict(instructions=result.instructions, cycles=result.cycles)
+    if translator is not None:
+        counts["translated"] = 1 - (translator.interpreted - interpreted) / total
+    return Summary(benchmark.name, "instructions/s", rates, correct, **counts)
+
+
+def RoundTrip(cpu, start, end):
+    """ Returns True if the disassembled code from start to end assembles back to the same bytes """
+    listing = []
+    index = start
+    while index < end:
+        ins_s, index = cpu.Encode(index)
+        listing.append(ins_s)
+    check = CPU()
+    counter = start
+    for line in listing:
+        counter = check.Translate(line, counter)
+    return check.RAM[start:end] == cpu.RAM[start:end]
+
+
+def MeasureAssemble(repeat):
+    """ Assembles 10000 lines of the test programs without the cache - lines per second """
+    source = "\n".join(ReadTest(name) for name in ("fibonacci", "self-destruct"))
+    lines = [line for line in source.splitlines() if line.split()]
+    lines = (lines * (10000 // len(lines) + 1))[:10000]
+    source = "\n".join(lines)
+    rates = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        program = assembler.Assemble(source, 0x1000, cache=False)
+        rates.append(len(lines) / (time.perf_counter() - start))
+
+    cpu = CPU()
+    address, data = program.segments[0]
+    cpu.Load(data, address)
+    return Summary("assemble", "lines/s", rates, RoundTrip(cpu, address, address + len(data)), lines=len(lines))
+
+
+def MeasureEncode(repeat):
+    """ Disassembles all the programs of the benchmarks - instructions per second """
+    cpu = CPU()
+    image = bytearray()
+    for benchmark in Programs():
+        cpu.Reset(clearMemory=True)
+        cpu.LoadAssembly(benchmark.source)
+        image += cpu.RAM[cpu.resetVector:cpu.resetVector + 0x100]
+    cpu.Load(bytes(image), 0x1000)
+    end = 0x1000 + len(image)
+
+    rates = []
+    for i in range(repeat):
+        count = 0
+        index = 0x1000
+        start = time.perf_counter()
+        while index < end:
+            ins_s, index = cpu.Encode(index)
+            count += 1
+        rates.append(count / (time.perf_counter() - start))
+    return Summary("encode", "instructions/s", rates, RoundTrip(cpu, 0x1000, end), instructions=count)
+
+
+def RunBenchmarks(engine="interpreter", repeat=5, names=None):
+    """ Returns the results of all benchmarks (or the ones in names) as a dictionary, which can be written as JSON """
+    results = []
+    for benchmark in Programs():
+        if names is None or benchmark.name in names:
+            results.append(MeasureProgram(benchmark, engine, repeat))
+    if names is None or "assemble" in names:
+        results.append(MeasureAssemble(repeat))
+    if names is None or "encode" in names:
+        results.append(MeasureEncode(repeat))
+
+    return {
+        "engine": engine,
+        "repeat": repeat,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "benchmarks": results,
+    }
+
+
+def Compare(results, baseline, tolerance):
+    """ Adds the ratio to the mean of the baseline to every result. Returns names of the benchmarks slower than the tolerance. """
+    old = {result["name"]: result for result in baseline["benchmarks"]}
+    slower = []
+    for result in results["benchmarks"]:
+        if result["name"] in old:
+            result["ratio"] = result["mean"] / old[result["name"]]["mean"]
+            if result["ratio"] < 1 - tolerance:
+                slower.append(result["name"])
+    return slower
+
+
+def Interpreted(results):
+    """ Returns names of the benchmarks, where the JIT or AOT left most instructions to the interpreter """
+    return [result["name"] for result in results["benchmarks"] if result.get("translated", 1.0) < MIN_TRANSLATED]
+
+
+def Table(results):
+    lines = [f"{'benchmark':<16}{'mean':>14}{'stdev':>8}{'best':>14}  {'unit':<16}{'translated':>10}{'baseline':>9}  result"]
+    for result in results["benchmarks"]:
+        ratio = f"{result['ratio']:.2f}x" if "ratio" in result else ""
+        translated = f"{100 * result['translated']:.1f}%" if "translated" in result else ""
+        lines.append(f"{result['name']:<16}{result['mean']:>14,.0f}{100 * result['stdev'] / result['mean']:>7.1f}%"
+                     f"{result['best']:>14,.0f}  {result['unit']:<16}{translated:>10}{ratio:>9}  {'ok' if result['correct'] else 'WRONG'}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the 6502 emulator")
+    parser.add_argument("--engine", default="interpreter", choices=["interpreter", "jit", "aot"])
+    parser.add_argument("--repeat", type=int, default=5, help="number of measured runs of every benchmark")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="run only these benchmarks")
+    parser.add_argument("--output", help="write the results into this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown against the baseline (default 0.10)")
+    args = parser.parse_args()
+
+    results = RunBenchmarks(args.engine, max(args.repeat, 2), args.only)
+    slower = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = Compare(results, json.load(f), args.tolerance)
+
+    print(Table(results))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    wrong = [result["name"] for result in results["benchmarks"] if not result["correct"]]
+    if wrong:
+        print("wrong results:", ", ".join(wrong))
+    if slower:
+        print("slower than the baseline:", ", ".join(slower))
+    interpreted = Interpreted(results)
+    if interpreted:
+        print(f"mostly interpreted by the {args.engine}:", ", ".join(interpreted))
+    return 1 if wrong or slower or interpreted else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
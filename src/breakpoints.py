@@ -0,0 +1,184 @@
+"""
+Breakpoints, watchpoints and conditional stops of the debugger.
+
+Every address of memory has a byte in the bitmap stops with the bits of what is set there: EXEC for a breakpoint on the
+instruction, READ and WRITE for watchpoints and CONDITION for a stop condition checked before every instruction.
+When something is set, the CPU runs the checking interpreter (interpreter.InterpretChecked), which looks into the bitmap
+before every instruction and on every access to memory - also the reads of the pointers of (zp,X), (zp),Y and jmp (abs)
+and the pulls from the stack - and calls Stopped or Watched only on the addresses with a bit set. It executes the groups
+of opcodes.FUSIONS without access to memory and the loops of loops.py at once like the fast interpreter, when none of
+their instructions has a stop; the loops don't go to the pages with watchpoints, which have the bit TRAP_WATCH in
+CPU.pageTraps. With nothing set the engines run without any checks.
+
+Conditions are python-like expressions of the registers A, X, Y, P, S, PC, the flags N, V, B, D, I, Z, C and memory RAM[address],
+with numbers written like in the assembler ($FF, %1010, 255):
+
+    A == $FF and X > 3
+    RAM[$0010] != 0 or C
+
+They are compiled once into python functions.
+"""
+
+import re
+
+from .assembler import ParseNumber
+
+EXEC = 0x01         # bit in stops - breakpoint on the instruction on the address
+READ = 0x02         # bit in stops - watchpoint on reading the address
+WRITE = 0x04        # bit in stops - watchpoint on writing the address
+CONDITION = 0x08    # bit in stops - condition checked before every instruction
+
+TRAP_WATCH = 0x08   # bit in CPU.pageTraps - a watchpoint is on the page
+
+TOKEN = re.compile(r"\s*(?:(?P<number>\$[0-9A-Fa-f]+|%[01]+|0[xX][0-9A-Fa-f]+|[0-9]+)|(?P<name>[A-Za-z_]\w*)"
+                   r"|(?P<operator>==|!=|<=|>=|<<|>>|[-+*/&|^~<>()\[\]]))")
+NAMES = {"A", "X", "Y", "P", "S", "PC", "RAM", "and", "or", "not"}
+FLAGS = {"N": 7, "V": 6, "B": 4, "D": 3, "I": 2, "Z": 1, "C": 0}   # flag: bit in P
+
+
+class Condition():
+    """ Expression compiled into a function of the registers and memory, which returns True when the CPU has to stop """
+
+    def __init__(self, text):
+        self.text = text.strip()
+        code = []
+        position = 0
+        while position < len(text):
+            if text[position:].strip() == "":
+                break
+            match = TOKEN.match(text, position)
+            if match is None:
+                raise ValueError(f"not valid condition {self.text}")
+            kind, token = match.lastgroup, match.group(match.lastgroup)
+            if kind == "number":
+                code.append(str(ParseNumber(token)))
+            elif token in FLAGS:
+                code.append(f"(P >> {FLAGS[token]} & 1)")
+            elif kind == "name" and token not in NAMES:
+                raise ValueError(f"unknown name {token} in condition {self.text}")
+            else:
+                code.append(token)
+            position = match.end()
+        if not code:
+            raise ValueError("empty condition")
+
+        try:
+            self.function = eval(compile(f"lambda A, X, Y, P, S, PC, RAM: bool({' '.join(code)})", "<condition>", "eval"), {})
+        except SyntaxError:
+            raise ValueError(f"not valid condition {self.text}") from None
+
+    def __call__(self, A, X, Y, P, S, PC, RAM):
+        return self.function(A, X, Y, P, S, PC, RAM)
+
+    def __repr__(self):
+        return self.text
+
+
+class Breakpoints():
+    """ Breakpoints, watchpoints and stop conditions of the CPU with the bitmap stops of their addresses """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.stops = bytearray(0x10000)
+        self.entries = []       # (kind, first, last, Condition or None), kind is 'break', 'read', 'write' or 'stop'
+        self.breaks = {}        # address: list of Conditions (None for a breakpoint without condition)
+        self.conditions = []    # Conditions of the stops without an address
+        self.hit = None         # description of the last stop, None if the CPU didn't stop on any
+
+    def __bool__(self):
+        return bool(self.entries)
+
+    def Break(self, address, condition=None):
+        """ Sets breakpoint on the instruction on address, with condition (text of the expression) it stops only when it is true """
+        self.Add("break", address, address + 1, Condition(condition) if condition else None)
+        return
+
+    def Watch(self, first, last=None, read=False, write=True):
+        """ Sets watchpoint on reading and/or writing addresses first to last-1 (only first if last is not given) """
+        if last is None:
+            last = first + 1
+        if not 0 <= first < last <= 0x10000:
+            raise ValueError(f"bad range of addresses ${first:04X}:${last:04X}")
+        if read:
+            self.Add("read", first, last)
+        if write:
+            self.Add("write", first, last)
+        return
+
+    def Stop(self, condition):
+        """ Sets stop before any instruction when condition (text of the expression) is true """
+        self.Add("stop", 0, 0x10000, Condition(condition))
+        return
+
+    def Add(self, kind, first, last, condition=None):
+        if not 0 <= first < last <= 0x10000:
+            raise ValueError(f"bad address ${first:04X}")
+        self.entries.append((kind, first, last, condition))
+        self.Update()
+        return
+
+    def Delete(self, index=None):
+        """ Removes the entry with the index (in List), all entries if index is not given """
+        if index is None:
+            self.entries = []
+        else:
+            del self.entries[index]
+        self.Update()
+        return
+
+    def Update(self):
+        """ Fills the bitmap stops and the dictionaries from the entries """
+        bits = {"break": EXEC, "read": READ, "write": WRITE}
+        self.breaks = {}
+        self.conditions = [condition for kind, first, last, condition in self.entries if kind == "stop"]
+        stops = self.stops
+        stops[:] = bytes([CONDITION]) * 0x10000 if self.conditions else bytes(0x10000)
+        traps = self.cpu.pageTraps
+        for page in range(0x100):
+            traps[page] &= ~TRAP_WATCH
+        for kind, first, last, condition in self.entries:
+            if kind == "break":
+                self.breaks.setdefault(first, []).append(condition)
+            if kind in bits:
+                for address in range(first, last):
+                    stops[address] |= bits[kind]
+            if kind in ("read", "write"):
+                for page in range(first >> 8, ((last - 1) >> 8) + 1):
+                    traps[page] |= TRAP_WATCH
+        return
+
+    def List(self):
+        """ Returns lines describing the entries with their indexes """
+        lines = []
+        for index, (kind, first, last, condition) in enumerate(self.entries):
+            if kind == "stop":
+                lines.append(f"{index}: stop {condition}")
+                continue
+            where = f"${first:04X}" if last == first + 1 else f"${first:04X}:${last:04X}"
+            lines.append(f"{index}: {kind} {where}" + (f" if {condition}" if condition is not None else ""))
+        return lines
+
+    # ---- CALLED BY THE CHECKING INTERPRETER ----
+
+    def Stopped(self, PC, A, X, Y, P, S):
+        """ Called before the instruction on PC with a bit in stops. Returns True if the CPU has to stop there. """
+        RAM = self.cpu.RAM
+        for condition in self.breaks.get(PC, ()):
+            if condition is None or condition(A, X, Y, P, S, PC, RAM):
+                self.hit = f"break ${PC:04X}" + (f" if {condition}" if condition is not None else "")
+                return True
+        for condition in self.conditions:
+            if condition(A, X, Y, P, S, PC, RAM):
+                self.hit = f"stop {condition}"
+                return True
+        return False
+
+    def Watched(self, address, kind):
+        """ Called after the access kind ('read' or 'write') to address with a bit in stops. Returns True. """
+        self.hit = f"{kind} ${address:04X}"
+        return True
+
+    def At(self):
+        """ Returns True if the CPU has to stop before the instruction on PC (for single steps) """
+        cpu = self.cpu
+        return bool(self.stops[cpu.PC]) and self.Stopped(cpu.PC, cpu.A, cpu.X, cpu.Y, cpu.P, cpu.S)
@@ -0,0 +1,205 @@
+"""
+Memory bus of the CPU with devices mapped into pages of memory.
+
+The page table pages gives for every page of memory the Device which handles it, or None for plain RAM. Pages of plain RAM
+stay on the fast path: the engines read and write the bytearray RAM directly. A page with a device has the bit TRAP_DEVICE
+in CPU.pageTraps, so stores there go through CPU.TrappedWrite (like stores into translated code) to Device.Write.
+Only devices with reads set see the reads of their page - when such a device is mapped, the CPU runs the interpreter
+with the reads checked (interpreter.InterpretDevices), otherwise reads of the page read RAM and nothing gets slower.
+
+MapStandard maps the standard devices, one page each - the input and the cycle counter, which see reads, only when
+they are asked for, so that a program which only prints and exits runs in the fastest engine:
+
+    $F000   CharacterOutput - a byte stored on any address of the page is written to the output, the output is buffered
+                              and written in large writes (when the buffer is full, before an input and at the end of Run)
+    $F100   CharacterInput  - $F100 reads the next byte of the input (0 at the end), $F101 reads 1 if there is a byte to read
+    $F200   CycleCounter    - $F200-$F203 read the number of cycles since Reset (little-endian, latched by reading $F200)
+    $F300   HaltPort        - a byte stored on any address of the page stops the CPU with the reason 'exit' and the byte
+                              as the exit code
+
+    lda #'A'
+    sta $F000       ; prints A
+    lda #0
+    sta $F300       ; exits with the code 0
+"""
+
+import sys
+
+TRAP_DEVICE = 0x04  # bit in CPU.pageTraps - the page is handled by a device
+
+OUTPUT_PAGE = 0xF0
+INPUT_PAGE = 0xF1
+CYCLES_PAGE = 0xF2
+HALT_PAGE = 0xF3
+
+
+class Exit(Exception):
+    """ Raised by a block of the JIT, which stored into the HaltPort - count is the number of its executed instructions """
+
+    def __init__(self, count):
+        super().__init__(count)
+        self.count = count
+
+
+class Device():
+    """ Handler of a page of memory. offset is the address on the page, cycles are the cycles executed by the current run. """
+
+    reads = False   # if the device sees the reads of its page, otherwise they read RAM
+
+    def __init__(self):
+        self.bus = None     # Bus the device is mapped to
+
+    def Read(self, offset, cycles):
+        return 0
+
+    def Write(self, offset, value):
+        """ Returns True if the CPU has to stop after the instruction """
+        return False
+
+    def Flush(self):
+        return
+
+
+class CharacterOutput(Device):
+    """ Writes the stored bytes into the binary stream output (standard output if not given) in writes of size bytes """
+
+    def __init__(self, output=None, size=0x1000):
+        super().__init__()
+        self.output = output
+        self.size = size
+        self.buffer = bytearray()
+
+    def Write(self, offset, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= self.size:
+            self.Flush()
+        return False
+
+    def Flush(self):
+        if not self.buffer:
+            return
+        output = self.output
+        if output is None:
+            sys.stdout.flush()
+            output = sys.stdout.buffer
+        output.write(self.buffer)
+        output.flush()
+        self.buffer = bytearray()
+        return
+
+
+class CharacterInput(Device):
+    """ Reads bytes from the binary stream input (standard input if not given) or from bytes data """
+
+    reads = True
+
+    def __init__(self, input=None, data=None):
+        super().__init__()
+        self.input = input
+        self.data = bytearray(data or b"")
+        self.position = 0
+        self.end = data is not None     # if there is nothing more to read into data
+
+    def Available(self):
+        """ Returns True if there is a byte to read, reads the next line of the input when data were all read """
+        if self.position < len(self.data) or self.end:
+            return self.position < len(self.data)
+        if self.bus is not None:
+            self.bus.Flush()    # the output written before the input, like a prompt, has to be seen
+        input = self.input if self.input is not None else sys.stdin.buffer
+        line = input.readline()
+        if not line:
+            self.end = True
+        self.data = bytearray(line)
+        self.position = 0
+        return bool(line)
+
+    def Read(self, offset, cycles):
+        if offset == 1:
+            return int(self.Available())
+        if not self.Available():
+            return 0
+        self.position += 1
+        return self.data[self.position - 1]
+
+
+class CycleCounter(Device):
+    """ Number of cycles of the CPU, reading the byte 0 latches the whole number for the bytes 1-3 """
+
+    reads = True
+
+    def __init__(self):
+        super().__init__()
+        self.latched = 0
+
+    def Read(self, offset, cycles):
+        if offset == 0:
+            self.latched = self.bus.cpu.cycles + cycles
+        return (self.latched >> (8 * (offset & 3))) & 0xFF
+
+
+class HaltPort(Device):
+    """ Stores the written byte as the exit code of the program and stops the CPU """
+
+    def Write(self, offset, value):
+        self.bus.exitCode = value
+        return True
+
+
+class Bus():
+    """ Page table of the memory of the CPU with the mapped devices """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.pages = [None] * 0x100     # page: Device, None for plain RAM
+        self.reads = 0                  # number of mapped pages with devices which see reads
+        self.exitCode = None            # code written into the HaltPort by the last Run, None if it didn't exit
+
+    def __bool__(self):
+        return any(device is not None for device in self.pages)
+
+    def Map(self, page, device):
+        """ Maps device to the page (0-255), replacing the device there """
+        self.Unmap(page)
+        device.bus = self
+        self.pages[page] = device
+        self.reads += device.reads
+        self.cpu.pageTraps[page] |= TRAP_DEVICE
+        return device
+
+    def Unmap(self, page):
+        """ Makes the page plain RAM again """
+        device = self.pages[page]
+        if device is not None:
+            device.Flush()
+            self.reads -= device.reads
+            self.pages[page] = None
+            self.cpu.pageTraps[page] &= ~TRAP_DEVICE
+        return
+
+    def MapStandard(self, output=None, input=None, data=None, reads=False):
+        """ Maps the standard devices (see the description of the module). output and input are binary streams
+            (standard output and input if not given), data are bytes read instead of input. The input and the cycle
+            counter are mapped only with reads True or with input or data given - they make the CPU run the interpreter
+            with devices.
+        """
+        self.Map(OUTPUT_PAGE, CharacterOutput(output))
+        self.Map(HALT_PAGE, HaltPort())
+        if reads or input is not None or data is not None:
+            self.Map(INPUT_PAGE, CharacterInput(input, data))
+            self.Map(CYCLES_PAGE, CycleCounter())
+        return
+
+    def Read(self, address, cycles=0):
+        return self.pages[address >> 8].Read(address & 0xFF, cycles)
+
+    def Write(self, address, value):
+        """ Returns True if the CPU has to stop after the instruction (exitCode is set) """
+        return self.pages[address >> 8].Write(address & 0xFF, value)
+
+    def Flush(self):
+        """ Writes the buffered output of the devices """
+        for device in self.pages:
+            if device is not None:
+                device.Flush()
+        return
@@ -0,0 +1,225 @@
+"""
+Disassembler of the 6502 machine code.
+
+The text of every opcode is a template made from the specification (opcodes.py), so decoding an instruction is one lookup
+and one format. The class Disassembler caches the decoded instructions of a CPU by address. It sets no trap on the pages
+with cached instructions, so stores of the program there stay on the fast path. Instead it keeps a copy of every such page
+and compares it with memory when the program ran since the last decoding - only the pages which differ are decoded again.
+Changes from outside of the program (loading, restoring a snapshot) come to it as to a code watcher of the CPU.
+
+Listing writes any range of memory as assembly, which the assembler (assembler.py) assembles back to the same bytes.
+With entry points it follows the code from them through the branches and jumps and writes the bytes which are not
+reached as data (.byte):
+
+    python disassembler.py tests/fibonacci.txt
+    python disassembler.py program.txt --entry 8000 --range 0000:FFFF --output listing.asm
+"""
+
+import argparse
+import sys
+
+from .opcodes import OPCODES
+
+# address mode: template of the operand, {0} is the byte after the opcode and {1} the second one
+OPERAND_TEMPLATES = {
+    "imp": "",
+    "A": " A",
+    "imm": " #${0:02X}",
+    "rel": " ${0:02X}",
+    "zp": " ${0:02X}",
+    "zp,X": " ${0:02X},X",
+    "zp,Y": " ${0:02X},Y",
+    "abs": " ${1:02X}{0:02X}",
+    "abs,X": " ${1:02X}{0:02X},X",
+    "abs,Y": " ${1:02X}{0:02X},Y",
+    "ind": " (${1:02X}{0:02X})",
+    "ind,X": " (${0:02X},X)",
+    "ind,Y": " (${0:02X}),Y",
+}
+
+# opcode: (template of the instruction, length), None for bytes which are not an instruction
+DECODE = [None] * 0x100
+for opcode, op in OPCODES.items():
+    DECODE[opcode] = (op.mnemonic + OPERAND_TEMPLATES[op.mode], op.length)
+
+
+def Decode(RAM, address):
+    """ Returns the instruction on address in assembly ('nao' for a byte which is not an instruction) and address of the next one """
+    entry = DECODE[RAM[address]]
+    if entry is None:
+        return "nao", (address + 1) & 0xFFFF
+    template, length = entry
+    if length == 1:
+        return template, (address + 1) & 0xFFFF
+    return template.format(RAM[(address + 1) & 0xFFFF], RAM[(address + 2) & 0xFFFF]), (address + length) & 0xFFFF
+
+
+def Pages(address, length):
+    """ Returns set of the pages with the bytes of the instruction on address """
+    return {((address + offset) >> 8) & 0xFF for offset in range(length)}
+
+
+class Disassembler():
+    """ Cache of the decoded instructions of the CPU by address """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.instructions = {}      # address: (text, address of the next instruction, length)
+        self.pageInstructions = {}  # page: set of addresses of the cached instructions with a byte on the page
+        self.pages = {}             # page: its bytes when the first instruction on it was cached
+        self.checked = 0            # cpu.instructions when the pages were compared with memory
+        self.hits = 0
+        self.misses = 0
+        cpu.codeWatchers.append(self)
+
+    def Decode(self, address):
+        """ Returns the instruction on address in assembly and address of the next one """
+        if self.cpu.instructions != self.checked:
+            self.Check()
+        entry = self.instructions.get(address)
+        if entry is not None:
+            self.hits += 1
+            return entry[0], entry[1]
+
+        self.misses += 1
+        RAM = self.cpu.RAM
+        text, next = Decode(RAM, address)
+        length = (next - address) & 0xFFFF or 0x10000
+        self.instructions[address] = (text, next, length)
+        for page in Pages(address, length):
+            self.pageInstructions.setdefault(page, set()).add(address)
+            if page not in self.pages:
+                self.pages[page] = bytes(RAM[page << 8:(page + 1) << 8])
+        return text, next
+
+    def Check(self):
+        """ Removes the instructions on the pages which the program changed since they were cached """
+        RAM = self.cpu.RAM
+        for page, data in list(self.pages.items()):
+            if RAM[page << 8:(page + 1) << 8] != data:
+                self.Remove(page)
+        self.checked = self.cpu.instructions
+        return
+
+    def Remove(self, page):
+        """ Removes the instructions with a byte on the page and the copy of the page """
+        for address in self.pageInstructions.pop(page, ()):
+            text, next, length = self.instructions.pop(address)
+            for instructionPage in Pages(address, length):
+                if instructionPage != page:
+                    self.pageInstructions[instructionPage].discard(address)
+        self.pages.pop(page, None)
+        return
+
+    def HasCode(self, page):
+        return False    # the pages are compared with memory, they need no trap
+
+    def Invalidate(self, first, last):
+        """ Removes the instructions on the pages of addresses first to last-1. Returns False, the run of the program doesn't change. """
+        for page in range(first >> 8, ((last - 1) >> 8) + 1):
+            self.Remove(page)
+        return False
+
+
+# ---- LISTING ----
+
+def Reachable(RAM, entries):
+    """ Returns set of the addresses of the instructions reachable from the entry points through branches and jumps """
+    found = set()
+    waiting = list(entries)
+    while waiting:
+        address = waiting.pop()
+        while address not in found:
+            op = OPCODES.get(RAM[address])
+            if op is None:
+                break
+            found.add(address)
+            next = address + op.length
+            if next > 0x10000:
+                break
+            if op.kind == "halt":
+                break
+            if op.kind == "jump":
+                # the targets of jmp ind, rts and rti are not known, jsr returns after itself
+                if op.mode == "abs":
+                    waiting.append(RAM[address + 1] | RAM[address + 2] << 8)
+                if op.mnemonic != "jsr":
+                    break
+            if op.kind == "branch":
+                offset = RAM[address + 1]
+                waiting.append((next + offset - ((offset & 0x80) << 1)) & 0xFFFF)
+            address = next & 0xFFFF
+    return found
+
+
+def Listing(RAM, first=0, last=0x10000, entries=None, skipZeros=16):
+    """ Yields lines of the listing of memory from first to last-1 in assembly with the address and the bytes in a comment.
+        With entries only the instructions reachable from them are listed as code, the other bytes as data (.byte).
+        Runs of at least skipZeros zero bytes of data are skipped.
+    """
+    code = None if entries is None else Reachable(RAM, entries)
+    address = first
+    origin = True   # if .org has to be written before the next line
+    while address < last:
+        isCode = code is None or address in code
+        if not isCode or code is None:
+            zeros = 0
+            while address + zeros < last and RAM[address + zeros] == 0 and (code is None or address + zeros not in code):
+                zeros += 1
+            if zeros >= skipZeros:
+                address += zeros
+                origin = True
+                continue
+
+        if isCode:
+            text, next = Decode(RAM, address)
+            length = next - address
+            if text == "nao" or not 0 < length <= last - address:
+                text, length = f".byte ${RAM[address]:02X}", 1
+        else:
+            length = 1
+            while address + length < last and length < 8 and address + length not in code:
+                length += 1
+            text = ".byte " + ", ".join(f"${RAM[byte]:02X}" for byte in range(address, address + length))
+
+        if origin:
+            yield f".org ${address:04X}"
+            origin = False
+        data = " ".join(f"{RAM[byte]:02X}" for byte in range(address, address + length))
+        yield f"        {text:<24}; {address:04X}  {data}"
+        address += length
+    return
+
+
+def main():
+    from ._6502_Emulator import CPU
+
+    parser = argparse.ArgumentParser(description="Writes listing of a 6502 program in assembly")
+    parser.add_argument("program", help="file with the program in assembly")
+    parser.add_argument("--entry", action="append", default=[], metavar="HHLL",
+                        help="address where code starts (hexadecimal, can be repeated, the start of the program by default)")
+    parser.add_argument("--range", default=None, metavar="START:END",
+                        help="addresses to list (hexadecimal, END not included), the program by default")
+    parser.add_argument("--all", action="store_true", help="list all bytes as code, don't follow the code from the entries")
+    parser.add_argument("--output", default="-", help="file for the listing (standard output if not given)")
+    args = parser.parse_args()
+
+    cpu = CPU()
+    with open(args.program) as f:
+        program = cpu.LoadAssembly(f.read())
+    if args.range:
+        first, last = (int(part.lstrip("$"), 16) for part in args.range.split(":"))
+    else:
+        first = min(address for address, data in program.segments)
+        last = max(address + len(data) for address, data in program.segments)
+    entries = None if args.all else [int(entry.lstrip("$"), 16) for entry in args.entry] or [cpu.resetVector]
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    with output:
+        for line in Listing(cpu.RAM, first, last, entries):
+            output.write(line + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Headless runner of 6502 functional test images, like the 6502 functional test by Klaus Dormann.
+
+Such a test runs from its start address through tests of every instruction and mode. When a test fails, the program stops
+in a trap - jmp to itself or a branch to itself - on the address of the failed test. When all tests pass, it traps
+on the success address. The runner executes the image in slices of instructions until the CPU traps, stops or runs out
+of the time budget, and reports the result with the speed:
+
+    python functional.py 6502_functional_test.bin --load 0000 --start 0400 --success 3469
+    python functional.py test.hex --start 0400 --success 3469 --engine jit --budget 120
+
+The exit code is 0 only if the program trapped on the success address.
+"""
+
+import argparse
+import sys
+import time
+
+from . import loader
+from ._6502_Emulator import CPU
+from .opcodes import OPCODES
+
+SLICE = 1000000     # instructions executed between the checks of the trap and of the time budget
+
+
+class Result():
+    """ How the run ended - reason is 'passed', 'failed' (trap on another address or a stop of the CPU) or 'budget' """
+
+    def __init__(self, reason, address, instructions, cycles, seconds):
+        self.reason = reason
+        self.address = address          # PC at the end
+        self.instructions = instructions
+        self.cycles = cycles
+        self.seconds = seconds
+
+    @property
+    def mips(self):
+        return self.instructions / self.seconds / 1e6 if self.seconds else 0.0
+
+    def __repr__(self):
+        return (f"{self.reason} at ${self.address:04X} after {self.instructions} instructions, {self.cycles} cycles, "
+                f"{self.seconds:.2f} s, {self.mips:.2f} MIPS")
+
+
+def Trapped(cpu):
+    """ Returns True if the instruction on PC jumps or branches to itself (the branch with its condition true) """
+    op = OPCODES.get(cpu.RAM[cpu.PC])
+    if op is None or op.kind not in ("jump", "branch"):
+        return False
+    PC = cpu.PC
+    cpu.Run(1)
+    return cpu.PC == PC
+
+
+def RunTest(cpu, success, budget=None, slice=SLICE):
+    """ Runs the program from PC until it traps, until the CPU stops or until it runs budget seconds (no limit if None).
+        Returns Result.
+    """
+    start = time.perf_counter()
+    while True:
+        result = cpu.Run(slice)
+        seconds = time.perf_counter() - start
+        if result.reason != "limit":
+            return Result("failed", cpu.PC, cpu.instructions, cpu.cycles, seconds)
+        if Trapped(cpu):
+            return Result("passed" if cpu.PC == success else "failed", cpu.PC, cpu.instructions, cpu.cycles, seconds)
+        if budget is not None and seconds > budget:
+            return Result("budget", cpu.PC, cpu.instructions, cpu.cycles, seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a 6502 functional test image until it traps and reports the result")
+    parser.add_argument("image", help="file with the image: raw binary (.bin), hexadecimal text, Intel HEX or segments (.seg)")
+    parser.add_argument("--load", default="0000", metavar="HHLL", help="address of a raw image (hexadecimal, 0000 by default)")
+    parser.add_argument("--start", default="0400", metavar="HHLL", help="address where the test starts (hexadecimal, 0400 by default)")
+    parser.add_argument("--success", required=True, metavar="HHLL", help="address of the trap when all tests pass (hexadecimal)")
+    parser.add_argument("--budget", type=float, default=600, help="maximum time of the run in seconds (600 by default)")
+    parser.add_argument("--engine", choices=("interpreter", "jit", "aot"), default="interpreter", help="engine running the test")
+    args = parser.parse_args()
+
+    cpu = CPU()
+    cpu.engine = args.engine
+    cpu.resetVector = int(args.start.lstrip("$"), 16)
+    loader.LoadFile(cpu, args.image, int(args.load.lstrip("$"), 16))
+    cpu.PC = cpu.resetVector
+    result = RunTest(cpu, int(args.success.lstrip("$"), 16), args.budget)
+    print(result)
+    return 0 if result.reason == "passed" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+Detection of idle loops - loops which wait for a change, which can never come.
+
+A program often waits in a tight loop: jmp to itself or polling of a location, which nothing else writes:
+
+    wait:   lda flag
+            beq wait
+
+The emulator has no interrupts and nothing changes memory besides the program and the devices, so when an iteration
+of a loop doesn't store anything, doesn't read a device and ends with the same registers as it started, every following
+iteration is the same and the loop never ends. Run executes the engines in slices of SLICE instructions and between them
+calls FastForward, which steps the code on PC for up to one iteration. If it finds an idle loop, it adds the instructions
+and cycles of the iterations up to the limit of the run at once (the next scheduled event - the emulator schedules no
+other), so the state is the same as if the loop was stepped, or stops the run with the reason 'idle' when the run has
+no limit.
+"""
+
+from .interpreter import Operand
+from .opcodes import OPCODES
+
+SLICE = 1 << 18     # instructions executed by an engine between the checks for an idle loop
+MAX_LOOP = 16       # maximal number of instructions of an iteration of an idle loop
+
+# opcode: compiled expression of the effective address (from RAM, PC, X and Y) of the instructions working with memory
+ADDRESSES = {op.opcode: compile(Operand(op)[0], f"<address of {op}>", "eval")
+             for op in OPCODES.values() if Operand(op)[0] is not None}
+
+
+def Registers(cpu):
+    return cpu.PC, cpu.A, cpu.X, cpu.Y, cpu.P, cpu.S
+
+
+def Pure(cpu):
+    """ Returns True if the instruction on PC doesn't store anything and doesn't read a device """
+    op = OPCODES.get(cpu.RAM[cpu.PC])
+    if op is None or op.kind == "halt" or "write(" in op.semantics or cpu.PC > 0xFFFD:
+        return False
+    if cpu.bus.reads and op.opcode in ADDRESSES:
+        # the pointers of the indirect modes are on the zero page, the stack on the page 1
+        address = eval(ADDRESSES[op.opcode], {"RAM": cpu.RAM, "PC": cpu.PC, "X": cpu.X, "Y": cpu.Y})
+        if any(cpu.bus.pages[page] is not None and cpu.bus.pages[page].reads for page in (address >> 8, 0x00, 0x01)):
+            return False
+    return True
+
+
+def FastForward(cpu, budget=None):
+    """ Steps at most one iteration of the loop on PC, within budget instructions (None for a run without a limit).
+        If the loop is idle, skips its whole iterations within the budget - or stops if there is no limit.
+        Returns the number of executed instructions and the reason: 'idle', 'limit' (continue the run) or the reason
+        of a stop of the stepped instructions.
+    """
+    start = Registers(cpu)
+    cycles = cpu.cycles
+    steps = MAX_LOOP if budget is None else min(budget, MAX_LOOP)
+    count = 0
+    while True:
+        if count == steps or not Pure(cpu):
+            return count, "limit"
+        done, reason = cpu.Interpret(1)
+        count += done
+        if reason != "limit":
+            return count, reason
+        if Registers(cpu) == start:
+            break
+
+    if budget is None:
+        return count, "idle"
+    iterations = (budget - count) // count
+    cpu.instructions += iterations * count
+    cpu.cycles += iterations * (cpu.cycles - cycles)
+    return count + iterations * count, "limit"
@@ -0,0 +1,511 @@
+"""
+Interpreter generated from the specification of the instructions (opcodes.py).
+
+The generator writes one python function with a single loop, where the registers are local variables and the code of every
+instruction is written in directly. The code of the instruction is found by a binary tree of comparisons of the opcode,
+so there is no method call per instruction. The tree is balanced - every opcode is found by 7 or 8 comparisons, so the
+cost of the dispatch is the same for all instructions, the common and the rare ones.
+
+With fusion the code of the first instruction of a group from opcodes.FUSIONS looks at the following opcodes and executes
+the whole group at once, so the group costs one dispatch instead of one for every instruction. The same way it recognizes
+the counter, fill and copy loops of loops.py and executes their iterations at once.
+
+The checking interpreter (InterpretChecked) is generated with the checks of the breakpoints and watchpoints (see breakpoints.py)
+before every instruction and on every access to memory, also the pointers of the indirect modes and the pulls from the stack.
+It fuses the groups and the loops too, but only when none of their instructions after the first one has a stop (the loops
+themselves don't run on the pages with watchpoints). The CPU runs it only when some are set.
+The tracing interpreter (InterpretTraced) is the checking one without fusion, which also writes a record of every instruction
+(see tracer.py).
+The profiling interpreters also count the executions of every opcode and every address (see profiler.py). CHECKING has all
+the variants of the checking interpreter by (trace, profile).
+The interpreter with devices (InterpretDevices) is generated without fusion and reads memory through the devices on the pages
+with the bit TRAP_DEVICE (see bus.py). The CPU runs it only when a device which sees reads is mapped, the checking interpreters
+always read through the devices.
+
+InstructionCode is also used by the JIT (jit.py), which writes the same code with the operands as constants.
+"""
+
+import itertools
+import os
+import re
+
+from . import breakpoints
+from . import bus
+from . import loops
+from . import tracer
+from .opcodes import FUSION_MODES, FUSIONS, OPCODES, TABLES
+
+WRITE = re.compile(r"^( *)write\((.*)\)$")
+BRANCH = re.compile(r"^( *)branch\((.*)\)$")
+
+
+def Operand(op, RAM=None, pc=None, offset=0):
+    """ Returns expression of the effective address and expression of the immediate value of the operand (or None).
+        Without RAM the operand is read from memory after PC+offset (interpreter), otherwise it is a constant read from RAM at pc (JIT).
+    """
+    mode = op.mode
+    if mode in ("imp", "A", "rel"):
+        return None, None
+
+    if RAM is None:
+        low = f"RAM[PC+{offset + 1}]"
+        word = f"(RAM[PC+{offset + 1}] | RAM[PC+{offset + 2}] << 8)"
+    else:
+        low = f"0x{RAM[pc+1]:02X}"
+        word = f"0x{RAM[pc+1] | RAM[pc+2] << 8:04X}"
+
+    if mode == "imm":
+        return None, low
+    if mode == "zp":
+        return low, None
+    if mode in ("zp,X", "zp,Y"):
+        return f"(({low} + {mode[-1]}) & 0xFF)", None
+    if mode in ("abs", "ind"):
+        # the address of ind is the address of the pointer, the semantics of jmp reads it
+        return word, None
+    if mode in ("abs,X", "abs,Y"):
+        if RAM is not None and RAM[pc+1] | RAM[pc+2] << 8 <= 0xFF00:
+            return f"({word} + {mode[-1]})", None
+        return f"(({word} + {mode[-1]}) & 0xFFFF)", None
+    if mode == "ind,X":
+        return f"(RAM[({low} + X) & 0xFF] | RAM[({low} + X + 1) & 0xFF] << 8)", None
+    if mode == "ind,Y":
+        high = f"RAM[({low} + 1) & 0xFF]" if RAM is None else f"RAM[0x{(RAM[pc+1] + 1) & 0xFF:02X}]"
+        return f"(((RAM[{low}] | {high} << 8) + Y) & 0xFFFF)", None
+    raise ValueError(f"not known address mode {mode}")
+
+
+def PenaltyCode(op, RAM=None, pc=None, offset=0):
+    """ Returns expression of the cycle, which op takes more when the indexed address crosses a page, or None """
+    if not op.pageCross:
+        return None
+    if op.mode == "ind,Y":
+        pointer = f"RAM[PC+{offset + 1}]" if RAM is None else f"0x{RAM[pc+1]:02X}"
+        return f"((RAM[{pointer}] + Y) >> 8)"
+    if RAM is None:
+        return f"((RAM[PC+{offset + 1}] + {op.mode[-1]}) >> 8)"
+    if RAM[pc+1] == 0:
+        return None
+    return f"((0x{RAM[pc+1]:02X} + {op.mode[-1]}) >> 8)"
+
+
+def SemanticsCode(semantics, address, value, write, branch=None, pc="PC"):
+    """ Returns lines of the semantics with the operand and the address of the instruction pc filled in.
+        write and branch are functions, which return lines storing the value (their argument) on the effective address 'a'
+        and lines of a branch taken on the condition (their argument).
+    """
+    lines = []
+    if address is not None:
+        if "write(" in semantics or re.search(r"\ba\b", semantics):
+            if address != "a":
+                lines.append(f"a = {address}")
+            if value is None:
+                value = "RAM[a]"
+        elif value is None:
+            value = f"RAM[{address}]"
+
+    for line in semantics.strip("\n").split("\n"):
+        store = WRITE.match(line)
+        jump = BRANCH.match(line)
+        if store:
+            lines += [store.group(1) + code for code in write(store.group(2))]
+        elif jump:
+            lines += [jump.group(1) + code for code in branch(jump.group(2))]
+        elif line:
+            lines.append(line.replace("{value}", str(value)).replace("{pc}", pc))
+    return lines
+
+
+def InstructionCode(op, write, RAM=None, pc=None):
+    """ Returns lines of code of the instruction op of the kind 'op' (without moving PC).
+        write is a function, which returns lines storing the value (its argument) on the effective address 'a'.
+    """
+    address, value = Operand(op, RAM, pc)
+    return SemanticsCode(op.semantics, address, value, write, pc="PC" if pc is None else f"0x{pc:04X}")
+
+
+def InterpreterWrite(value):
+    # a store into the HaltPort (see bus.py) stops the loop after the instruction
+    return [
+        "if traps[a >> 8]:",
+        f"    if TrappedWrite(a, {value}) and bus.exitCode is not None:",
+        '        reason = "exit"',
+        "        maxInstructions = 0",
+        "else:",
+        f"    RAM[a] = {value}",
+    ]
+
+
+def WatchCode(address, kind):
+    """ Returns lines checking the access kind ('read' or 'write') to address for a watchpoint, which ends the loop """
+    return [
+        f"if stops[{address}] & {kind.upper()}:",
+        f'    watch = Watched({address}, "{kind}")',
+        "    maxInstructions = 0",
+    ]
+
+
+def CheckedWrite(value):
+    return InterpreterWrite(value) + WatchCode("a", "write")
+
+
+def PointerReads(op):
+    """ Returns expressions of the addresses, which op reads besides its operand - the pointers of the indirect modes
+        and the bytes pulled from the stack
+    """
+    if op.mode == "ind,X":
+        return ["(RAM[PC+1] + X) & 0xFF", "(RAM[PC+1] + X + 1) & 0xFF"]
+    if op.mode == "ind,Y":
+        return ["RAM[PC+1]", "(RAM[PC+1] + 1) & 0xFF"]
+    if op.mode == "ind":
+        return ["(RAM[PC+1] | RAM[PC+2] << 8)", "RAM[PC+2] << 8 | (RAM[PC+1] + 1) & 0xFF"]
+    pulls = {"pla": 1, "plp": 1, "rts": 2, "rti": 3}.get(op.mnemonic, 0)
+    return [f"0x100 | (S + {number}) & 0xFF" for number in range(1, pulls + 1)]
+
+
+def InterpreterBranch(length, offset):
+    """ Returns function writing a branch at the end of a group of instructions of the length, with its operand at PC+offset+1.
+        A taken branch costs a cycle more and one more if it goes to another page.
+    """
+    def branch(condition):
+        return [
+            f"if {condition}:",
+            f"    o = RAM[PC+{offset + 1}]",
+            f"    t = (PC + {length} + o - ((o & 0x80) << 1)) & 0xFFFF",
+            f"    cycles += 1 + (((PC + {length}) ^ t) > 0xFF)",
+            "    PC = t",
+            "else:",
+            f"    PC += {length}",
+        ]
+    return branch
+
+
+def GroupCode(ops, semantics, checks=False, devices=False):
+    """ Returns lines of the interpreter executing the instructions ops (list of Opcode) by the semantics of the group.
+        With checks the accesses to memory are checked for watchpoints, with devices the reads go to the devices on their pages.
+    """
+    address = value = read = None
+    offset = 0
+    cycles = [str(sum(op.cycles for op in ops))]
+    for index, op in enumerate(ops):
+        penalty = PenaltyCode(op, offset=offset)
+        if penalty is not None:
+            register = op.mode[-1]
+            if any(re.search(rf"\b{register} = ", earlier.semantics) for earlier in ops[:index]):
+                raise ValueError(f"{op} in a group reads the address with {register} changed by the group")
+            cycles.append(penalty)
+        opAddress, opValue = Operand(op, offset=offset)
+        if value is None and address is None:
+            value = opValue
+            if opAddress is not None:
+                value = f"RAM[{opAddress}]"
+                read = opAddress
+        if opAddress is not None:
+            address = opAddress
+        offset += op.length
+
+    lines = [f"cycles += {' + '.join(cycles)}"]
+    write = CheckedWrite if checks else InterpreterWrite
+    if checks:
+        for pointer in PointerReads(ops[0]):
+            lines += [f"w = {pointer}"] + WatchCode("w", "read")
+    if (checks or devices) and address is not None:
+        if read is not None and read != address:
+            # the group reads the value from another address than the one of the last instruction (lda, sta)
+            lines.append(f"r = {read}")
+            read = "r"
+        elif read is not None:
+            read = "a"
+        lines.append(f"a = {address}")
+        if read is not None and "{value}" in semantics:
+            if checks:
+                lines += WatchCode(read, "read")
+            value = f"RAM[{read}]"
+            if devices:
+                lines.append(f"v = Read({read}, cycles) if traps[{read} >> 8] & DEVICE else RAM[{read}]")
+                value = "v"
+        address = "a"
+    lines += SemanticsCode(semantics, address, value, write, InterpreterBranch(offset, offset - ops[-1].length))
+    if ops[-1].kind != "branch":
+        lines.append(f"PC += {offset}")
+    return lines + [f"count += {len(ops)}"]
+
+
+def Groups():
+    """ Returns dictionary first opcode: list of (opcodes of the group, semantics), the longest groups first """
+    byMnemonic = {}
+    for op in OPCODES.values():
+        if op.mode in FUSION_MODES:
+            byMnemonic.setdefault(op.mnemonic, []).append(op.opcode)
+
+    groups = {}
+    for mnemonics, semantics in sorted(FUSIONS.items(), key=lambda item: -len(item[0])):
+        for opcodes in itertools.product(*(sorted(byMnemonic[mnemonic]) for mnemonic in mnemonics)):
+            groups.setdefault(opcodes[0], []).append((opcodes, semantics))
+    return groups
+
+
+def TraceCode(op):
+    """ Returns lines writing the record of the executed instruction op on PC pc into the buffer of the tracer """
+    operands = [f"RAM[pc+{index}]" if index < op.length else "0" for index in (1, 2)]
+    address = value = "0"
+    flags = 0
+    if op.kind == "op" and Operand(op)[0] is not None:
+        address, value = "a", "RAM[a]"
+        flags = (tracer.READ if "{value}" in op.semantics else 0) | (tracer.WRITE if "write(" in op.semantics else 0)
+    return [
+        f"Record(buffer, offset, pc, 0x{op.opcode:02X}, {', '.join(operands)}, A, X, Y, P & 0x7D | NZ[nz], S, {address}, {value}, {flags})",
+        f"offset += {tracer.RECORD.size}",
+        "if offset == end:",
+        "    offset = Flush()",
+    ]
+
+
+def LeafCode(op, groups, shapes, checks=False, trace=False, profile=False, devices=False):
+    """ Returns lines of the interpreter for the opcode op (None for bytes which are not an instruction) with the groups
+        (see Groups) and the loops (shapes - dictionary first opcode: list of (index in loops.LOOPS, Loop)) starting with it
+    """
+    if op is None:
+        return ['reason = "halt"', "break"]
+    write = CheckedWrite if checks else InterpreterWrite
+    if op.kind == "halt":
+        # brk with the interrupt vector of zeros is the end of the program
+        single = [
+            "if not (RAM[0xFFFE] | RAM[0xFFFF]):",
+            '    reason = "brk"',
+            "    break",
+            f"cycles += {op.cycles}",
+            *SemanticsCode(op.semantics, None, None, write),
+            "count += 1",
+        ]
+    elif op.kind == "branch":
+        single = GroupCode([op], f"branch({op.semantics})")
+    elif op.kind == "jump":
+        address, value = Operand(op)
+        single = [f"cycles += {op.cycles}"]
+        if checks:
+            for pointer in PointerReads(op):
+                single += [f"w = {pointer}"] + WatchCode("w", "read")
+        single += SemanticsCode(op.semantics, address, None, write) + ["count += 1"]
+    else:
+        single = GroupCode([op], op.semantics, checks, devices)
+    if trace:
+        single += TraceCode(op)
+    if profile:
+        single += [f"opcodes[0x{op.opcode:02X}] += 1", "addresses[pc] += 1"]
+
+    if op.opcode not in groups and op.opcode not in shapes:
+        return single
+
+    # at the end of memory the group or loop would read bytes over $FFFF, so only the single instruction is executed there
+    lines = [f"n = RAM[PC+{op.length}] if PC < 0x{0x10000 - op.length:04X} else -1"]
+    for number, loop in shapes.get(op.opcode, ()):
+        # the iterations which can't be executed at once are executed one instruction after another
+        register = loop.register
+        conditions = [f"n == 0x{loop.opcodes[1]:02X}", f"PC <= 0x{0x10000 - loop.length:04X}"] + loop.Conditions()[1:]
+        if checks:
+            # every iteration passes all instructions of the loop, none of them may have a stop
+            conditions.append(f"not any(stops[PC:PC+{loop.length}])")
+        lines += [
+            f"{'elif' if len(lines) > 1 else 'if'} {' and '.join(conditions)}:",
+            f"    bulk = LOOPS[{number}].Run(cpu, PC, A, {register}, maxInstructions - count)",
+            "    if bulk is None:",
+            *("        " + line for line in single),
+            "    else:",
+            f"        done, c, A, {register}, nz, PC = bulk",
+            "        count += done",
+            "        cycles += c",
+        ]
+    for opcodes, semantics in groups.get(op.opcode, ()):
+        ops = [OPCODES[opcode] for opcode in opcodes]
+        conditions = [f"n == 0x{ops[1].opcode:02X}"]
+        if sum(next.length for next in ops) > op.length + 1:
+            conditions.append(f"PC <= 0x{0x10000 - sum(next.length for next in ops):04X}")
+        offset = op.length + ops[1].length
+        for next in ops[2:]:
+            conditions.append(f"RAM[PC+{offset}] == 0x{next.opcode:02X}")
+            offset += next.length
+        conditions.append(f"count <= fit{len(ops)}")
+        if checks:
+            # the instructions after the first one may not have a stop
+            offset = 0
+            for next in ops[:-1]:
+                offset += next.length
+                conditions.append(f"not stops[PC+{offset}]")
+
+        lines.append(f"{'elif' if len(lines) > 1 else 'if'} {' and '.join(conditions)}:")
+        lines += ["    " + line for line in GroupCode(ops, semantics, checks, devices)]
+        lines.append(f"    saved += {len(ops) - 1}")
+
+    return lines + ["else:"] + ["    " + line for line in single]
+
+
+def TreeCode(segments, groups, shapes, indent, *options):
+    """ Returns lines of the binary tree of comparisons, which chooses between segments - list of (first opcode, Opcode or None).
+        The tree is balanced, so every segment has the same depth up to one. groups, shapes and options are passed to LeafCode.
+    """
+    if len(segments) == 1:
+        return [indent + line for line in LeafCode(segments[0][1], groups, shapes, *options)]
+    middle = len(segments) // 2
+    return ([f"{indent}if op < 0x{segments[middle][0]:02X}:"] + TreeCode(segments[:middle], groups, shapes, indent + "    ", *options) +
+            [f"{indent}else:"] + TreeCode(segments[middle:], groups, shapes, indent + "    ", *options))
+
+
+def Source(fusion=True, checks=False, trace=False, profile=False, devices=False):
+    """ Returns source of the interpreter function, with fusion of the groups of instructions or without,
+        with the checks of the breakpoints and watchpoints, with the records of the tracer and with the counts of the profiler
+        (both with checks and without fusion) and with the reads through the devices (without fusion, but with checks)
+    """
+    segments = []
+    for opcode in range(0x100):
+        op = OPCODES.get(opcode)
+        if op is not None or not segments or segments[-1][1] is not None:
+            segments.append((opcode, op))
+    groups = Groups() if fusion else {}
+    shapes = loops.BY_OPCODE if fusion else {}
+    longest = max(len(mnemonics) for mnemonics in FUSIONS)
+
+    if checks:
+        # a stop before the first instruction is not checked, so that a run can continue from a breakpoint
+        prologue = [
+            "    stops = cpu.breakpoints.stops",
+            "    Stopped = cpu.breakpoints.Stopped",
+            "    Watched = cpu.breakpoints.Watched",
+            "    watch = False",
+        ]
+        # a watchpoint sets maxInstructions to 0, so the loop ends after the instruction
+        check = [
+            "        if stops[PC] and count and Stopped(PC, A, X, Y, P & 0x7D | NZ[nz], S):",
+            '            reason = "break"',
+            "            break",
+        ]
+        epilogue = [
+            "    if watch:",
+            '        reason = "watch"',
+        ]
+    else:
+        prologue, check, epilogue = [], [], []
+
+    if trace:
+        prologue += [
+            "    Record = RECORD.pack_into",
+            "    buffer = cpu.tracer.buffer",
+            "    offset = cpu.tracer.offset",
+            "    end = len(buffer)",
+            "    Flush = cpu.tracer.Flush",
+        ]
+        epilogue += ["    cpu.tracer.offset = offset"]
+
+    if profile:
+        prologue += [
+            "    opcodes = cpu.profiler.opcodes",
+            "    addresses = cpu.profiler.addresses",
+        ]
+
+    if trace or profile:
+        check += ["        pc = PC"]
+
+    if devices:
+        prologue += ["    Read = bus.Read"]
+
+    return "\n".join([
+        "def Interpret(cpu, maxInstructions):",
+        "    RAM = cpu.RAM",
+        "    traps = cpu.pageTraps",
+        "    TrappedWrite = cpu.TrappedWrite",
+        "    bus = cpu.bus",
+        "    A = cpu.A",
+        "    X = cpu.X",
+        "    Y = cpu.Y",
+        "    P = cpu.P",
+        "    S = cpu.S",
+        "    PC = cpu.PC",
+        "    nz = NZVALUE[P & 0x82]",
+        '    reason = "limit"',
+        "    count = 0",
+        "    cycles = 0",
+        "    saved = 0",
+        "    # a group of n instructions is fused only if count <= fitn, so that it doesn't go over maxInstructions",
+        *(f"    fit{n} = maxInstructions - {n}" for n in range(2, longest + 1)),
+        *prologue,
+        "    try:",
+        "        while count < maxInstructions:",
+        *("    " + line for line in check),
+        "            op = RAM[PC]",
+        *TreeCode(segments, groups, shapes, "            ", checks, trace, profile, devices),
+        "    except IndexError:",
+        "        # the code ran over the end of memory",
+        '        reason = "halt"',
+        "        PC &= 0xFFFF",
+        *epilogue,
+        "    cpu.A = A",
+        "    cpu.X = X",
+        "    cpu.Y = Y",
+        "    cpu.P = P & 0x7D | NZ[nz]",
+        "    cpu.S = S",
+        "    cpu.PC = PC",
+        "    cpu.instructions += count",
+        "    cpu.cycles += cycles",
+        "    cpu.dispatchesSaved += saved",
+        "    return count, reason",
+        "",
+    ])
+
+
+def Generate(fusion=True, checks=False, trace=False, profile=False, devices=False):
+    """ Compiles the interpreter and returns the function Interpret(cpu, maxInstructions), which returns the number of executed
+        instructions and the reason of the stop ('brk', 'halt', 'limit', 'exit', with checks also 'break' and 'watch').
+    """
+    namespace = dict(TABLES, READ=breakpoints.READ, WRITE=breakpoints.WRITE, RECORD=tracer.RECORD, DEVICE=bus.TRAP_DEVICE,
+                     LOOPS=loops.LOOPS)
+    if trace or profile:
+        name = f"<{'tracing ' if trace else ''}{'profiling ' if profile else ''}interpreter>"
+    elif checks:
+        name = "<checking interpreter>"
+    elif devices:
+        name = "<interpreter with devices>"
+    else:
+        name = "<interpreter>" if fusion else "<interpreter without fusion>"
+    exec(compile(Source(fusion, checks, trace, profile, devices), name, "exec"), namespace)
+    return namespace["Interpret"]
+
+
+Interpret = Generate(fusion=True)
+InterpretUnfused = Generate(fusion=False)
+InterpretDevices = Generate(fusion=False, devices=True)
+CHECKING = {(trace, profile): Generate(fusion=not (trace or profile), checks=True, trace=trace, profile=profile, devices=True)
+            for trace in (False, True) for profile in (False, True)}
+InterpretChecked = CHECKING[False, False]
+InterpretTraced = CHECKING[True, False]
+
+
+def FusionReport():
+    """ Runs every program in the directory tests with and without fusion and returns a table of the dispatches saved by fusion.
+        Raises AssertionError if the two runs of a program don't end in the same state.
+    """
+    from ._6502_Emulator import CPU
+
+    tests = os.path.join(os.path.dirname(os.path.realpath(__file__)), "tests")
+    lines = [f"{'program':<16}{'instructions':>14}{'dispatches':>12}{'saved':>8}{'saved %':>9}"]
+    for name in sorted(name for name in os.listdir(tests) if name.endswith(".txt")):
+        with open(os.path.join(tests, name)) as f:
+            source = f.read()
+
+        states = []
+        for fusion in (False, True):
+            cpu = CPU()
+            cpu.fusion = fusion
+            cpu.LoadAssembly(source)
+            result = cpu.Run()
+            states.append((cpu.A, cpu.X, cpu.Y, cpu.P, cpu.PC, bytes(cpu.RAM), result.instructions, result.reason))
+        assert states[0] == states[1], f"{name}: the run with fusion is different from the run without it"
+
+        instructions = result.instructions
+        saved = cpu.dispatchesSaved
+        lines.append(f"{os.path.splitext(name)[0]:<16}{instructions:>14}{instructions - saved:>12}{saved:>8}"
+                     f"{100 * saved / max(instructions, 1):>8.1f}%")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    print(FusionReport())
@@ -0,0 +1,276 @@
+"""
+Basic-block JIT for the 6502 CPU.
+
+A basic block is a run of instructions which starts at some address and ends with a branch, jmp, jsr, rts, rti or with
+the instruction before brk (or a byte which is not an instruction), brk is left to the interpreter. Every block is translated
+into one python function with the operands of the instructions already written in as constants. Functions are compiled once
+and cached by the start address. A block which is a loop of loops.py is kept as Loop.Execute, which executes the iterations
+of the loop at once (when cpu.fusion is on).
+
+Stores into memory, which holds translated code, go through CPU.TrappedWrite, which removes the affected blocks from the cache,
+so programs which rewrite themselves (tests/self-destruct.txt) run the same as in the interpreter. Stores into the pages of
+devices go through it too (see bus.py), a block which stores into the HaltPort raises bus.Exit. A removed block is kept
+with the bytes of its code and put back without translating when the same bytes are there again - e.g. when the same
+program is loaded again after Reset.
+"""
+
+import re
+import sys
+
+from . import loops
+from .bus import Exit
+from .interpreter import InstructionCode, PenaltyCode
+from .opcodes import OPCODES, TABLES
+
+MAX_BLOCK = 64  # maximal number of instructions in one block
+LOOP = sys.maxsize  # number of instructions in the cache entry of a loop, the entry never fits and goes to the slow path
+
+REGISTERS = ("A", "X", "Y", "P", "S")  # registers of the CPU, which are kept in local variables inside a block
+
+
+def TranslateBlock(RAM, start, name="block"):
+    """ Returns source of the python function (called name) executing the block at start, address after the block,
+        number of instructions in it and the addresses where the program can continue after the block.
+        Returns None if the first instruction can't be translated (brk, not an instruction or the end of memory).
+        The function adds the cycles of the executed instructions to cpu.cycles - the constant part at once at the exit
+        of the block and the cycles for crossing a page in the local variable cycles.
+    """
+    body = []
+    pc = start
+    count = 0
+    constant = 0    # cycles of the instructions without the cycles for crossing a page
+    end = None      # lines of code which set PC at the end of the block
+    exits = []
+
+    while count < MAX_BLOCK and pc < 0x10000:
+        op = OPCODES.get(RAM[pc])
+        if op is None or op.kind == "halt" or pc + op.length > 0x10000:
+            break
+        next = pc + op.length
+        count += 1
+        constant += op.cycles
+        body.append(f"    # ${pc:04X} {op.mnemonic}")
+
+        if op.kind == "branch":
+            offset = RAM[pc+1]
+            if offset & 0x80:
+                offset -= 0x100
+            target = (next + offset) % 0x10000
+            taken = constant + 1 + ((next ^ target) > 0xFF)
+            end = [
+                f"if {op.semantics}:",
+                f"    @SYNC@cpu.cycles += @CYCLES@{taken}; cpu.PC = 0x{target:04X}",
+                f"else:",
+                f"    @SYNC@cpu.cycles += @CYCLES@{constant}; cpu.PC = 0x{next % 0x10000:04X}",
+            ]
+            exits = [target, next % 0x10000]
+            pc = next
+            break
+        if op.kind == "jump":
+            # a store of jsr into a trapped page doesn't end the block early - the block ends with the jump anyway
+            def write(value):
+                return [
+                    f"if traps[a >> 8]:",
+                    f"    if cpu.TrappedWrite(a, {value}) and cpu.bus.exitCode is not None:",
+                    f"        exited = True",
+                    f"else:",
+                    f"    RAM[a] = {value}",
+                ]
+
+            lines = InstructionCode(op, write, RAM, pc)
+            end = [f"@SYNC@cpu.cycles += @CYCLES@{constant}; cpu.PC = PC"]
+            if any("exited = True" in line for line in lines):
+                body.append("    exited = False")
+                end += ["if exited:", f"    raise Exit({count})"]
+            body += ["    " + line for line in lines]
+            # the targets of jmp ind, rts and rti are known only when the block runs
+            target = RAM[pc+1] | RAM[pc+2] << 8
+            exits = {"jmp abs": [target], "jsr abs": [target, next % 0x10000]}.get(f"{op.mnemonic} {op.mode}", [])
+            pc = next
+            break
+
+        def write(value):
+            return [
+                f"if traps[a >> 8]:",
+                f"    if cpu.TrappedWrite(a, {value}):",
+                f"        # translated code was changed, the rest of the block may be different, or the program exited",
+                f"        @SYNC@cpu.cycles += @CYCLES@{constant}; cpu.PC = 0x{next:04X}",
+                f"        if cpu.bus.exitCode is not None:",
+                f"            raise Exit({count})",
+                f"        return {count}",
+                f"else:",
+                f"    RAM[a] = {value}",
+            ]
+
+        penalty = PenaltyCode(op, RAM, pc)
+        if penalty is not None:
+            body.append(f"    cycles += {penalty}")
+        body += ["    " + line for line in InstructionCode(op, write, RAM, pc)]
+        pc = next
+
+    if count == 0:
+        return None
+    if end is None:
+        # a block ending at the end of memory leaves PC $10000, on which the interpreter stops with 'halt'
+        exits = [pc] if pc < 0x10000 else []
+        end = [f"@SYNC@cpu.cycles += @CYCLES@{constant}; cpu.PC = 0x{pc:04X}"]
+
+    code = "\n".join(body + ["    " + line for line in end])
+    lazy = re.search(r"\bnz\b", code) is not None   # if the block works with the flags N and Z (see opcodes.NZ)
+    dynamic = re.search(r"^ +cycles \+=", code, re.M) is not None
+    used = [r for r in REGISTERS if re.search(rf"\b{r}\b", code) or (r == "P" and lazy)]
+    written = [r for r in REGISTERS if re.search(rf"^ +(nz = )?(\w+, )*{r}(, \w+)* (&|\||\^|>>)?=", code, re.M)]
+    if lazy and re.search(r"^ +(\w+, )*nz(, \w+)* = ", code, re.M):
+        written = [r for r in written if r != "P"]
+        sync = "".join(f"cpu.{r} = {r}; " for r in written) + "cpu.P = P & 0x7D | NZ[nz]; "
+    else:
+        sync = "".join(f"cpu.{r} = {r}; " for r in written)
+
+    source = [f"def {name}(cpu, RAM, traps):"]
+    source += [f"    {r} = cpu.{r}" for r in used]
+    if lazy:
+        source.append("    nz = NZVALUE[P & 0x82]")
+    if dynamic:
+        source.append("    cycles = 0")
+    source.append(code.replace("@SYNC@", sync).replace("@CYCLES@", "cycles + " if dynamic else ""))
+    source.append(f"    return {count}")
+    return "\n".join(source) + "\n", pc, count, exits
+
+
+class JIT():
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.blocks = {}        # start address: (function, end address, number of instructions)
+        self.pageBlocks = {}    # page: set of start addresses of blocks which have code on the page
+        self.code = {}          # start address: bytes of the code of the block in the cache or in removed
+        self.removed = {}       # start address: cache entry of the block removed by Invalidate
+
+        self.dispatches = 0     # number of executed blocks
+        self.misses = 0         # number of translated blocks
+        self.interpreted = 0    # number of instructions executed by the interpreter instead of a block
+
+        cpu.codeWatchers.append(self)
+
+    def Compile(self, start):
+        """ Translates and compiles block at start and puts it into the cache. Returns the cache entry or None. """
+        entry = self.CompileLoop(start)
+        if entry is not None:
+            return entry
+        entry = self.removed.get(start)
+        if entry is not None and entry[2] != LOOP and self.cpu.RAM[start:entry[1]] == self.code[start]:
+            self.AddBlock(start, entry)
+            return entry
+        translation = TranslateBlock(self.cpu.RAM, start)
+        if translation is None:
+            return None
+        source, end, count, exits = translation
+
+        namespace = dict(TABLES, Exit=Exit)
+        exec(compile(source, f"<jit ${start:04X}>", "exec"), namespace)
+        entry = (namespace["block"], end, count)
+        self.misses += 1
+        self.AddBlock(start, entry)
+        return entry
+
+    def CompileLoop(self, start):
+        """ Puts Loop.Execute into the cache if there is a loop at start (see loops.py). Returns the cache entry or None. """
+        loop = loops.Recognize(self.cpu.RAM, start) if self.cpu.fusion else None
+        if loop is None:
+            return None
+        entry = (loop.Execute, start + loop.length, LOOP)
+        self.AddBlock(start, entry)
+        return entry
+
+    def AddBlock(self, start, entry):
+        """ Puts the block into the cache and sets the trap on the pages with its code """
+        self.blocks[start] = entry
+        self.code[start] = bytes(self.cpu.RAM[start:entry[1]])
+        self.removed.pop(start, None)
+        for page in range(start >> 8, ((entry[1] - 1) >> 8) + 1):
+            self.pageBlocks.setdefault(page, set()).add(start)
+            self.cpu.SetCodeTrap(page)
+        return
+
+    # ---- INVALIDATION ----
+
+    def HasCode(self, page):
+        return bool(self.pageBlocks.get(page))
+
+    def Invalidate(self, first, last):
+        """ Moves blocks with code on addresses first to last-1 from the cache to removed. Returns True if there were any. """
+        removed = False
+        for page in range(first >> 8, ((last - 1) >> 8) + 1):
+            for start in list(self.pageBlocks.get(page, ())):
+                end = self.blocks[start][1]
+                if start < last and first < end:
+                    self.removed[start] = self.blocks.pop(start)
+                    removed = True
+                    for blockPage in range(start >> 8, ((end - 1) >> 8) + 1):
+                        self.pageBlocks[blockPage].discard(start)
+                        self.cpu.ClearCodeTrap(blockPage)
+        return removed
+
+    def Flush(self):
+        """ Removes all blocks from the cache, also the removed ones """
+        pages = list(self.pageBlocks)
+        self.blocks.clear()
+        self.pageBlocks.clear()
+        self.code.clear()
+        self.removed.clear()
+        for page in pages:
+            self.cpu.ClearCodeTrap(page)
+        return
+
+    # ---- MAIN LOOP ----
+
+    def Run(self, maxInstructions):
+        """ Executes the program from PC block by block until brk, not known instruction or until maxInstructions are executed.
+            Instructions which don't fit into the limit or can't be translated are executed by the interpreter.
+            Returns number of executed instructions and reason of the stop like CPU.Interpret.
+        """
+        cpu = self.cpu
+        RAM = cpu.RAM
+        traps = cpu.pageTraps
+        blocks = self.blocks
+        count = 0
+        interpreted = 0     # instructions executed by the interpreter, which counts them in cpu.instructions itself
+        dispatches = 0
+        reason = "limit"
+
+        try:
+            while count < maxInstructions:
+                entry = blocks.get(cpu.PC)
+                if entry is None:
+                    entry = self.Compile(cpu.PC)
+                if entry is None or count + entry[2] > maxInstructions:
+                    if entry is not None and entry[2] == LOOP:
+                        # counts its instructions in cpu.instructions like the interpreter
+                        executed, reason = entry[0](cpu, maxInstructions - count)
+                    else:
+                        # the interpreter stops on brk, on the limit and on the exit
+                        executed, reason = cpu.Interpret(1 if entry is None else maxInstructions - count)
+                        self.interpreted += executed
+                    count += executed
+                    interpreted += executed
+                    if reason != "limit":
+                        break
+                    continue
+                dispatches += 1
+                count += entry[0](cpu, RAM, traps)
+        except Exit as stop:
+            dispatches += 1
+            count += stop.count
+            reason = "exit"
+
+        self.dispatches += dispatches
+        cpu.instructions += count - interpreted
+        return count, reason
+
+    def HitRate(self):
+        """ Returns the part of executed blocks which were already in the cache """
+        if self.dispatches == 0:
+            return 0.0
+        return max(self.dispatches - self.misses, 0) / self.dispatches
+
+    def Report(self):
+        return f"JIT blocks {len(self.blocks)}  translated {self.misses}  hit rate {100 * self.HitRate():.1f}%"
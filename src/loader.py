@@ -0,0 +1,227 @@
+"""
+Loaders of binary images into the memory of the CPU.
+
+Supported formats:
+    raw binary (.bin)       - bytes of memory, read straight into CPU.RAM by readinto at any address
+    hexadecimal text        - bytes in hexadecimal separated by white space (the format of in.txt), parsed at once by bytes.fromhex
+    Intel HEX               - text records ':LLAAAATT...CC' with the addresses in them (any other extension, first character ':')
+    segments (.seg)         - header SEGMENTS_HEADER (magic, version, start address) followed by segments,
+                              each SEGMENT (address, length) and its bytes, which are read straight into CPU.RAM
+
+Every loader returns list of the loaded segments (address, length) and the start address given by the file (or None).
+
+    python loader.py program.txt --output program.seg       # assembles the program and writes it as an image
+"""
+
+import argparse
+import os
+import struct
+import sys
+
+SEGMENTS_MAGIC = b"6502SEGS"
+SEGMENTS_VERSION = 1
+SEGMENTS_HEADER = struct.Struct("<8sHI")    # magic, version, start address (NO_START if the file has none)
+SEGMENT = struct.Struct("<HI")              # address, length
+NO_START = 0xFFFFFFFF
+
+
+def CheckFit(address, length):
+    if not 0 <= address <= address + length <= 0x10000:
+        raise ValueError(f"{length} bytes do not fit into memory at ${address:04X}")
+
+
+def Loaded(cpu, segments):
+    """ Tells the CPU that the segments (address, length) of memory were written """
+    for address, length in segments:
+        cpu.Written(address, address + length)
+    cpu.loadCount += 1
+    return
+
+
+# ---- FORMATS ----
+
+def LoadBinary(cpu, path, address=None):
+    """ Reads the raw binary file path into memory at address (resetVector if not given) """
+    if address is None:
+        address = cpu.resetVector
+    with open(path, "rb", buffering=0) as f:
+        length = os.fstat(f.fileno()).st_size
+        CheckFit(address, length)
+        read = f.readinto(memoryview(cpu.RAM)[address:address + length])
+    Loaded(cpu, [(address, read)])
+    return [(address, read)], None
+
+
+def ParseHex(text):
+    """ Returns bytes of the text with bytes in hexadecimal separated by white space """
+    try:
+        return bytes.fromhex(text)
+    except ValueError:
+        # bytes written with one digit
+        try:
+            return bytes(int(number, 16) for number in text.split())
+        except ValueError:
+            raise ValueError("not valid hexadecimal bytes") from None
+
+
+def LoadHex(cpu, text, address=None):
+    """ Writes the bytes of text in hexadecimal (or Intel HEX if it starts with ':') into memory at address (resetVector if not given) """
+    if text.lstrip().startswith(":"):
+        return LoadIntelHex(cpu, text)
+    if address is None:
+        address = cpu.resetVector
+    data = ParseHex(text)
+    CheckFit(address, len(data))
+    cpu.RAM[address:address + len(data)] = data
+    Loaded(cpu, [(address, len(data))])
+    return [(address, len(data))], None
+
+
+def LoadIntelHex(cpu, text):
+    """ Writes the data records of the Intel HEX text into memory. Raises ValueError for a bad record. """
+    try:
+        data = bytes.fromhex(text.replace(":", ""))
+    except ValueError:
+        raise ValueError("not valid Intel HEX") from None
+
+    RAM = cpu.RAM
+    segments = []
+    start = None
+    base = 0        # address from the extended address records
+    offset = 0
+    number = 0
+    while offset < len(data):
+        number += 1
+        length = data[offset]
+        next = offset + length + 5
+        if next > len(data) or sum(data[offset:next]) & 0xFF:
+            raise ValueError(f"record {number} of Intel HEX has a bad length or checksum")
+        kind = data[offset + 3]
+        if kind == 0x00:
+            address = base + (data[offset + 1] << 8 | data[offset + 2])
+            if address + length > 0x10000:
+                raise ValueError(f"record {number} of Intel HEX is out of memory at ${address:04X}")
+            RAM[address:address + length] = data[offset + 4:next - 1]
+            if segments and segments[-1][0] + segments[-1][1] == address:
+                segments[-1] = (segments[-1][0], segments[-1][1] + length)
+            else:
+                segments.append((address, length))
+        elif kind == 0x01:
+            break
+        else:
+            value = data[offset + 4:next - 1]
+            if kind == 0x02:
+                base = int.from_bytes(value, "big") << 4
+            elif kind == 0x04:
+                base = int.from_bytes(value, "big") << 16
+            elif kind == 0x03:
+                start = (value[0] << 8 | value[1]) * 16 + (value[2] << 8 | value[3])
+            elif kind == 0x05:
+                start = int.from_bytes(value, "big")
+            else:
+                raise ValueError(f"record {number} of Intel HEX has not known type {kind:02X}")
+        offset = next
+    Loaded(cpu, segments)
+    return segments, start
+
+
+def LoadSegments(cpu, path):
+    """ Reads the segments file path into memory """
+    segments = []
+    with open(path, "rb") as f:
+        header = f.read(SEGMENTS_HEADER.size)
+        if len(header) < SEGMENTS_HEADER.size or header[:len(SEGMENTS_MAGIC)] != SEGMENTS_MAGIC:
+            raise ValueError(f"{path} is not a file of segments")
+        magic, version, start = SEGMENTS_HEADER.unpack(header)
+        if version != SEGMENTS_VERSION:
+            raise ValueError(f"{path} has version {version} of segments, expected {SEGMENTS_VERSION}")
+        RAM = memoryview(cpu.RAM)
+        while True:
+            segment = f.read(SEGMENT.size)
+            if not segment:
+                break
+            if len(segment) < SEGMENT.size:
+                raise ValueError(f"{path} is damaged: incomplete segment")
+            address, length = SEGMENT.unpack(segment)
+            CheckFit(address, length)
+            if f.readinto(RAM[address:address + length]) != length:
+                raise ValueError(f"{path} is damaged: segment at ${address:04X} is shorter than {length} bytes")
+            segments.append((address, length))
+    Loaded(cpu, segments)
+    return segments, None if start == NO_START else start
+
+
+def LoadFile(cpu, path, address=None):
+    """ Loads the image file path by its format (see the description of the module). address is used by the formats
+        without addresses (resetVector if not given). Returns list of the segments (address, length) and the start address or None.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".bin":
+        return LoadBinary(cpu, path, address)
+    if extension == ".seg":
+        return LoadSegments(cpu, path)
+    with open(path) as f:
+        return LoadHex(cpu, f.read(), address)
+
+
+# ---- WRITERS ----
+
+def SaveSegments(path, segments, start=None):
+    """ Writes segments - list of (address, bytes) - into the segments file path """
+    with open(path, "wb") as f:
+        f.write(SEGMENTS_HEADER.pack(SEGMENTS_MAGIC, SEGMENTS_VERSION, NO_START if start is None else start))
+        for address, data in segments:
+            CheckFit(address, len(data))
+            f.write(SEGMENT.pack(address, len(data)))
+            f.write(data)
+    return
+
+
+def IntelHex(segments, start=None):
+    """ Returns Intel HEX text of segments - list of (address, bytes) - with 16 bytes in a record """
+    lines = []
+    for address, data in segments:
+        CheckFit(address, len(data))
+        for offset in range(0, len(data), 16):
+            chunk = data[offset:offset + 16]
+            record = bytes([len(chunk), (address + offset) >> 8, (address + offset) & 0xFF, 0x00]) + bytes(chunk)
+            lines.append(":" + (record + bytes([-sum(record) & 0xFF])).hex().upper())
+    if start is not None:
+        record = bytes([4, 0, 0, 0x05]) + start.to_bytes(4, "big")
+        lines.append(":" + (record + bytes([-sum(record) & 0xFF])).hex().upper())
+    lines.append(":00000001FF")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    from . import assembler
+
+    parser = argparse.ArgumentParser(description="Assembles a 6502 program and writes it as a binary image")
+    parser.add_argument("program", help="file with the program in assembly")
+    parser.add_argument("--output", required=True, help="file for the image: .bin (from the lowest address), .seg, or Intel HEX")
+    parser.add_argument("--origin", default="8000", metavar="HHLL", help="address of the program (hexadecimal, 8000 by default)")
+    args = parser.parse_args()
+
+    with open(args.program) as f:
+        program = assembler.Assemble(f.read(), int(args.origin.lstrip("$"), 16), os.path.dirname(os.path.abspath(args.program)))
+    segments = program.segments
+    start = int(args.origin.lstrip("$"), 16)
+    extension = os.path.splitext(args.output)[1].lower()
+    if extension == ".bin":
+        first = min(address for address, data in segments)
+        image = bytearray(max(address + len(data) for address, data in segments) - first)
+        for address, data in segments:
+            image[address - first:address - first + len(data)] = data
+        with open(args.output, "wb") as f:
+            f.write(image)
+        print(f"{len(image)} bytes from ${first:04X}", file=sys.stderr)
+    elif extension == ".seg":
+        SaveSegments(args.output, segments, start)
+    else:
+        with open(args.output, "w") as f:
+            f.write(IntelHex(segments, start))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+"""
+Lockstep engine - runs many instances of one program at once with NumPy.
+
+Memory of N instances is one N x 65536 array and every register is an array of N values. In every step the engine takes
+the lowest PC of the running instances and executes the instruction there for all instances at that PC together, as operations
+on arrays. Instances which branched differently wait until the others get to their PC, so they come together again after
+the branches (lowest PC first). Every instance reads its own opcode, so instances with different code at the PC are split
+by the opcode.
+
+The code executing an opcode is generated from the specification of the instructions (opcodes.py) like the interpreter,
+so the instances end in the same state as after CPU.Run. Like CPU.Run without a limit, the engine looks for an idle loop
+(see idle.py) after every idle.SLICE instructions of an instance and stops the instance with the reason 'idle'.
+"""
+
+import re
+import sys
+
+import numpy
+
+from . import assembler
+from . import idle
+from ._6502_Emulator import CPU
+from .interpreter import SemanticsCode
+from .opcodes import OPCODES, TABLES
+
+INT = numpy.int64
+REGISTERS = ("A", "X", "Y", "P", "S", "nz")     # registers kept as arrays, which the generated code uses
+REASONS = ("running", "brk", "halt", "limit", "idle")
+RUNNING, BRK, HALT, LIMIT, IDLE = range(len(REASONS))
+END = 0x10000   # PC of an instance which stopped, above every address
+
+
+# ---- CODE OF THE OPCODES ----
+
+def Operand(op):
+    """ Returns expression of the effective address and expression of the immediate value of the operand (or None)
+        for the instances I at PC pc
+    """
+    low = "RAM[I, pc + 1].astype(INT)"
+    word = f"({low} | RAM[I, pc + 2].astype(INT) << 8)"
+    mode = op.mode
+    if mode == "imm":
+        return None, low
+    if mode == "zp":
+        return low, None
+    if mode in ("zp,X", "zp,Y"):
+        return f"({low} + {mode[-1]}) & 0xFF", None
+    if mode in ("abs", "ind"):
+        return word, None
+    if mode in ("abs,X", "abs,Y"):
+        return f"({word} + {mode[-1]}) & 0xFFFF", None
+    if mode == "ind,X":
+        return f"RAM[I, ({low} + X) & 0xFF].astype(INT) | RAM[I, ({low} + X + 1) & 0xFF].astype(INT) << 8", None
+    if mode == "ind,Y":
+        return f"((RAM[I, {low}].astype(INT) | RAM[I, ({low} + 1) & 0xFF].astype(INT) << 8) + Y) & 0xFFFF", None
+    return None, None
+
+
+def Penalty(op):
+    """ Returns expression of the cycle for crossing a page by the indexed address of op """
+    if op.mode == "ind,Y":
+        return "(RAM[I, RAM[I, pc + 1]].astype(INT) + Y) >> 8"
+    return f"(RAM[I, pc + 1].astype(INT) + {op.mode[-1]}) >> 8"
+
+
+def Memory(line):
+    """ Returns the line of the semantics with every read RAM[address] turned into the read of the instances I """
+    position = 0
+    while True:
+        start = line.find("RAM[", position)
+        if start < 0:
+            return line
+        depth = 0
+        for end in range(start + 3, len(line)):
+            depth += {"[": 1, "]": -1}.get(line[end], 0)
+            if depth == 0:
+                break
+        inner = Memory(line[start + 4:end])
+        if inner.startswith("I, "):
+            # already the memory of the instances, like the stores of LockstepWrite
+            position = end + 1
+            continue
+        read = f"RAM[I, {inner}].astype(INT)"
+        line = line[:start] + read + line[end + 1:]
+        position = start + len(read)
+
+
+def Condition(condition):
+    """ Returns the condition of a branch as an expression of an array of bools """
+    if condition.startswith("not "):
+        return f"({condition[4:]}) == 0"
+    return f"({condition}) != 0"
+
+
+def LockstepWrite(value):
+    return [f"RAM[I, a] = {value}"]
+
+
+def OpcodeCode(op):
+    """ Returns lines of the function executing the opcode op (None for bytes which are not an instruction) for instances I
+        and lines which come before the loads of the registers
+    """
+    if op is None:
+        return ["state.reason[I] = HALT"], []
+
+    prologue = []
+    if op.kind == "halt":
+        # brk stops the instances with the interrupt vector of zeros, the others jump to it
+        prologue = [
+            "stop = (RAM[I, 0xFFFE] | RAM[I, 0xFFFF]) == 0",
+            "state.reason[I[stop]] = BRK",
+            "I = I[~stop]",
+        ]
+
+    address, value = Operand(op)
+    lines = [f"cycles = {op.cycles}"]
+    if op.pageCross:
+        lines.append(f"cycles = cycles + ({Penalty(op)})")
+    if address is not None:
+        lines.append(f"a = {address}")
+        value = "RAM[I, a].astype(INT)"
+
+    if op.kind == "branch":
+        lines += [
+            f"taken = {Condition(op.semantics)}",
+            "o = RAM[I, pc + 1].astype(INT)",
+            f"t = (pc + {op.length} + o - ((o & 0x80) << 1)) & 0xFFFF",
+            f"cycles = cycles + taken * (1 + (((pc + {op.length}) ^ t) > 0xFF))",
+            f"state.PC[I] = numpy.where(taken, t, pc + {op.length})",
+        ]
+    else:
+        lines += [Memory(line) for line in SemanticsCode(op.semantics, None, value, LockstepWrite, pc="pc")]
+        if op.kind == "op":
+            lines.append(f"state.PC[I] = pc + {op.length}")
+        else:
+            lines.append("state.PC[I] = PC")
+    return lines + ["state.cycles[I] += cycles", "state.count[I] += 1"], prologue
+
+
+def FunctionCode(name, lines, prologue=()):
+    """ Returns source of the function name(state, RAM, I, pc), which runs the prologue, loads the registers used by lines
+        and stores the changed ones
+    """
+    code = "\n".join(lines)
+    loads = [f"{register} = state.{register}[I]" for register in REGISTERS if re.search(rf"\b{register}\b", code)]
+    stores = [f"state.{register}[I] = {register}" for register in REGISTERS
+              if re.search(rf"^ *(\w+ = )*(\w+, )*{register}(, \w+)* (=|&=|\|=)", code, re.MULTILINE)]
+    return "\n".join([f"def {name}(state, RAM, I, pc):"] + ["    " + line for line in [*prologue, *loads, *lines, *stores]]) + "\n"
+
+
+class Columns():
+    """ Table of tuples kept as arrays of its columns - indexing by an array returns the tuple of the arrays, like the table
+        returns a tuple for one index
+    """
+
+    def __init__(self, table):
+        self.columns = numpy.array(table, dtype=INT).T.copy()
+
+    def __getitem__(self, index):
+        return self.columns[:, index]
+
+
+def Generate():
+    """ Compiles the functions of all 256 opcodes and returns them as a list indexed by the opcode """
+    namespace = {name: Columns(table) if isinstance(table[0], tuple) else numpy.array(table, dtype=INT)
+                 for name, table in TABLES.items()}
+    namespace.update(numpy=numpy, INT=INT, BRK=BRK, HALT=HALT)
+    source = "\n".join(FunctionCode(f"Opcode{opcode:02X}", *OpcodeCode(OPCODES.get(opcode))) for opcode in range(0x100))
+    exec(compile(source, "<lockstep>", "exec"), namespace)
+    return [namespace[f"Opcode{opcode:02X}"] for opcode in range(0x100)]
+
+
+FUNCTIONS = Generate()
+NZ = numpy.array(TABLES["NZ"], dtype=INT)
+NZVALUE = numpy.array(TABLES["NZVALUE"], dtype=INT)
+
+
+# ---- ENGINE ----
+
+class Lockstep():
+    """ count instances of the CPU, each with its own memory and registers """
+
+    def __init__(self, count, resetVector=0x8000):
+        self.RAM = numpy.zeros((count, 0x10000), dtype=numpy.uint8)
+        self.resetVector = resetVector
+        self.skipIdle = True    # if Run without a limit stops the instances in idle loops (see idle.py)
+        self.Reset()
+
+    def __len__(self):
+        return len(self.RAM)
+
+    def Reset(self, clearMemory=False):
+        """ Sets registers of all instances to zero and PC to resetVector """
+        count = len(self.RAM)
+        self.A = numpy.zeros(count, dtype=INT)
+        self.X = numpy.zeros(count, dtype=INT)
+        self.Y = numpy.zeros(count, dtype=INT)
+        self.P = numpy.zeros(count, dtype=INT)
+        self.S = numpy.zeros(count, dtype=INT)
+        self.nz = numpy.zeros(count, dtype=INT)
+        self.PC = numpy.full(count, self.resetVector, dtype=INT)
+        self.count = numpy.zeros(count, dtype=INT)          # instructions executed by the last Run
+        self.instructions = numpy.zeros(count, dtype=INT)   # instructions executed since Reset
+        self.cycles = numpy.zeros(count, dtype=INT)         # cycles since Reset
+        self.reason = numpy.zeros(count, dtype=numpy.int8)  # index into REASONS
+        if clearMemory:
+            self.RAM[:] = 0
+        return
+
+    def Load(self, data, address=None):
+        """ Writes bytes of data into memory of all instances starting at address (resetVector if not given) """
+        if address is None:
+            address = self.resetVector
+        if address + len(data) > 0x10000:
+            raise ValueError(f"{len(data)} bytes do not fit into memory at ${address:04X}")
+        self.RAM[:, address:address + len(data)] = numpy.frombuffer(bytes(data), dtype=numpy.uint8)
+        return
+
+    def LoadAssembly(self, source, address=None, directory=None):
+        """ Assembles source (see assembler.py) and writes it into memory of all instances from address (resetVector if not given) """
+        program = assembler.Assemble(source, self.resetVector if address is None else address, directory)
+        for start, data in program.segments:
+            self.Load(data, start)
+        return program
+
+    def Run(self, maxInstructions=None):
+        """ Executes every instance until it reaches a break or not known instruction, or until it executed maxInstructions.
+            Returns array of the numbers of executed instructions and list of the reasons of the stop ('brk', 'halt', 'limit'
+            or 'idle').
+        """
+        limited = maxInstructions is not None
+        if maxInstructions is None:
+            maxInstructions = sys.maxsize
+
+        RAM = self.RAM
+        self.nz = NZVALUE[self.P & 0x82]
+        self.count[:] = 0
+        self.reason[:] = RUNNING if maxInstructions > 0 else LIMIT
+        pcs = numpy.where(self.reason == RUNNING, self.PC, END)
+        # count of every instance, on which it stops - or without a limit looks for an idle loop like CPU.Run
+        stops = numpy.full(len(self), maxInstructions if limited or not self.skipIdle else idle.SLICE, dtype=INT)
+
+        while True:
+            pc = int(pcs.min())
+            if pc == END:
+                break
+            I = numpy.flatnonzero(pcs == pc)
+            ops = RAM[I, pc]
+            first = ops[0]
+            if (ops == first).all():
+                FUNCTIONS[first](self, RAM, I, pc)
+            else:
+                for op in numpy.unique(ops):
+                    FUNCTIONS[op](self, RAM, I[ops == op], pc)
+
+            reason = self.reason[I]
+            due = (reason == RUNNING) & (self.count[I] >= stops[I])
+            if due.any():
+                if limited:
+                    reason[due] = LIMIT
+                else:
+                    for index in numpy.flatnonzero(due):
+                        reason[index] = self.FastForward(I[index])
+                        stops[I[index]] = self.count[I[index]] + idle.SLICE
+            self.reason[I] = reason
+            pcs[I] = numpy.where(reason == RUNNING, self.PC[I], END)
+
+        self.P = self.P & 0x7D | NZ[self.nz]
+        self.instructions += self.count
+        return self.count.copy(), [REASONS[reason] for reason in self.reason]
+
+    def FastForward(self, index):
+        """ Steps the instance index by idle.FastForward on a CPU with its state during Run - the stepped instructions
+            don't store, so only the registers and counters are copied back. Returns the reason (index into REASONS).
+        """
+        P = self.P[index]
+        self.P[index] = P & 0x7D | NZ[self.nz[index]]
+        cpu = self.Instance(index)
+        self.P[index] = P
+        done, reason = idle.FastForward(cpu)
+        if done:
+            self.A[index], self.X[index], self.Y[index], self.S[index], self.PC[index] = cpu.A, cpu.X, cpu.Y, cpu.S, cpu.PC
+            self.P[index] = cpu.P
+            self.nz[index] = NZVALUE[cpu.P & 0x82]
+            self.count[index] += done
+            self.cycles[index] = cpu.cycles
+        return RUNNING if reason == "limit" else REASONS.index(reason)
+
+    def Instance(self, index):
+        """ Returns CPU with the memory and registers of the instance index """
+        cpu = CPU()
+        cpu.resetVector = self.resetVector
+        cpu.RAM[:] = self.RAM[index].tobytes()
+        cpu.A = int(self.A[index])
+        cpu.X = int(self.X[index])
+        cpu.Y = int(self.Y[index])
+        cpu.P = int(self.P[index])
+        cpu.S = int(self.S[index])
+        cpu.PC = int(self.PC[index])
+        cpu.instructions = int(self.instructions[index])
+        cpu.cycles = int(self.cycles[index])
+        return cpu
@@ -0,0 +1,211 @@
+"""
+Loops executed at once - counter, fill and copy loops with an index register.
+
+A loop is a body of instructions closed by bne or jmp back to its first instruction. The body changes the index register
+(inx, dex, iny or dey) and may store A or copy bytes with the index:
+
+    clear:  sta $0400,X         ; fill - also dex before sta and loops closed by jmp, like tests/self-destruct.txt
+            dex
+            bne clear
+    copy:   lda $2000,Y         ; copy
+            sta $0400,Y
+            iny
+            bne copy
+    delay:  dex                 ; counter
+            bne delay
+
+A loop closed by bne ends when the index register gets to zero, so the number of iterations is known before it starts,
+a loop closed by jmp runs at most 256 iterations (then it stores the same bytes again). Run executes as many iterations
+as fit into the limit of instructions with one slice of RAM and returns the registers, the flags and the cycles, which are
+the same as after executing the instructions one by one. The iterations stop before the first store into the code of
+the loop itself - the rest runs instruction by instruction, so a loop overwriting itself works as before. Loops working
+with pages of devices or watchpoints, copies between overlapping ranges and addresses wrapping around $FFFF are not
+executed at once.
+
+The fused interpreter checks the loops like the groups of opcodes.FUSIONS, the JIT and AOT keep Loop.Execute instead
+of the block at the start of a loop.
+"""
+
+import itertools
+
+from .breakpoints import TRAP_WATCH
+from .bus import TRAP_DEVICE
+from .opcodes import ENCODE, NZ, OPCODES
+
+# mnemonic of the step: index register and the change of it
+STEPS = {"inx": ("X", 1), "dex": ("X", -1), "iny": ("Y", 1), "dey": ("Y", -1)}
+
+# bodies of the loops - 'step' is the mnemonic from STEPS, sta and lda use the mode abs with the index register;
+# a copy with the step first is closed only by jmp, with bne the loaded byte would end the loop
+BODIES = {
+    ("step",): ("bne",),
+    ("sta", "step"): ("bne", "jmp"),
+    ("step", "sta"): ("bne", "jmp"),
+    ("lda", "sta", "step"): ("bne", "jmp"),
+    ("step", "lda", "sta"): ("jmp",),
+}
+
+ITERATIONS = 0x100  # maximal number of iterations of a loop closed by jmp executed at once
+
+
+class Loop():
+    """ Shape of a loop - the opcodes of its body closed by bne or jmp """
+
+    def __init__(self, ops):
+        self.ops = ops
+        self.opcodes = [op.opcode for op in ops]
+        self.closing = ops[-1].mnemonic
+        step = next(op for op in ops if op.mnemonic in STEPS)
+        self.register, self.step = STEPS[step.mnemonic]
+        self.stepFirst = ops[0] is step
+        self.length = sum(op.length for op in ops)      # bytes of the code of the loop
+        self.size = len(ops)                            # instructions of one iteration
+        self.cycles = sum(op.cycles for op in ops)      # cycles of one iteration without a taken branch and crossed pages
+        self.load = self.store = None                   # offsets of the operands of lda and sta in the loop
+        offset = 0
+        for op in ops:
+            if op.mnemonic == "lda":
+                self.load = offset + 1
+            elif op.mnemonic == "sta":
+                self.store = offset + 1
+            offset += op.length
+        # the flags N and Z are set by the last lda or step of the body
+        self.loaded = [op.mnemonic for op in ops if op.mnemonic == "lda" or op is step][-1] == "lda"
+
+    def __repr__(self):
+        return "Loop(" + " ".join(f"{op.mnemonic} {op.mode}" for op in self.ops) + ")"
+
+    def Conditions(self, pc="PC"):
+        """ Returns list of expressions, which are all true if the loop is on the address pc (its first opcode is not checked) """
+        conditions = []
+        offset = 0
+        for op in self.ops:
+            if offset:
+                conditions.append(f"RAM[{pc}+{offset}] == 0x{op.opcode:02X}")
+            offset += op.length
+        if self.closing == "bne":
+            conditions.append(f"RAM[{pc}+{self.length - 1}] == 0x{-self.length & 0xFF:02X}")
+        else:
+            conditions.append(f"RAM[{pc}+{self.length - 2}] | RAM[{pc}+{self.length - 1}] << 8 == {pc}")
+        return conditions
+
+    def At(self, RAM, pc):
+        """ Returns True if the loop is on the address pc """
+        if pc + self.length > 0x10000:
+            return False
+        offset = 0
+        for op in self.ops:
+            if RAM[pc + offset] != op.opcode:
+                return False
+            offset += op.length
+        if self.closing == "bne":
+            return RAM[pc + self.length - 1] == -self.length & 0xFF
+        return RAM[pc + self.length - 2] | RAM[pc + self.length - 1] << 8 == pc
+
+    def Run(self, cpu, PC, A, index, budget):
+        """ Executes the iterations of the loop on PC, which fit into budget instructions, at once. index is the value of
+            the index register. Returns None if no iteration can be executed at once, otherwise tuple of the executed
+            instructions, their cycles, A, the index register, the value of the flags N and Z (see opcodes.NZ) and PC.
+        """
+        RAM = cpu.RAM
+        traps = cpu.pageTraps
+        step = self.step
+        trip = -step * index & 0xFF or 0x100
+        n = min(trip if self.closing == "bne" else ITERATIONS, budget // self.size)
+        first = (index + step) & 0xFF if self.stepFirst else index    # index of the first access to memory
+        store = load = None
+        if self.store is not None:
+            store = RAM[PC + self.store] | RAM[PC + self.store + 1] << 8
+            if store > 0xFF00 or (traps[store >> 8] | traps[(store + 0xFF) >> 8]) & (TRAP_DEVICE | TRAP_WATCH):
+                return None
+            # stop before the store into the loop
+            for address in range(max(PC, store), min(PC + self.length, store + 0x100)):
+                n = min(n, (address - store - first) * step & 0xFF)
+        if self.load is not None:
+            load = RAM[PC + self.load] | RAM[PC + self.load + 1] << 8
+            if load > 0xFF00 or (traps[load >> 8] | traps[(load + 0xFF) >> 8]) & (TRAP_DEVICE | TRAP_WATCH):
+                return None
+            if load != store and abs(load - store) < 0x100:
+                return None
+        if n == 0:
+            return None
+
+        # the accessed indexes are first, first + step, ... - n consecutive numbers, up to two ranges without wrapping
+        low = first if step == 1 else (first - n + 1) & 0xFF
+        ranges = [(low, min(low + n, 0x100))]
+        if low + n > 0x100:
+            ranges.append((0, low + n - 0x100))
+        last = (first + step * (n - 1)) & 0xFF
+        cycles = self.cycles * n
+        if load is not None:
+            A = RAM[load + last]
+            # reading crosses a page on the indexes from 0x100 - the low byte of the address
+            edge = 0x100 - (load & 0xFF)
+            cycles += sum(max(0, end - max(start, edge)) for start, end in ranges)
+        if store is not None:
+            for start, end in ranges:
+                if load is None:
+                    RAM[store + start:store + end] = bytes((A,)) * (end - start)
+                else:
+                    RAM[store + start:store + end] = RAM[load + start:load + end]
+                for page in range((store + start) >> 8, ((store + end - 1) >> 8) + 1):
+                    if traps[page]:
+                        # the same as the stores one by one - the page is marked written, translated code on it removed
+                        address = max(page << 8, store + start)
+                        cpu.TrappedWrite(address, RAM[address])
+                        cpu.CodeChanged(address, min((page + 1) << 8, store + end))
+
+        index = (index + step * n) & 0xFF
+        exited = self.closing == "bne" and n == trip
+        if self.closing == "bne":
+            taken = n - exited
+            cycles += taken * (1 + (((PC + self.length) ^ PC) > 0xFF))
+        return n * self.size, cycles, A, index, A if self.loaded else index, PC + self.length if exited else PC
+
+    def Execute(self, cpu, budget):
+        """ Runs the loop on PC of cpu like CPU.Interpret(budget) - the iterations at once, or one iteration by the interpreter
+            when they can't be executed at once. Returns the number of executed instructions and the reason of the stop.
+        """
+        index = cpu.X if self.register == "X" else cpu.Y
+        result = self.Run(cpu, cpu.PC, cpu.A, index, budget)
+        if result is None:
+            return cpu.Interpret(min(self.size, budget))
+        count, cycles, cpu.A, index, nz, cpu.PC = result
+        if self.register == "X":
+            cpu.X = index
+        else:
+            cpu.Y = index
+        cpu.P = cpu.P & 0x7D | NZ[nz]
+        cpu.instructions += count
+        cpu.cycles += cycles
+        return count, "limit"
+
+
+def Shapes():
+    """ Returns list of all Loops """
+    shapes = []
+    for (body, closings), step in itertools.product(BODIES.items(), STEPS):
+        register = STEPS[step][0]
+        for closing in closings:
+            mnemonics = [(step, "imp") if mnemonic == "step" else (mnemonic, f"abs,{register}") for mnemonic in body]
+            mnemonics.append((closing, "rel" if closing == "bne" else "abs"))
+            shapes.append(Loop([OPCODES[ENCODE[mnemonic]] for mnemonic in mnemonics]))
+    return shapes
+
+
+LOOPS = Shapes()
+
+# first opcode: list of (index in LOOPS, Loop)
+BY_OPCODE = {}
+for number, loop in enumerate(LOOPS):
+    BY_OPCODE.setdefault(loop.opcodes[0], []).append((number, loop))
+
+
+def Recognize(RAM, pc):
+    """ Returns the Loop on the address pc or None """
+    if pc > 0xFFFF:
+        return None
+    for number, loop in BY_OPCODE.get(RAM[pc], ()):
+        if loop.At(RAM, pc):
+            return loop
+    return None
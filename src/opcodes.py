@@ -0,0 +1,573 @@
+"""
+Specification of the instructions of the 6502 CPU.
+
+Everything the emulator knows about an instruction is written here once: the table SPEC gives for every opcode its mnemonic,
+address mode, length and number of cycles, SEMANTICS gives for every mnemonic python code of what it does.
+The table has all 151 documented opcodes of the NMOS 6502 with all address modes.
+FUSIONS gives the code of common groups of instructions, which the interpreter executes together.
+The interpreter and the JIT generate their code from it (see interpreter.py), the assembler (CPU.Translate) and the disassembler
+(CPU.Encode) use the tables ENCODE and OPCODES made from it.
+
+Code of the semantics works with registers in local variables A, X, Y, S, P, PC and memory in RAM:
+    {value}     - is replaced by the value of the operand
+    {pc}        - is replaced by the address of the instruction
+    a           - is the effective address of the operand (all modes with an address)
+    write(v)    - stores v on the address a
+    nz          - value of the flags N and Z, which are not kept in P until it is stored (see NZ)
+    ADC, SBC    - tables of the result, nz and the flags C, V of the addition and subtraction, binary and decimal
+The stack is on the page 1 (0x100 | S), S points to the first free byte below the top and moves down.
+"""
+
+# ---- TABLES ----
+
+# The flags N and Z are lazy: the code keeps the value they are taken from in the local variable nz and puts them into P
+# only when P is stored (NZ[nz]). Value 0x100 has both flags set, which no 8-bit result has.
+NZ = [(0x80 if value & 0x180 else 0) | (0x02 if value & 0xFF == 0 else 0) for value in range(0x200)]
+
+# P & 0x82: value of nz with the same flags N and Z
+NZVALUE = [0x01] * 0x83
+NZVALUE[0x02] = 0x00
+NZVALUE[0x80] = 0x80
+NZVALUE[0x82] = 0x100
+
+
+def AddTable(operation):
+    """ Returns table of the operation(A, m, carry, decimal) for every (P & 0x09) << 16 | A << 8 | m - with the flags D and C of P,
+        - tuple of the result, nz of the result and the flags C and V (0x41)
+    """
+    table = [(0, 0, 0)] * 0xA0000
+    values = {}     # the same tuples are one object, so that the table takes less memory
+    for flags in (0x00, 0x01, 0x08, 0x09):
+        table[flags << 16:(flags + 1) << 16] = [values.setdefault(value, value) for value in
+                                                 (operation(A, m, flags & 0x01, flags & 0x08) for A in range(0x100) for m in range(0x100))]
+    return table
+
+
+def Flags(result, carry, overflow, nz=None):
+    """ Returns value of the table of ADC or SBC, nz is the result if not given """
+    return result, result if nz is None else nz, carry | overflow << 6
+
+
+def Add(A, m, carry, decimal):
+    s = A + m + carry
+    r = s & 0xFF
+    if not decimal:
+        return Flags(r, s > 0xFF, (~(A ^ m) & (A ^ r) & 0x80) != 0)
+
+    # NMOS 6502: the digits are corrected one by one, N and V are taken before the correction of the high digit
+    # and Z from the binary sum
+    low = (A & 0x0F) + (m & 0x0F) + carry
+    if low >= 0x0A:
+        low = ((low + 0x06) & 0x0F) + 0x10
+    t = (A & 0xF0) + (m & 0xF0) + low
+    signed = (A & 0xF0) - ((A & 0x80) << 1) + (m & 0xF0) - ((m & 0x80) << 1) + low
+    overflow = not -0x80 <= signed <= 0x7F
+    nz = (0x100 if r == 0 else 0x80) if t & 0x80 else (0x00 if r == 0 else 0x01)
+    if t >= 0xA0:
+        t += 0x60
+    return Flags(t & 0xFF, t > 0xFF, overflow, nz)
+
+
+def Subtract(A, m, carry, decimal):
+    # the carry is clear when the subtraction borrows
+    s = A - m - (1 - carry)
+    r = s & 0xFF
+    if not decimal:
+        return Flags(r, s >= 0, ((A ^ m) & (A ^ r) & 0x80) != 0)
+
+    # NMOS 6502: the flags are the same as of the binary subtraction
+    low = (A & 0x0F) - (m & 0x0F) + carry - 1
+    if low < 0:
+        low = ((low - 0x06) & 0x0F) - 0x10
+    t = (A & 0xF0) - (m & 0xF0) + low
+    if t < 0:
+        t -= 0x60
+    return Flags(t & 0xFF, s >= 0, ((A ^ m) & (A ^ r) & 0x80) != 0, r)
+
+
+ADC = AddTable(Add)
+SBC = AddTable(Subtract)
+
+TABLES = {"NZ": NZ, "NZVALUE": NZVALUE, "ADC": ADC, "SBC": SBC}  # globals of the generated code
+
+# address mode: length of the instruction
+#   zp - zero page, ind - (abs) of jmp, ind,X - (zp,X), ind,Y - (zp),Y
+MODES = {"A": 1, "imp": 1, "imm": 2, "rel": 2, "zp": 2, "zp,X": 2, "zp,Y": 2, "abs": 3, "abs,X": 3, "abs,Y": 3,
+         "ind": 3, "ind,X": 2, "ind,Y": 2}
+
+# mnemonic: (kind, semantics), 'mnemonic A' for the mode A of the instructions which also work with memory
+#   op     - code, after which PC moves to the next instruction
+#   branch - condition on which the branch is taken
+#   jump   - code, which sets PC
+#   halt   - brk: stops the CPU when the vector at $FFFE is zero, otherwise the code of the interrupt, which sets PC
+SEMANTICS = {
+    "adc": ("op", """
+A, nz, t = ADC[(P & 0x09) << 16 | A << 8 | {value}]
+P = P & 0xBE | t
+"""),
+    "and": ("op", """
+nz = A = A & {value}
+"""),
+    "asl A": ("op", """
+P = P & 0xFE | A >> 7
+nz = A = (A << 1) & 0xFF
+"""),
+    "asl": ("op", """
+m = {value}
+P = P & 0xFE | m >> 7
+nz = m = (m << 1) & 0xFF
+write(m)
+"""),
+    "bcc": ("branch", "not P & 0x01"),
+    "bcs": ("branch", "P & 0x01"),
+    "beq": ("branch", "not nz & 0xFF"),
+    "bit": ("op", """
+m = {value}
+P = P & 0xBF | m & 0x40
+nz = A & m | (m & 0x80) << 1
+"""),
+    "bmi": ("branch", "nz & 0x180"),
+    "bne": ("branch", "nz & 0xFF"),
+    "bpl": ("branch", "not nz & 0x180"),
+    "brk": ("halt", """
+t = ({pc} + 2) & 0xFFFF
+a = 0x100 | S
+write(t >> 8)
+a = 0x100 | (S - 1) & 0xFF
+write(t & 0xFF)
+a = 0x100 | (S - 2) & 0xFF
+write(P & 0x7D | NZ[nz] | 0x30)
+S = (S - 3) & 0xFF
+P |= 0x04
+PC = RAM[0xFFFE] | RAM[0xFFFF] << 8
+"""),
+    "bvc": ("branch", "not P & 0x40"),
+    "bvs": ("branch", "P & 0x40"),
+    "clc": ("op", """
+P &= 0xFE
+"""),
+    "cld": ("op", """
+P &= 0xF7
+"""),
+    "cli": ("op", """
+P &= 0xFB
+"""),
+    "clv": ("op", """
+P &= 0xBF
+"""),
+    "cmp": ("op", """
+m = {value}
+nz = (A - m) & 0xFF
+P = P & 0xFE | (A >= m)
+"""),
+    "cpx": ("op", """
+m = {value}
+nz = (X - m) & 0xFF
+P = P & 0xFE | (X >= m)
+"""),
+    "cpy": ("op", """
+m = {value}
+nz = (Y - m) & 0xFF
+P = P & 0xFE | (Y >= m)
+"""),
+    "dec": ("op", """
+nz = m = ({value} - 1) & 0xFF
+write(m)
+"""),
+    "dex": ("op", """
+nz = X = (X - 1) & 0xFF
+"""),
+    "dey": ("op", """
+nz = Y = (Y - 1) & 0xFF
+"""),
+    "eor": ("op", """
+nz = A = A ^ {value}
+"""),
+    "inc": ("op", """
+nz = m = ({value} + 1) & 0xFF
+write(m)
+"""),
+    "inx": ("op", """
+nz = X = (X + 1) & 0xFF
+"""),
+    "iny": ("op", """
+nz = Y = (Y + 1) & 0xFF
+"""),
+    "jmp": ("jump", """
+PC = a
+"""),
+    "jmp ind": ("jump", """
+PC = RAM[a] | RAM[a & 0xFF00 | (a + 1) & 0xFF] << 8
+"""),
+    "jsr": ("jump", """
+t = ({pc} + 2) & 0xFFFF
+PC = a
+a = 0x100 | S
+write(t >> 8)
+a = 0x100 | (S - 1) & 0xFF
+write(t & 0xFF)
+S = (S - 2) & 0xFF
+"""),
+    "lda": ("op", """
+nz = A = {value}
+"""),
+    "ldx": ("op", """
+nz = X = {value}
+"""),
+    "ldy": ("op", """
+nz = Y = {value}
+"""),
+    "lsr A": ("op", """
+P = P & 0xFE | A & 0x01
+nz = A = A >> 1
+"""),
+    "lsr": ("op", """
+m = {value}
+P = P & 0xFE | m & 0x01
+nz = m = m >> 1
+write(m)
+"""),
+    "nop": ("op", ""),
+    "ora": ("op", """
+nz = A = A | {value}
+"""),
+    "pha": ("op", """
+a = 0x100 | S
+S = (S - 1) & 0xFF
+write(A)
+"""),
+    "php": ("op", """
+a = 0x100 | S
+S = (S - 1) & 0xFF
+write(P & 0x7D | NZ[nz] | 0x30)
+"""),
+    "pla": ("op", """
+S = (S + 1) & 0xFF
+nz = A = RAM[0x100 | S]
+"""),
+    "plp": ("op", """
+S = (S + 1) & 0xFF
+P = RAM[0x100 | S] & 0xCF
+nz = NZVALUE[P & 0x82]
+"""),
+    "rol A": ("op", """
+c = A >> 7
+nz = A = ((A << 1) & 0xFF) | (P & 0x01)
+P = P & 0xFE | c
+"""),
+    "rol": ("op", """
+m = {value}
+c = m >> 7
+nz = m = ((m << 1) & 0xFF) | (P & 0x01)
+P = P & 0xFE | c
+write(m)
+"""),
+    "ror A": ("op", """
+c = A & 0x01
+nz = A = (A >> 1) | ((P & 0x01) << 7)
+P = P & 0xFE | c
+"""),
+    "ror": ("op", """
+m = {value}
+c = m & 0x01
+nz = m = (m >> 1) | ((P & 0x01) << 7)
+P = P & 0xFE | c
+write(m)
+"""),
+    "rti": ("jump", """
+P = RAM[0x100 | (S + 1) & 0xFF] & 0xCF
+nz = NZVALUE[P & 0x82]
+PC = RAM[0x100 | (S + 2) & 0xFF] | RAM[0x100 | (S + 3) & 0xFF] << 8
+S = (S + 3) & 0xFF
+"""),
+    "rts": ("jump", """
+PC = ((RAM[0x100 | (S + 1) & 0xFF] | RAM[0x100 | (S + 2) & 0xFF] << 8) + 1) & 0xFFFF
+S = (S + 2) & 0xFF
+"""),
+    "sbc": ("op", """
+A, nz, t = SBC[(P & 0x09) << 16 | A << 8 | {value}]
+P = P & 0xBE | t
+"""),
+    "sec": ("op", """
+P |= 0x01
+"""),
+    "sed": ("op", """
+P |= 0x08
+"""),
+    "sei": ("op", """
+P |= 0x04
+"""),
+    "sta": ("op", """
+write(A)
+"""),
+    "stx": ("op", """
+write(X)
+"""),
+    "sty": ("op", """
+write(Y)
+"""),
+    "tax": ("op", """
+nz = X = A
+"""),
+    "tay": ("op", """
+nz = Y = A
+"""),
+    "tsx": ("op", """
+nz = X = S
+"""),
+    "txa": ("op", """
+nz = A = X
+"""),
+    "txs": ("op", """
+S = X
+"""),
+    "tya": ("op", """
+nz = A = Y
+"""),
+}
+
+# Cycles are the base number of cycles of the instruction. Instructions which read memory in the modes abs,X, abs,Y and ind,Y take
+# one cycle more when the indexed address is on another page than the base address. Branches take one cycle more when they
+# are taken and one more when the branch goes to another page.
+SPEC = [
+    # opcode, mnemonic, mode, length, cycles
+    (0x69, "adc", "imm",   2, 2),
+    (0x65, "adc", "zp",    2, 3),
+    (0x75, "adc", "zp,X",  2, 4),
+    (0x6D, "adc", "abs",   3, 4),
+    (0x7D, "adc", "abs,X", 3, 4),
+    (0x79, "adc", "abs,Y", 3, 4),
+    (0x61, "adc", "ind,X", 2, 6),
+    (0x71, "adc", "ind,Y", 2, 5),
+    (0x29, "and", "imm",   2, 2),
+    (0x25, "and", "zp",    2, 3),
+    (0x35, "and", "zp,X",  2, 4),
+    (0x2D, "and", "abs",   3, 4),
+    (0x3D, "and", "abs,X", 3, 4),
+    (0x39, "and", "abs,Y", 3, 4),
+    (0x21, "and", "ind,X", 2, 6),
+    (0x31, "and", "ind,Y", 2, 5),
+    (0x0A, "asl", "A",     1, 2),
+    (0x06, "asl", "zp",    2, 5),
+    (0x16, "asl", "zp,X",  2, 6),
+    (0x0E, "asl", "abs",   3, 6),
+    (0x1E, "asl", "abs,X", 3, 7),
+    (0x90, "bcc", "rel",   2, 2),
+    (0xB0, "bcs", "rel",   2, 2),
+    (0xF0, "beq", "rel",   2, 2),
+    (0x24, "bit", "zp",    2, 3),
+    (0x2C, "bit", "abs",   3, 4),
+    (0x30, "bmi", "rel",   2, 2),
+    (0xD0, "bne", "rel",   2, 2),
+    (0x10, "bpl", "rel",   2, 2),
+    (0x00, "brk", "imp",   1, 7),
+    (0x50, "bvc", "rel",   2, 2),
+    (0x70, "bvs", "rel",   2, 2),
+    (0x18, "clc", "imp",   1, 2),
+    (0xD8, "cld", "imp",   1, 2),
+    (0x58, "cli", "imp",   1, 2),
+    (0xB8, "clv", "imp",   1, 2),
+    (0xC9, "cmp", "imm",   2, 2),
+    (0xC5, "cmp", "zp",    2, 3),
+    (0xD5, "cmp", "zp,X",  2, 4),
+    (0xCD, "cmp", "abs",   3, 4),
+    (0xDD, "cmp", "abs,X", 3, 4),
+    (0xD9, "cmp", "abs,Y", 3, 4),
+    (0xC1, "cmp", "ind,X", 2, 6),
+    (0xD1, "cmp", "ind,Y", 2, 5),
+    (0xE0, "cpx", "imm",   2, 2),
+    (0xE4, "cpx", "zp",    2, 3),
+    (0xEC, "cpx", "abs",   3, 4),
+    (0xC0, "cpy", "imm",   2, 2),
+    (0xC4, "cpy", "zp",    2, 3),
+    (0xCC, "cpy", "abs",   3, 4),
+    (0xC6, "dec", "zp",    2, 5),
+    (0xD6, "dec", "zp,X",  2, 6),
+    (0xCE, "dec", "abs",   3, 6),
+    (0xDE, "dec", "abs,X", 3, 7),
+    (0xCA, "dex", "imp",   1, 2),
+    (0x88, "dey", "imp",   1, 2),
+    (0x49, "eor", "imm",   2, 2),
+    (0x45, "eor", "zp",    2, 3),
+    (0x55, "eor", "zp,X",  2, 4),
+    (0x4D, "eor", "abs",   3, 4),
+    (0x5D, "eor", "abs,X", 3, 4),
+    (0x59, "eor", "abs,Y", 3, 4),
+    (0x41, "eor", "ind,X", 2, 6),
+    (0x51, "eor", "ind,Y", 2, 5),
+    (0xE6, "inc", "zp",    2, 5),
+    (0xF6, "inc", "zp,X",  2, 6),
+    (0xEE, "inc", "abs",   3, 6),
+    (0xFE, "inc", "abs,X", 3, 7),
+    (0xE8, "inx", "imp",   1, 2),
+    (0xC8, "iny", "imp",   1, 2),
+    (0x4C, "jmp", "abs",   3, 3),
+    (0x6C, "jmp", "ind",   3, 5),
+    (0x20, "jsr", "abs",   3, 6),
+    (0xA9, "lda", "imm",   2, 2),
+    (0xA5, "lda", "zp",    2, 3),
+    (0xB5, "lda", "zp,X",  2, 4),
+    (0xAD, "lda", "abs",   3, 4),
+    (0xBD, "lda", "abs,X", 3, 4),
+    (0xB9, "lda", "abs,Y", 3, 4),
+    (0xA1, "lda", "ind,X", 2, 6),
+    (0xB1, "lda", "ind,Y", 2, 5),
+    (0xA2, "ldx", "imm",   2, 2),
+    (0xA6, "ldx", "zp",    2, 3),
+    (0xB6, "ldx", "zp,Y",  2, 4),
+    (0xAE, "ldx", "abs",   3, 4),
+    (0xBE, "ldx", "abs,Y", 3, 4),
+    (0xA0, "ldy", "imm",   2, 2),
+    (0xA4, "ldy", "zp",    2, 3),
+    (0xB4, "ldy", "zp,X",  2, 4),
+    (0xAC, "ldy", "abs",   3, 4),
+    (0xBC, "ldy", "abs,X", 3, 4),
+    (0x4A, "lsr", "A",     1, 2),
+    (0x46, "lsr", "zp",    2, 5),
+    (0x56, "lsr", "zp,X",  2, 6),
+    (0x4E, "lsr", "abs",   3, 6),
+    (0x5E, "lsr", "abs,X", 3, 7),
+    (0xEA, "nop", "imp",   1, 2),
+    (0x09, "ora", "imm",   2, 2),
+    (0x05, "ora", "zp",    2, 3),
+    (0x15, "ora", "zp,X",  2, 4),
+    (0x0D, "ora", "abs",   3, 4),
+    (0x1D, "ora", "abs,X", 3, 4),
+    (0x19, "ora", "abs,Y", 3, 4),
+    (0x01, "ora", "ind,X", 2, 6),
+    (0x11, "ora", "ind,Y", 2, 5),
+    (0x48, "pha", "imp",   1, 3),
+    (0x08, "php", "imp",   1, 3),
+    (0x68, "pla", "imp",   1, 4),
+    (0x28, "plp", "imp",   1, 4),
+    (0x2A, "rol", "A",     1, 2),
+    (0x26, "rol", "zp",    2, 5),
+    (0x36, "rol", "zp,X",  2, 6),
+    (0x2E, "rol", "abs",   3, 6),
+    (0x3E, "rol", "abs,X", 3, 7),
+    (0x6A, "ror", "A",     1, 2),
+    (0x66, "ror", "zp",    2, 5),
+    (0x76, "ror", "zp,X",  2, 6),
+    (0x6E, "ror", "abs",   3, 6),
+    (0x7E, "ror", "abs,X", 3, 7),
+    (0x40, "rti", "imp",   1, 6),
+    (0x60, "rts", "imp",   1, 6),
+    (0xE9, "sbc", "imm",   2, 2),
+    (0xE5, "sbc", "zp",    2, 3),
+    (0xF5, "sbc", "zp,X",  2, 4),
+    (0xED, "sbc", "abs",   3, 4),
+    (0xFD, "sbc", "abs,X", 3, 4),
+    (0xF9, "sbc", "abs,Y", 3, 4),
+    (0xE1, "sbc", "ind,X", 2, 6),
+    (0xF1, "sbc", "ind,Y", 2, 5),
+    (0x38, "sec", "imp",   1, 2),
+    (0xF8, "sed", "imp",   1, 2),
+    (0x78, "sei", "imp",   1, 2),
+    (0x85, "sta", "zp",    2, 3),
+    (0x95, "sta", "zp,X",  2, 4),
+    (0x8D, "sta", "abs",   3, 4),
+    (0x9D, "sta", "abs,X", 3, 5),
+    (0x99, "sta", "abs,Y", 3, 5),
+    (0x81, "sta", "ind,X", 2, 6),
+    (0x91, "sta", "ind,Y", 2, 6),
+    (0x86, "stx", "zp",    2, 3),
+    (0x96, "stx", "zp,Y",  2, 4),
+    (0x8E, "stx", "abs",   3, 4),
+    (0x84, "sty", "zp",    2, 3),
+    (0x94, "sty", "zp,X",  2, 4),
+    (0x8C, "sty", "abs",   3, 4),
+    (0xAA, "tax", "imp",   1, 2),
+    (0xA8, "tay", "imp",   1, 2),
+    (0xBA, "tsx", "imp",   1, 2),
+    (0x8A, "txa", "imp",   1, 2),
+    (0x9A, "txs", "imp",   1, 2),
+    (0x98, "tya", "imp",   1, 2),
+]
+
+
+# mnemonics of a group of instructions executed by one dispatch of the interpreter: semantics of the whole group
+#   {value}     - operand of the first instruction of the group with an operand
+#   a           - effective address of the last instruction of the group with an address
+#   branch(c)   - the group ends with a branch taken when c is true
+# The flags are computed once and must end the same as after the instructions one by one.
+# Only the instructions in FUSION_MODES are fused - every other opcode in a group would make the check of the following
+# opcode longer for all instructions which are not followed by a group.
+FUSION_MODES = {"A", "imp", "imm", "rel", "zp", "abs", "abs,X"}
+FUSIONS = {
+    ("clc", "adc"): """
+A, nz, t = ADC[(P & 0x08) << 16 | A << 8 | {value}]
+P = P & 0xBE | t
+""",
+    ("sec", "sbc"): """
+A, nz, t = SBC[(P & 0x08) << 16 | 0x10000 | A << 8 | {value}]
+P = P & 0xBE | t
+""",
+    ("txa", "clc", "adc"): """
+A, nz, t = ADC[(P & 0x08) << 16 | X << 8 | {value}]
+P = P & 0xBE | t
+""",
+    ("txa", "sec", "sbc"): """
+A, nz, t = SBC[(P & 0x08) << 16 | 0x10000 | X << 8 | {value}]
+P = P & 0xBE | t
+""",
+    ("lda", "sta"): """
+nz = A = {value}
+write(A)
+""",
+    ("cmp", "bne"): """
+m = {value}
+nz = (A - m) & 0xFF
+P = P & 0xFE | (A >= m)
+branch(A != m)
+""",
+    ("cmp", "beq"): """
+m = {value}
+nz = (A - m) & 0xFF
+P = P & 0xFE | (A >= m)
+branch(A == m)
+""",
+    ("dex", "bne"): """
+nz = X = (X - 1) & 0xFF
+branch(X)
+""",
+    ("dey", "bne"): """
+nz = Y = (Y - 1) & 0xFF
+branch(Y)
+""",
+    ("inx", "bne"): """
+nz = X = (X + 1) & 0xFF
+branch(X)
+""",
+    ("inx", "txa"): """
+nz = A = X = (X + 1) & 0xFF
+""",
+    ("tay", "txa"): """
+Y = A
+nz = A = X
+""",
+    ("tax", "tya"): """
+X = A
+nz = A = Y
+""",
+}
+
+
+class Opcode():
+    """ One row of SPEC with the semantics of its mnemonic """
+
+    def __init__(self, opcode, mnemonic, mode, length, cycles):
+        self.opcode = opcode
+        self.mnemonic = mnemonic
+        self.mode = mode
+        self.length = length
+        self.cycles = cycles
+        self.kind, self.semantics = SEMANTICS.get(f"{mnemonic} {mode}") or SEMANTICS[mnemonic]
+        # if crossing a page costs a cycle
+        self.pageCross = mode in ("abs,X", "abs,Y", "ind,Y") and "write(" not in self.semantics
+
+    def __repr__(self):
+        return f"Opcode(${self.opcode:02X} {self.mnemonic} {self.mode})"
+
+
+OPCODES = {row[0]: Opcode(*row) for row in SPEC}                            # opcode: Opcode
+ENCODE = {(op.mnemonic, op.mode): op.opcode for op in OPCODES.values()}    # (mnemonic, mode): opcode
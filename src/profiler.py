@@ -0,0 +1,156 @@
+"""
+Profiler of the executed instructions.
+
+When cpu.profiler is a Profiler, the CPU runs the profiling interpreter (see interpreter.CHECKING), which after every instruction
+adds one to the count of its opcode (table of 256 counts) and to the count of its address (table of 65536 counts).
+Without the profiler the interpreter doesn't count anything.
+
+Blocks groups the counts into basic blocks - instructions following each other up to a branch, jump or brk, which were
+executed the same number of times - and Report prints the most executed ones with their code disassembled by CPU.Encode:
+
+    python profiler.py tests/bubbleSort.txt --top 5
+    python profiler.py program.txt --folded program.folded --json program.json
+"""
+
+import argparse
+import json
+import sys
+from array import array
+
+from .opcodes import OPCODES
+
+
+class Block():
+    """ Basic block - instructions on addresses, all executed count times """
+
+    def __init__(self, addresses, count):
+        self.addresses = addresses
+        self.count = count
+
+    @property
+    def start(self):
+        return self.addresses[0]
+
+    @property
+    def end(self):
+        """ Address of the last instruction of the block """
+        return self.addresses[-1]
+
+    @property
+    def instructions(self):
+        """ Number of the instructions executed in the block """
+        return self.count * len(self.addresses)
+
+
+class Profiler():
+    """ Numbers of executions of every opcode (opcodes) and of the instruction on every address (addresses) """
+
+    def __init__(self):
+        self.opcodes = array("Q", bytes(8 * 0x100))
+        self.addresses = array("Q", bytes(8 * 0x10000))
+
+    def __len__(self):
+        """ Number of all counted instructions """
+        return sum(self.opcodes)
+
+    def Clear(self):
+        self.opcodes = array("Q", bytes(8 * 0x100))
+        self.addresses = array("Q", bytes(8 * 0x10000))
+        return
+
+    def Blocks(self, RAM):
+        """ Returns list of the basic blocks of the executed instructions in memory RAM, the most executed instructions first """
+        blocks = []
+        block = None
+        next = None     # address after the last instruction of block
+        for address, count in enumerate(self.addresses):
+            if count == 0:
+                continue
+            op = OPCODES.get(RAM[address])
+            if block is not None and address == next and count == block.count:
+                block.addresses.append(address)
+            else:
+                block = Block([address], count)
+                blocks.append(block)
+            next = address + (op.length if op is not None else 1)
+            if op is None or op.kind != "op":
+                block = None
+        blocks.sort(key=lambda block: (-block.instructions, block.start))
+        return blocks
+
+    def Report(self, cpu, top=10):
+        """ Returns text of the report with the most executed opcodes and top blocks with their code from the memory of cpu """
+        total = len(self) or 1
+        lines = [f"instructions {len(self)}", "", f"{'opcode':<16}{'count':>12}{'%':>8}"]
+        for opcode in sorted(range(0x100), key=lambda opcode: -self.opcodes[opcode]):
+            count = self.opcodes[opcode]
+            if count == 0:
+                break
+            op = OPCODES.get(opcode)
+            name = f"{opcode:02X} {op.mnemonic} {op.mode}" if op is not None else f"{opcode:02X}"
+            lines.append(f"{name:<16}{count:>12}{100 * count / total:>7.1f}%")
+
+        for block in self.Blocks(cpu.RAM)[:top]:
+            lines += ["", f"block ${block.start:04X}-${block.end:04X}  executed {block.count} times  "
+                          f"{block.instructions} instructions  {100 * block.instructions / total:.1f}%"]
+            for address in block.addresses:
+                lines.append(f"    {address:04X}  {cpu.Encode(address)[0]}")
+        return "\n".join(lines)
+
+    def Folded(self, cpu, name="program"):
+        """ Returns lines of the blocks in the folded stack format (frames separated by ';' and the number of instructions)
+            for flame graph viewers
+        """
+        return [f"{name};${block.start:04X}-${block.end:04X} {cpu.Encode(block.start)[0]} {block.instructions}"
+                for block in self.Blocks(cpu.RAM)]
+
+    def JSON(self, cpu):
+        """ Returns the counts and the blocks as a dictionary for json """
+        opcodes = {}
+        for opcode, count in enumerate(self.opcodes):
+            if count:
+                op = OPCODES.get(opcode)
+                opcodes[f"{opcode:02X}" + (f" {op.mnemonic} {op.mode}" if op is not None else "")] = count
+        return {
+            "instructions": len(self),
+            "opcodes": opcodes,
+            "addresses": {f"{address:04X}": count for address, count in enumerate(self.addresses) if count},
+            "blocks": [{
+                "start": f"{block.start:04X}",
+                "end": f"{block.end:04X}",
+                "count": block.count,
+                "instructions": block.instructions,
+                "code": [cpu.Encode(address)[0] for address in block.addresses],
+            } for block in self.Blocks(cpu.RAM)],
+        }
+
+
+def main():
+    from ._6502_Emulator import CPU
+
+    parser = argparse.ArgumentParser(description="Runs a 6502 program with the profiler and prints the most executed code")
+    parser.add_argument("program", help="file with the program in assembly")
+    parser.add_argument("--top", type=int, default=10, help="number of blocks in the report")
+    parser.add_argument("--limit", type=int, help="maximum number of executed instructions")
+    parser.add_argument("--folded", help="file for the blocks in the folded stack format (flame graphs)")
+    parser.add_argument("--json", help="file for the counts and the blocks in JSON")
+    args = parser.parse_args()
+
+    cpu = CPU()
+    with open(args.program) as f:
+        cpu.LoadAssembly(f.read())
+    cpu.profiler = Profiler()
+    cpu.Run(args.limit)
+
+    print(cpu.profiler.Report(cpu, args.top))
+    if args.folded:
+        with open(args.folded, "w") as f:
+            f.write("\n".join(cpu.profiler.Folded(cpu)) + "\n")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(cpu.profiler.JSON(cpu), f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
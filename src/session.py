@@ -0,0 +1,111 @@
+"""
+Cooperative runs of many CPUs in one asyncio event loop.
+
+CPU.Run blocks until the program stops. Session.Run is the same run as a coroutine: it executes the program in slices
+of instructions and yields to the event loop between them, so thousands of sessions share one thread:
+
+    sessions = [Session(cpu) for cpu in cpus]
+    token = CancelToken()
+    results = await asyncio.gather(*(session.Run(1000000, token) for session in sessions))
+
+Every slice is sized to take the same time of the host whatever the engine and the program - QUANTUM seconds, or less
+when there are so many running sessions that a round of them would take more than LATENCY - so the sessions get fair
+shares of the time and the event loop stays responsive. The run stops for the same reasons as CPU.Run - 'limit'
+when its maxInstructions are used up - or with the reason 'cancelled' when its CancelToken is cancelled or its task is
+cancelled. Every reason has an asyncio.Event in 'stops', which is set when the run stops with it:
+
+    await session.stops["break"].wait()     # or await session.Wait("brk", "break")
+
+The devices block the event loop only when they read the standard input, so the sessions should give the input
+of CharacterInput as bytes (see bus.py).
+"""
+
+import asyncio
+import time
+
+from . import idle
+from ._6502_Emulator import RunResult
+
+QUANTUM = 0.002     # seconds of the host which a slice should take
+LATENCY = 0.02      # seconds of the host which one slice of every running session should take together
+MIN_SLICE = 100     # instructions of the first and the shortest slice
+MAX_SLICE = 1 << 20
+
+REASONS = ("brk", "halt", "limit", "break", "watch", "exit", "idle", "cancelled")
+
+
+class CancelToken():
+    """ Cancels the runs of all sessions which got it, they stop after their current slice """
+
+    def __init__(self):
+        self.cancelled = False
+
+    def Cancel(self):
+        self.cancelled = True
+
+
+class Session():
+    """ CPU running as a coroutine in slices of instructions """
+
+    active = 0      # number of sessions running at the moment
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.slice = MIN_SLICE      # instructions of the next slice, adapted to QUANTUM
+        self.stops = {reason: asyncio.Event() for reason in REASONS}
+        self.result = None          # RunResult of the last run, None while it runs
+        self.running = False
+
+    async def Run(self, maxInstructions=None, token=None):
+        """ Executes instructions from PC like CPU.Run, yielding to the event loop after every slice. Stops also when
+            the token is cancelled. Sets the event in 'stops' of the reason and returns RunResult of the whole run.
+        """
+        if self.running:
+            raise RuntimeError("the session is already running")
+        cpu = self.cpu
+        for event in self.stops.values():
+            event.clear()
+        self.result = None
+        self.running = True
+        Session.active += 1
+        instructions = cpu.instructions
+        cycles = cpu.cycles
+        seconds = 0.0
+        count = 0
+        checked = 0     # count, when idle.FastForward was called the last time
+        reason = "cancelled"
+        try:
+            while token is None or not token.cancelled:
+                start = time.perf_counter()
+                result = cpu.Run(self.slice if maxInstructions is None else min(self.slice, maxInstructions - count))
+                reason = result.reason
+                count = cpu.instructions - instructions
+                if reason == "limit" and count - checked >= idle.SLICE and count != maxInstructions and cpu.skipIdle and not cpu.Checking():
+                    # the slices are shorter than idle.SLICE, so Run doesn't look for idle loops between them
+                    checked = count
+                    reason = idle.FastForward(cpu, None if maxInstructions is None else maxInstructions - count)[1]
+                    count = cpu.instructions - instructions
+                elapsed = time.perf_counter() - start
+                seconds += elapsed
+                if reason != "limit" or count == maxInstructions:
+                    break
+                quantum = min(QUANTUM, LATENCY / Session.active)
+                self.slice = max(MIN_SLICE, min(MAX_SLICE, int(self.slice * min(2.0, quantum / elapsed if elapsed else 2.0))))
+                reason = "cancelled"
+                await asyncio.sleep(0)
+        finally:
+            self.running = False
+            Session.active -= 1
+            self.result = RunResult(cpu, cpu.instructions - instructions, reason, cpu.cycles - cycles, seconds)
+            self.stops[reason].set()
+        return self.result
+
+    async def Wait(self, *reasons):
+        """ Waits until the run stops with one of the reasons (with any if none are given). Returns its RunResult. """
+        waits = [asyncio.ensure_future(self.stops[reason].wait()) for reason in reasons or REASONS]
+        try:
+            await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for wait in waits:
+                wait.cancel()
+        return self.result
@@ -0,0 +1,84 @@
+"""
+Snapshots of the state of the CPU (CPU.Snapshot and CPU.Restore) and their file format.
+
+Memory of a snapshot is a list of 256 pages of 256 bytes. Pages are immutable bytes objects, so a snapshot taken after
+another one keeps the pages which were not written in between, and all CPUs restored from one snapshot share its pages.
+
+File of a snapshot is a header with the registers followed by the memory compressed by zlib: a bitmap of the pages
+which are not all zeros and the contents of these pages.
+"""
+
+import struct
+import zlib
+
+MAGIC = b"6502SNAP"
+VERSION = 1
+HEADER = struct.Struct("<8sHBBBBBHQQ")   # magic, version, A, X, Y, S, P, PC, instructions, cycles
+ZERO_PAGE = bytes(0x100)
+
+
+class Snapshot():
+    """ Memory (list of 256 pages) and registers of the CPU, with the numbers of instructions and cycles executed since Reset """
+
+    def __init__(self, pages, A=0, X=0, Y=0, S=0, P=0, PC=0, instructions=0, cycles=0):
+        self.pages = pages
+        self.A = A
+        self.X = X
+        self.Y = Y
+        self.S = S
+        self.P = P
+        self.PC = PC
+        self.instructions = instructions
+        self.cycles = cycles
+
+    def Memory(self):
+        """ Returns the whole memory as 64 KiB of bytes """
+        return b"".join(self.pages)
+
+    def __repr__(self):
+        return (f"Snapshot(A=${self.A:02X}, X=${self.X:02X}, Y=${self.Y:02X}, S=${self.S:02X}, P=${self.P:02X}, PC=${self.PC:04X}, "
+                f"instructions={self.instructions}, cycles={self.cycles})")
+
+
+def Save(snapshot, path):
+    """ Writes the snapshot into the file path """
+    used = bytearray(0x20)
+    data = []
+    for page, content in enumerate(snapshot.pages):
+        if content != ZERO_PAGE:
+            used[page >> 3] |= 1 << (page & 7)
+            data.append(content)
+
+    header = HEADER.pack(MAGIC, VERSION, snapshot.A, snapshot.X, snapshot.Y, snapshot.S, snapshot.P, snapshot.PC,
+                         snapshot.instructions, snapshot.cycles)
+    with open(path, "wb") as f:
+        f.write(header + zlib.compress(bytes(used) + b"".join(data)))
+    return
+
+
+def Load(path):
+    """ Reads the snapshot from the file path. Raises ValueError if the file is not a snapshot. """
+    with open(path, "rb") as f:
+        content = f.read()
+    if len(content) < HEADER.size or content[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a snapshot of the CPU")
+    magic, version, A, X, Y, S, P, PC, instructions, cycles = HEADER.unpack_from(content)
+    if version != VERSION:
+        raise ValueError(f"{path} has version {version} of snapshots, expected {VERSION}")
+
+    try:
+        memory = zlib.decompress(content[HEADER.size:])
+    except zlib.error as error:
+        raise ValueError(f"{path} is damaged: {error}") from None
+    used, data = memory[:0x20], memory[0x20:]
+    pages = []
+    offset = 0
+    for page in range(0x100):
+        if used[page >> 3] >> (page & 7) & 1:
+            pages.append(data[offset:offset + 0x100])
+            offset += 0x100
+        else:
+            pages.append(ZERO_PAGE)
+    if offset != len(data) or len(used) != 0x20:
+        raise ValueError(f"{path} is damaged: wrong size of the memory")
+    return Snapshot(pages, A, X, Y, S, P, PC, instructions, cycles)
@@ -0,0 +1,306 @@
+"""
+Tests of the engines - run by pytest from the directory of the project or src.
+
+Every program of the benchmarks (with the programs in the directory tests) runs in the interpreter without fusion, which
+is the reference, and in every other engine: the fused interpreter (with the loops of loops.py), the JIT, AOT and the
+lockstep engine. The registers, memory, the numbers of instructions and cycles and the reason of the stop have to be
+the same - also in the second run of the same program on the same CPU, and for idle loops (see idle.py). AOT has to keep
+its blocks when the same image is loaded again and its cache directory has to keep at most MAX_MODULES modules. The
+disassembler has to notice code changed by the program without a trap on its page. The checking interpreter has to run the
+programs like the reference with breakpoints, which are never hit, stop on watchpoints also on the reads of pointers and
+of the stack, and stop inside the groups and loops, which it executes at once otherwise.
+"""
+
+import functools
+import importlib.util
+import os
+import sys
+
+import pytest
+
+from . import aot
+from . import benchmark
+from ._6502_Emulator import CPU, TRAP_CODE
+from .benchmark import ReadTest
+
+ENGINES = ("interpreter", "jit", "aot")
+
+# programs, which never end - jmp to itself and polling of a location nobody writes
+IDLE = {
+    "jump": "loop: jmp loop\n",
+    "poll": "ldx #$00\nclear: sta $0200,X\ninx\nbne clear\nwait: lda $10\nbeq wait\n",
+}
+
+
+def Programs():
+    """ Returns the Benchmarks of benchmark.py and the programs in tests, which are not among them """
+    programs = benchmark.Programs()
+    names = {program.name for program in programs}
+    for name in sorted(os.listdir(benchmark.TESTS)):
+        if name.endswith(".txt") and name[:-4] not in names:
+            programs.append(benchmark.Benchmark(name[:-4], ReadTest(name[:-4]), lambda cpu, data: True))
+    return programs
+
+
+PROGRAMS = Programs()
+
+
+def State(cpu, result):
+    return (result.reason, result.instructions, result.cycles,
+            cpu.A, cpu.X, cpu.Y, cpu.P, cpu.S, cpu.PC, cpu.instructions, cpu.cycles, bytes(cpu.RAM))
+
+
+@functools.lru_cache(maxsize=None)
+def Reference(program, maxInstructions=None):
+    """ Runs the program in the interpreter without fusion, returns the state after the run """
+    cpu = CPU()
+    cpu.fusion = False
+    return Run(cpu, program, maxInstructions)
+
+
+def Run(cpu, program, maxInstructions=None):
+    cpu.Reset(clearMemory=True)
+    cpu.LoadAssembly(program.source)
+    for address, data in program.data.items():
+        cpu.Load(data, address)
+    return State(cpu, cpu.Run(maxInstructions))
+
+
+def Lockstep(program, maxInstructions=None):
+    """ Runs the program in two instances of the lockstep engine, returns the states of both """
+    pytest.importorskip("numpy")
+    from . import lockstep
+    engine = lockstep.Lockstep(2)
+    engine.LoadAssembly(program.source)
+    for address, data in program.data.items():
+        engine.Load(data, address)
+    counts, reasons = engine.Run(maxInstructions)
+    states = []
+    for index in range(2):
+        cpu = engine.Instance(index)
+        states.append((reasons[index], int(counts[index]), cpu.cycles,
+                       cpu.A, cpu.X, cpu.Y, cpu.P, cpu.S, cpu.PC, cpu.instructions, cpu.cycles, bytes(cpu.RAM)))
+    return states
+
+
+@pytest.mark.parametrize("program", PROGRAMS, ids=lambda program: program.name)
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_matches_reference(engine, program):
+    """ Runs the program twice on the same CPU, both runs have to end like the reference """
+    expected = Reference(program)
+    assert expected[0] == "brk"
+    cpu = CPU()
+    cpu.engine = engine
+    for run in range(2):
+        interpreted = Interpreted(cpu)
+        assert Run(cpu, program) == expected, f"run {run + 1}"
+        assert program.check(cpu, program.data)
+        if run and engine != "interpreter":
+            # the second run reuses the translated code, it isn't left to the interpreter
+            assert Interpreted(cpu) - interpreted < benchmark.MIN_TRANSLATED * expected[1]
+
+
+@pytest.mark.parametrize("program", PROGRAMS, ids=lambda program: program.name)
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_matches_reference_with_limit(engine, program):
+    """ A run stopped by the limit in the middle of the program and the run of the rest """
+    end = Reference(program)
+    limit = end[1] // 3 + 1
+    cpu = CPU()
+    cpu.engine = engine
+    assert Run(cpu, program, limit) == Reference(program, limit)
+    assert State(cpu, cpu.Run())[3:] == end[3:]
+
+
+@pytest.mark.parametrize("program", [program for program in PROGRAMS if Reference(program)[1] < 10000],
+                         ids=lambda program: program.name)
+def test_lockstep_matches_reference(program):
+    expected = Reference(program)
+    for state in Lockstep(program):
+        assert state == expected
+
+
+@pytest.mark.parametrize("name", IDLE)
+@pytest.mark.parametrize("engine", ENGINES + ("lockstep",))
+def test_idle_loop(engine, name):
+    """ Without a limit every engine stops in an idle loop with the reason 'idle', with a limit it runs up to it """
+    program = benchmark.Benchmark(name, IDLE[name], None)
+    # the lockstep engine has no fast-forward, stepping the limit would take long
+    for maxInstructions in (None,) if engine == "lockstep" else (None, 1000003):
+        expected = Reference(program, maxInstructions)
+        assert expected[0] == ("idle" if maxInstructions is None else "limit")
+        if engine == "lockstep":
+            states = Lockstep(program, maxInstructions)
+        else:
+            cpu = CPU()
+            cpu.engine = engine
+            states = [Run(cpu, program, maxInstructions)]
+        for state in states:
+            assert state == expected
+
+
+@pytest.mark.parametrize("program", PROGRAMS, ids=lambda program: program.name)
+@pytest.mark.parametrize("stop", ("break", "watch"))
+def test_checking_matches_reference(stop, program):
+    """ With a breakpoint or watchpoint, which is never hit, the checking interpreter ends like the reference """
+    cpu = CPU()
+    if stop == "break":
+        cpu.breakpoints.Break(0xFFF0)
+    else:
+        cpu.breakpoints.Watch(0xFFF0, read=True, write=True)
+    assert Run(cpu, program) == Reference(program)
+
+
+# programs reading the address only by a pointer or a pull from the stack (S starts at 0), a watchpoint on reading it stops them
+WATCHED = {
+    "ind,Y": ("lda #$34\nsta $10\nlda #$12\nsta $11\nldy #$01\nlda ($10),Y\nbrk\n", 0x0011),
+    "ind,X": ("lda #$34\nsta $11\nlda #$12\nsta $12\nldx #$01\nlda ($10,X)\nbrk\n", 0x0011),
+    "jmp ind": ("lda #<end\nsta $10\nlda #>end\nsta $11\njmp ($0010)\nend: brk\n", 0x0011),
+    "pla": ("lda #$05\npha\npla\nbrk\n", 0x0100),
+    "plp": ("php\nplp\nbrk\n", 0x0100),
+    "rts": ("jsr return\nbrk\nreturn: rts\n", 0x01FF),
+    "rti": ("lda #>end\npha\nlda #<end\npha\nphp\nrti\nend: brk\n", 0x01FE),
+}
+
+
+@pytest.mark.parametrize("name", WATCHED)
+def test_watchpoint_on_pointer_and_stack_reads(name):
+    source, address = WATCHED[name]
+    cpu = CPU()
+    cpu.LoadAssembly(source)
+    assert cpu.Run().reason == "brk"
+    cpu.Reset(clearMemory=True)
+    cpu.LoadAssembly(source)
+    cpu.breakpoints.Watch(address, read=True, write=False)
+    assert cpu.Run().reason == "watch"
+    assert cpu.breakpoints.hit == f"read ${address:04X}"
+
+
+def test_breakpoint_and_watchpoint_in_fused_code():
+    """ A stop on the second instruction of a group or in a loop, which the checking interpreter would execute at once """
+    cpu = CPU()
+    program = cpu.LoadAssembly("ldx #$05\nloop: dex\nbne loop\nldx #$00\nlda #$07\nfill: sta $0300,X\ninx\nbne fill\nbrk\n")
+    branch = program.symbols["loop"] + 1
+    cpu.breakpoints.Break(branch)
+    for count in range(5):
+        assert cpu.Run().reason == "break"
+        assert (cpu.PC, cpu.X) == (branch, 4 - count)
+    cpu.breakpoints.Delete()
+    cpu.breakpoints.Watch(0x0380)
+    assert cpu.Run().reason == "watch"
+    assert cpu.breakpoints.hit == "write $0380"
+    assert (cpu.RAM[0x037F], cpu.RAM[0x0380], cpu.RAM[0x0381]) == (7, 7, 0)
+
+
+# code at the end of memory, the last instruction or group runs over $FFFF
+END = {
+    "inx": "A2 05 E8",
+    "dex-bne": "A2 05 CA D0",
+    "txa-sec-sbc": "A2 05 8A 38 E9",
+    "lda-sta": "A2 05 A9 07 8D",
+}
+
+
+@pytest.mark.parametrize("name", END)
+@pytest.mark.parametrize("engine", ENGINES)
+def test_end_of_memory(engine, name):
+    """ Instructions up to $FFFF are executed one by one like in the reference, the run stops with 'halt' after them """
+    code = bytes.fromhex(END[name])
+    states = []
+    for engine, fusion in ((engine, True), ("interpreter", False)):
+        cpu = CPU()
+        cpu.engine = engine
+        cpu.fusion = fusion
+        cpu.Load(code, 0x10000 - len(code))
+        cpu.PC = 0x10000 - len(code)
+        states.append(State(cpu, cpu.Run(100)))
+    assert states[0] == states[1]
+    assert states[1][0] == "halt"
+
+
+def test_jit_keeps_blocks_after_loading_the_same_image():
+    """ Loading the program again removes its blocks, the next run has to put them back without translating them """
+    cpu = CPU()
+    cpu.engine = "jit"
+    source = ReadTest("bubbleSort")
+    for run in range(3):
+        cpu.Reset(clearMemory=True)
+        cpu.LoadAssembly(source)
+        assert cpu.Run().reason == "brk"
+        if run == 0:
+            translated = cpu.jit.misses
+    assert cpu.jit.misses == translated
+    # only the block with a changed instruction is translated again
+    cpu.Reset(clearMemory=True)
+    cpu.LoadAssembly(source.replace("start:  ldx #$00", "start:  ldx #$01"))
+    assert cpu.Run().reason == "brk"
+    assert cpu.jit.misses == translated + 1
+
+
+def test_aot_keeps_blocks_after_loading_the_same_image():
+    """ Loading the program again removes its blocks, the next run has to put them back from the module """
+    cpu = CPU()
+    cpu.engine = "aot"
+    source = ReadTest("bubbleSort")
+    blocks = None
+    for run in range(3):
+        cpu.Reset(clearMemory=True)
+        cpu.LoadAssembly(source)
+        assert cpu.Run().reason == "brk"
+        assert len(cpu.aot.blocks) > 0
+        assert blocks is None or len(cpu.aot.blocks) == blocks
+        blocks = len(cpu.aot.blocks)
+    assert cpu.aot.interpreted <= 3     # only the brk at the end of every run
+
+
+def test_aot_cache_keeps_max_modules(tmp_path, monkeypatch):
+    """ The least recently used modules over MAX_MODULES are removed from the cache directory with their bytecode """
+    monkeypatch.setattr(aot, "CACHE", str(tmp_path))
+    monkeypatch.setattr(aot, "MAX_MODULES", 3)
+    monkeypatch.setattr(aot, "modules", {})
+    monkeypatch.setattr(sys, "dont_write_bytecode", False)
+    paths = []
+    for value in range(6):
+        if value == 4:
+            # a use of the module from the directory makes it the most recently used one
+            aot.modules.clear()
+            aot.LoadModule(Image(1), {0x8000}, 0x8000)
+        paths.append(aot.LoadModule(Image(value), {0x8000}, 0x8000).__file__)
+        assert len(aot.modules) <= aot.MAX_MODULES
+    kept = [path for path in paths if os.path.exists(path)]
+    assert kept == [paths[1]] + paths[4:]
+    assert sorted(os.listdir(tmp_path)) == sorted([os.path.basename(path) for path in kept] + ["__pycache__"])
+    for path in paths:
+        assert os.path.exists(importlib.util.cache_from_source(path)) == (path in kept)
+
+
+def test_disassembler_sees_code_changed_by_the_program():
+    """ The decoded instructions are cached without the code trap, an instruction changed by the program is decoded again """
+    cpu = CPU()
+    cpu.LoadAssembly("lda #$E8\nsta patch\npatch: nop\nbrk\n")
+    patch = cpu.resetVector + 5
+    state = cpu.Snapshot()
+    assert cpu.Encode(patch) == ("nop", patch + 1)
+    assert cpu.Encode(patch) == ("nop", patch + 1)
+    assert cpu.disassembler.hits == 1
+    assert not cpu.pageTraps[patch >> 8] & TRAP_CODE
+    assert cpu.Run().reason == "brk"
+    assert cpu.Encode(patch) == ("inx", patch + 1)
+    cpu.Restore(state)
+    assert cpu.Encode(patch) == ("nop", patch + 1)
+    cpu.Load(bytes([0xA9, 0x07]), patch)
+    assert cpu.Encode(patch) == ("lda #$07", patch + 2)
+
+
+def Image(value):
+    """ Returns memory with the program lda #value, brk at $8000 """
+    RAM = bytearray(0x10000)
+    RAM[0x8000:0x8003] = bytes([0xA9, value, 0x00])
+    return RAM
+
+
+def Interpreted(cpu):
+    """ Returns the number of instructions, which the JIT or AOT of the cpu left to the interpreter """
+    translator = benchmark.Translator(cpu)
+    return translator.interpreted if translator is not None else 0
+
@@ -0,0 +1,71 @@
+"""
+Tests of the instruction set - run by pytest from the directory of the project or src.
+
+The functional test image tests/functional.asm traps on the address of a failed check, every engine has to run it through
+functional.RunTest to the success address. ADC and SBC are checked on their own in the binary and the decimal mode,
+with the carry in and out and the overflow, also in the groups clc, adc and sec, sbc, which the interpreter fuses.
+"""
+
+import os
+
+import pytest
+
+from . import functional
+from ._6502_Emulator import CPU
+from .benchmark import TESTS
+
+ENGINES = ("interpreter", "jit", "aot")
+
+# (decimal, carry, instruction, A, operand): (A, C, V) after it, V is None where it isn't checked (decimal mode)
+ARITHMETIC = {
+    (False, 0, "adc", 0x50, 0x50): (0xA0, 0, 1),
+    (False, 0, "adc", 0xFF, 0x01): (0x00, 1, 0),
+    (False, 1, "adc", 0x7F, 0x00): (0x80, 0, 1),
+    (False, 1, "adc", 0xFF, 0xFF): (0xFF, 1, 0),
+    (False, 1, "sbc", 0x50, 0x30): (0x20, 1, 0),
+    (False, 0, "sbc", 0x50, 0x30): (0x1F, 1, 0),
+    (False, 1, "sbc", 0x50, 0xF0): (0x60, 0, 0),
+    (False, 1, "sbc", 0x50, 0xB0): (0xA0, 0, 1),
+    (False, 1, "sbc", 0x80, 0x01): (0x7F, 1, 1),
+    (False, 1, "sbc", 0x00, 0x01): (0xFF, 0, 0),
+    (False, 0, "sbc", 0x00, 0x00): (0xFF, 0, 0),
+    (True, 0, "adc", 0x15, 0x27): (0x42, 0, None),
+    (True, 0, "adc", 0x81, 0x92): (0x73, 1, None),
+    (True, 1, "adc", 0x58, 0x46): (0x05, 1, None),
+    (True, 0, "adc", 0x99, 0x01): (0x00, 1, None),
+    (True, 1, "adc", 0x09, 0x00): (0x10, 0, None),
+    (True, 1, "sbc", 0x46, 0x12): (0x34, 1, None),
+    (True, 1, "sbc", 0x40, 0x13): (0x27, 1, None),
+    (True, 0, "sbc", 0x32, 0x02): (0x29, 1, None),
+    (True, 1, "sbc", 0x12, 0x21): (0x91, 0, None),
+    (True, 0, "sbc", 0x00, 0x00): (0x99, 0, None),
+}
+
+
+@pytest.mark.parametrize("engine, fusion", [("interpreter", False)] + [(engine, True) for engine in ENGINES])
+def test_functional_image(engine, fusion):
+    cpu = CPU()
+    cpu.engine = engine
+    cpu.fusion = fusion
+    cpu.resetVector = 0x0400
+    with open(os.path.join(TESTS, "functional.asm")) as f:
+        program = cpu.LoadAssembly(f.read())
+    cpu.PC = program.symbols["start"]
+    result = functional.RunTest(cpu, program.symbols["success"], budget=60, slice=10000)
+    assert (result.reason, result.address) == ("passed", program.symbols["success"])
+
+
+@pytest.mark.parametrize("case", ARITHMETIC, ids=lambda case: f"{'decimal' if case[0] else 'binary'}-C{case[1]}-"
+                                                             f"{case[3]:02X}-{case[2]}-{case[4]:02X}")
+@pytest.mark.parametrize("fusion", (True, False))
+def test_adc_sbc(fusion, case):
+    decimal, carry, mnemonic, A, operand = case
+    expected, C, V = ARITHMETIC[case]
+    cpu = CPU()
+    cpu.fusion = fusion
+    cpu.LoadAssembly(f"{'sed' if decimal else 'cld'}\nlda #${A:02X}\n{'sec' if carry else 'clc'}\n"
+                     f"{mnemonic} #${operand:02X}\nbrk\n")
+    assert cpu.Run().reason == "brk"
+    assert (cpu.A, cpu.P & 0x01) == (expected, C)
+    if V is not None:
+        assert cpu.P >> 6 & 1 == V
@@ -0,0 +1,240 @@
+; functional test of the instruction set in the style of the 6502 functional test by Klaus Dormann
+; a failed check branches or jumps to itself (traps) on its address, when all checks pass the test traps on success
+; run by test_functional.py through functional.RunTest from start ($0400)
+
+.org $FFFE
+.word interrupt
+
+.org $0400
+start:  cld
+        ldx #$FF
+        txs
+
+; ---- loads, stores and address modes ----
+        lda #$55
+        sta $10
+        ldx $10
+        cpx #$55
+        bne *
+        ldy #$AA
+        sty $11
+        lda $11
+        cmp #$AA
+        bne *
+        ldx #$02
+        lda #$77
+        sta $FF,X           ; zp,X wraps around to $01
+        lda $01
+        cmp #$77
+        bne *
+        ldy #$10
+        lda #$33
+        sta $0200,Y
+        lda $0210
+        cmp #$33
+        bne *
+        lda #$10
+        sta $20
+        lda #$02
+        sta $21             ; pointer at $20 to $0210
+        ldx #$04
+        lda ($1C,X)
+        cmp #$33
+        bne *
+        ldy #$01
+        lda #$44
+        sta ($20),Y         ; $0211
+        lda $0211
+        cmp #$44
+        bne *
+        lda #<indirect
+        sta $02FF
+        lda #>indirect
+        sta $0200
+        jmp ($02FF)         ; the high byte of the pointer on the end of a page is read from the start of the page
+        jmp *
+indirect:
+
+; ---- stack ----
+        lda #$12
+        pha
+        lda #$34
+        pha
+        lda #$00
+        pla
+        cmp #$34
+        bne *
+        pla
+        cmp #$12
+        bne *
+        tsx
+        cpx #$FF
+        bne *
+        lda #$FF
+        pha
+        plp                 ; all flags set
+        php
+        pla
+        cmp #$FF
+        bne *
+        lda #$00
+        pha
+        plp                 ; all flags clear
+        php
+        pla
+        cmp #$30            ; B and the unused bit are pushed set
+        bne *
+        ldx #$00
+        jsr increment
+        jsr increment
+        cpx #$02
+        bne *
+
+; ---- adc and sbc in binary mode ----
+        clc
+        lda #$50
+        adc #$50
+        bvc *               ; positive + positive = negative
+        bcs *
+        cmp #$A0
+        bne *
+        sec
+        lda #$FF
+        adc #$00
+        bcc *
+        bne *
+        sec
+        lda #$50
+        sbc #$F0
+        bcs *               ; the carry is clear after a borrow
+        bvs *
+        cmp #$60
+        bne *
+        sec
+        lda #$50
+        sbc #$B0
+        bcs *
+        bvc *               ; positive - negative = negative
+        cmp #$A0
+        bne *
+        clc
+        lda #$50
+        sbc #$30            ; the clear carry subtracts one more
+        bcc *
+        cmp #$1F
+        bne *
+
+; ---- adc and sbc in decimal mode ----
+        sed
+        clc
+        lda #$58
+        adc #$46            ; 58 + 46 = 104
+        bcc *
+        cmp #$04
+        bne *
+        sec
+        lda #$99
+        adc #$00            ; 99 + 0 + 1 = 100
+        bcc *
+        cmp #$00
+        bne *
+        sec
+        lda #$12
+        sbc #$21            ; 12 - 21 = 91 with a borrow
+        bcs *
+        cmp #$91
+        bne *
+        clc
+        lda #$32
+        sbc #$02            ; 32 - 2 - 1 = 29
+        bcc *
+        cmp #$29
+        bne *
+        cld
+
+; ---- compare and bit ----
+        lda #$40
+        cmp #$41
+        bcs *
+        beq *
+        bpl *
+        ldx #$80
+        cpx #$80
+        bne *
+        bcc *
+        ldy #$01
+        cpy #$00
+        bcc *
+        beq *
+        lda #$C0
+        sta $12
+        lda #$01
+        bit $12
+        bpl *               ; N is bit 7 of memory
+        bvc *               ; V is bit 6 of memory
+        bne *               ; Z from A and memory
+
+; ---- shifts, rotations, increments and logic ----
+        lda #$81
+        asl A
+        bcc *
+        cmp #$02
+        bne *
+        lsr A
+        bcs *
+        cmp #$01
+        bne *
+        sec
+        ror A
+        bcc *
+        cmp #$80
+        bne *
+        clc
+        rol A
+        bcc *
+        bne *
+        lda #$40
+        sta $13
+        asl $13
+        lda $13
+        cmp #$80
+        bne *
+        lda #$FF
+        sta $14
+        inc $14
+        bne *
+        dec $14
+        dec $14
+        lda $14
+        cmp #$FE
+        bne *
+        lda #$F0
+        and #$3C
+        ora #$01
+        eor #$FF
+        cmp #$CE
+        bne *
+        lda #$5A
+        tax
+        tay
+        cpx #$5A
+        bne *
+        cpy #$5A
+        bne *
+
+; ---- brk and rti ----
+        ldx #$00
+        brk
+        .byte $00           ; rti returns after the byte following brk
+        cpx #$01
+        bne *
+
+success: jmp success
+
+increment:
+        inx
+        rts
+
+interrupt:
+        inx
+        rti
@@ -0,0 +1,149 @@
+"""
+Trace of the executed instructions.
+
+When cpu.tracer is a Tracer, the CPU runs the tracing interpreter (interpreter.InterpretTraced), which after every instruction
+packs a record of a fixed size into the preallocated buffer of the tracer: PC, opcode and operand bytes of the instruction,
+registers A, X, Y, P, S after it and the address and the value of memory it read or wrote. The buffer is a ring - when it is full
+it is written into the file of the tracer (if it has one) and filled again from the start, so the memory stays the same
+however long the program runs.
+
+A trace file is a header followed by the records. Log decodes it into text with the instructions disassembled by CPU.Encode:
+
+    python tracer.py record tests/bubbleSort.txt trace.bin
+    python tracer.py decode trace.bin --output trace.txt
+"""
+
+import argparse
+import struct
+import sys
+
+MAGIC = b"6502TRAC"
+VERSION = 2
+HEADER = struct.Struct("<8sHHQ")            # magic, version, size of a record, number of the first record
+RECORD = struct.Struct("<HBBBBBBBHHBB")     # PC, opcode, 2 operand bytes, A, X, Y, P, S, address, value, flags
+READ = 0x01                                 # bit in flags - the instruction read the address
+WRITE = 0x02                                # bit in flags - the instruction wrote the address
+
+
+class Tracer():
+    """ Ring buffer for the last records records of the executed instructions, which are also streamed into the file path if it is given """
+
+    def __init__(self, records=0x10000, path=None):
+        self.buffer = bytearray(records * RECORD.size)
+        self.offset = 0         # offset of the next record in the buffer
+        self.filled = 0         # number of times the buffer was full
+        self.file = None
+        if path is not None:
+            self.file = open(path, "wb")
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0))
+
+    def __len__(self):
+        """ Number of all records since the start """
+        return (self.filled * len(self.buffer) + self.offset) // RECORD.size
+
+    def Flush(self):
+        """ Called by the interpreter when the buffer is full. Writes it into the file and returns the offset of the next record. """
+        if self.file is not None:
+            self.file.write(self.buffer)
+        self.filled += 1
+        return 0
+
+    def Records(self):
+        """ Returns the records in the buffer (the last ones) from the oldest as bytes """
+        if self.filled:
+            return self.buffer[self.offset:] + self.buffer[:self.offset]
+        return bytes(self.buffer[:self.offset])
+
+    def Save(self, path):
+        """ Writes the records in the buffer into the file path """
+        records = self.Records()
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, len(self) - len(records) // RECORD.size))
+            f.write(records)
+        return
+
+    def Close(self):
+        """ Writes the rest of the records into the file and closes it """
+        if self.file is not None:
+            self.file.write(self.buffer[:self.offset])
+            self.file.close()
+            self.file = None
+        return
+
+
+# ---- DECODER ----
+
+def Read(path):
+    """ Yields number and the record of every record in the trace file path - tuple (PC, opcode, low and high operand byte,
+        A, X, Y, P, S, address, value, flags). Raises ValueError if the file is not a trace.
+    """
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a trace")
+        magic, version, size, first = HEADER.unpack(header)
+        if version != VERSION or size != RECORD.size:
+            raise ValueError(f"{path} has version {version} of traces, expected {VERSION}")
+        number = first
+        while True:
+            chunk = f.read(RECORD.size * 0x1000)
+            for record in RECORD.iter_unpack(chunk[:len(chunk) - len(chunk) % RECORD.size]):
+                yield number, record
+                number += 1
+            if len(chunk) < RECORD.size * 0x1000:
+                return
+
+
+def Log(records):
+    """ Yields lines of text of the records (from Read) with the instructions disassembled by CPU.Encode """
+    from ._6502_Emulator import CPU
+
+    cpu = CPU()
+    for number, (PC, opcode, low, high, A, X, Y, P, S, address, value, flags) in records:
+        code = bytes((opcode, low, high))[:0x10000 - PC]
+        if cpu.RAM[PC:PC + len(code)] != code:
+            cpu.Load(code, PC)
+        ins_s, next = cpu.Encode(PC)
+        data = " ".join(f"{byte:02X}" for byte in code[:(next - PC) & 0xFFFF])
+        line = f"{number:>10}  {PC:04X}  {data:<9}{ins_s:<16}A:{A:02X} X:{X:02X} Y:{Y:02X} P:{P:02X} S:{S:02X}"
+        if flags:
+            line += f"  {'R' if flags & READ else ''}{'W' if flags & WRITE else ''} ${address:04X}={value:02X}"
+        yield line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Records and decodes traces of 6502 programs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="runs a program with the tracer and writes the trace")
+    record.add_argument("program", help="file with the program in assembly")
+    record.add_argument("trace", help="file for the trace")
+    record.add_argument("--records", type=int, default=0x10000, help="size of the ring buffer in records")
+    record.add_argument("--last", action="store_true", help="write only the last records in the buffer, not the whole run")
+    record.add_argument("--limit", type=int, help="maximum number of executed instructions")
+    decode = commands.add_parser("decode", help="writes a trace as text")
+    decode.add_argument("trace", help="file with the trace")
+    decode.add_argument("--output", default="-", help="file for the text (standard output if not given)")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        from ._6502_Emulator import CPU
+
+        cpu = CPU()
+        with open(args.program) as f:
+            cpu.LoadAssembly(f.read())
+        cpu.tracer = Tracer(args.records, None if args.last else args.trace)
+        result = cpu.Run(args.limit)
+        if args.last:
+            cpu.tracer.Save(args.trace)
+        cpu.tracer.Close()
+        print(f"{result.reason} after {result.instructions} instructions, {len(cpu.tracer)} records", file=sys.stderr)
+    else:
+        output = sys.stdout if args.output == "-" else open(args.output, "w")
+        with output:
+            for line in Log(Read(args.trace)):
+                output.write(line + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())